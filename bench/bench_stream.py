@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+"""Throughput benchmarks for the stream readers and dataset functions.
+
+Synthetic das2.2 and das3 streams of a chosen size, rank and encoding are
+generated with fixed random seeds so that runs on different releases read
+exactly the same bytes.  Each benchmark is run a few times and the best and
+median times are reported as JSON, for example:
+
+	python bench/bench_stream.py -o new.json
+	python bench/bench_stream.py -o new.json --baseline old.json
+
+With --baseline the program exits with status 1 if any benchmark's best time
+is slower than the baseline by more than the tolerance.
+"""
+
+import sys
+import os
+import os.path
+import argparse
+import json
+import platform
+import tempfile
+import time
+from io import BytesIO
+
+import numpy
+
+import _das2
+import das2
+from das2 import pkt
+
+# Records start at this time and advance by one second
+g_nT0us2000 = 631152000000000   # 2020-01-01T00:00:00 in us2000
+
+g_lVersions = ('2.2', '3.0')
+g_lEncodings = ('binary', 'ascii', 'utf8')
+
+def perr(sOut):
+	sys.stderr.write(sOut)
+	sys.stderr.write('\n')
+
+# ########################################################################### #
+# Stream generation
+
+def _das2Hdr(nItems, sEnc):
+	"""Get a das2.2 packet header for one time column and nItems amplitudes"""
+	if sEnc == 'binary':
+		(sTime, sTimeUnits, sAmp) = ('little_endian_real8', 'us2000', 'little_endian_real4')
+	else:
+		(sTime, sTimeUnits, sAmp) = ('time24', 'UTC', 'ascii11')
+
+	sX = '<x type="%s" units="%s"></x>'%(sTime, sTimeUnits)
+	if nItems == 1:
+		sY = '<y name="amplitude" type="%s" units="V"></y>'%sAmp
+	else:
+		sY = '<yscan name="amplitude" type="%s" zUnits="V" yUnits="Hz" '%sAmp +\
+			'nitems="%d" yTagMin="10.0" yTagInterval="10.0"></yscan>'%nItems
+	return '<packet>\n  %s\n  %s\n</packet>\n'%(sX, sY)
+
+def _das3Hdr(nItems, sEnc):
+	"""Get a das3 dataset header for one time column and nItems amplitudes"""
+	if sEnc == 'binary':
+		sTime = '<scalar use="center" units="us2000" valType="real">\n' +\
+			'      <packet numItems="1" itemBytes="8" encoding="LEreal"/>'
+		sAmp = 'itemBytes="4" encoding="LEreal"'
+	else:
+		sTime = '<scalar use="center" units="UTC" valType="datetime">\n' +\
+			'      <packet numItems="1" itemBytes="24" encoding="utf8"/>'
+		if sEnc == 'ascii': sAmp = 'itemBytes="11" encoding="utf8"'
+		else: sAmp = 'itemBytes="*" valTerm=";" encoding="utf8"'
+
+	sJSize = ''
+	sYCoord = ''
+	if nItems > 1:
+		sJSize = ' jSize="%d"'%nItems
+		sYCoord = '''  <yCoord physDim="frequency">
+    <scalar use="center" units="Hz" valType="real"%s>
+      <sequence minval="10.0" interval="10.0"/>
+    </scalar>
+  </yCoord>
+'''%sJSize
+
+	return '''<dataset name="bench" rank="%d"%s>
+  <xCoord physDim="time">
+    %s
+    </scalar>
+  </xCoord>
+%s  <data physDim="amplitude">
+    <scalar use="center" units="V" valType="real"%s>
+      <packet numItems="%d" %s/>
+    </scalar>
+  </data>
+</dataset>
+'''%(2 if nItems > 1 else 1, sJSize, sTime, sYCoord, sJSize, nItems, sAmp)
+
+def _times(aUs2000):
+	"""Format us2000 times as 24 byte ISO strings"""
+	aTime = (aUs2000 - g_nT0us2000).astype('m8[us]') + numpy.datetime64('2020-01-01', 'us')
+	return [('%s '%str(t)[:23]).encode('ascii') for t in aTime.astype('M8[ms]')]
+
+def _records(aTime, aAmp, sEnc):
+	"""Get the payload bytes of each record"""
+	if sEnc == 'binary':
+		aRec = numpy.zeros(len(aTime), dtype=[
+			('time', '<f8'), ('amp', '<f4', aAmp.shape[1:])
+		])
+		aRec['time'] = aTime
+		aRec['amp'] = aAmp
+		return [x.tobytes() for x in aRec]
+
+	lTime = _times(aTime)
+	lOut = []
+	for i in range(len(aTime)):
+		if sEnc == 'ascii':
+			lVals = ['%10.3e '%r for r in aAmp[i].ravel()]
+			lVals[-1] = lVals[-1][:-1] + '\n'
+		else:
+			lVals = ['%.4g;'%r for r in aAmp[i].ravel()]
+		lOut.append(lTime[i] + ''.join(lVals).encode('ascii'))
+	return lOut
+
+def genStream(
+	fOut, sVersion='2.2', nRecs=10000, nItems=1, sEnc='binary', nSeed=1,
+	bShuffle=False, nFirst=0
+):
+	"""Write a synthetic stream with one record per data packet
+
+	Args:
+		fOut (file-like) - A binary output
+
+		sVersion (str) - Either '2.2' or '3.0'
+
+		nRecs (int) - The number of records
+
+		nItems (int) - Amplitudes per record, more than 1 makes a rank 2
+			time/frequency dataset.
+
+		sEnc (str) - One of 'binary', 'ascii' (fixed width text) or 'utf8'
+			(variable width text, das3 only)
+
+		nSeed (int) - Seed for the amplitude values and the shuffle order
+
+		bShuffle (bool) - Write the records out of time order
+
+		nFirst (int) - The index of the first record's time step, used to
+			make consecutive pieces of the same timeline.
+
+	Returns (int): The number of bytes written
+	"""
+	if sVersion not in g_lVersions:
+		raise ValueError("Unknown stream version '%s'"%sVersion)
+	if sEnc not in g_lEncodings:
+		raise ValueError("Unknown encoding '%s'"%sEnc)
+	if sEnc == 'utf8' and sVersion == '2.2':
+		raise ValueError("das2.2 streams have no variable width encoding")
+
+	rng = numpy.random.default_rng(nSeed)
+	aAmp = rng.standard_normal((nRecs, nItems)).astype('f4')
+	aTime = (g_nT0us2000 + (numpy.arange(nRecs) + nFirst)*1000000).astype('f8')
+	if bShuffle: aTime = aTime[rng.permutation(nRecs)]
+
+	lRecs = _records(aTime, aAmp if nItems > 1 else aAmp[:,0], sEnc)
+
+	fBuf = BytesIO()
+	if sVersion == '2.2':
+		hdr = pkt.HdrBuf(0)
+		hdr.add('<stream version="2.2">\n  <properties String:title="Benchmark"/>\n</stream>\n')
+		hdr.send(fBuf)
+		hdr = pkt.HdrBuf(1)
+		hdr.add(_das2Hdr(nItems, sEnc))
+		hdr.send(fBuf)
+
+		data = pkt.PktBuf(1)
+		for xRec in lRecs:
+			data.add(xRec)
+			data.send(fBuf, bFlush=False)
+	else:
+		hdr = pkt.HdrBuf(0, 'das3')
+		hdr.add('<stream type="das-basic-stream" version="3.0">\n' +\
+			'  <properties><p name="title">Benchmark</p></properties>\n</stream>\n')
+		hdr.send(fBuf)
+		hdr = pkt.HdrBuf(1, 'das3')
+		hdr.add(_das3Hdr(nItems, sEnc))
+		hdr.send(fBuf)
+
+		data = pkt.PktArrayBuf(1, 'das3')
+		data.addVarRecords(lRecs)
+		data.send(fBuf)
+
+	xOut = fBuf.getvalue()
+	fOut.write(xOut)
+	return len(xOut)
+
+# ########################################################################### #
+# Timing
+
+def timeRuns(fRun, nRepeat, fSetup=None):
+	"""Run a function a number of times, untimed setup is run before each
+
+	Returns (tuple): (list of run times in seconds, last return value)
+	"""
+	lSec = []
+	ret = None
+	for i in range(nRepeat):
+		arg = fSetup() if fSetup else None
+		t0 = time.perf_counter()
+		ret = fRun(arg)
+		lSec.append(time.perf_counter() - t0)
+	return (lSec, ret)
+
+def result(sName, dCase, nBytes, nRecs, lSec=None, sStatus='ok', sMsg=None):
+	dOut = {'name':sName, 'case':dCase, 'status':sStatus}
+	if sMsg: dOut['message'] = sMsg
+	if lSec:
+		rBest = min(lSec)
+		dOut.update({
+			'bytes':nBytes, 'records':nRecs, 'runs':lSec, 'best_s':rBest,
+			'median_s':float(numpy.median(lSec)),
+			'mb_per_s':(nBytes/1048576.0)/rBest if rBest > 0 else None,
+			'rec_per_s':nRecs/rBest if rBest > 0 else None
+		})
+	return dOut
+
+def caseKey(dRes):
+	d = dRes['case']
+	lKey = [dRes['name'], d['encoding'], 'v' + d['version']]
+	if d.get('shuffled'): lKey.append('shuffled')
+	lKey += ['rank%d'%d['rank'], 'n%d'%d['records']]
+	return ' '.join(lKey)
+
+def readPackets(xStream):
+	nPkts = 0
+	for p in das2.PacketReader(BytesIO(xStream)): nPkts += 1
+	return nPkts
+
+def benchCase(sVersion, sEnc, nItems, nRecs, nRepeat, nSeed, sTmpDir):
+	"""Run all benchmarks on one stream layout
+
+	Returns (list): Result dictionaries
+	"""
+	dCase = {
+		'version':sVersion, 'encoding':sEnc, 'rank':2 if nItems > 1 else 1,
+		'items':nItems, 'records':nRecs, 'seed':nSeed
+	}
+	lOut = []
+
+	fBuf = BytesIO()
+	nBytes = genStream(fBuf, sVersion, nRecs, nItems, sEnc, nSeed)
+	xStream = fBuf.getvalue()
+
+	# Pure python readers
+	(lSec, nPkts) = timeRuns(lambda a: readPackets(xStream), nRepeat)
+	if nPkts != nRecs + 2:
+		lOut.append(result('PacketReader', dCase, nBytes, nRecs, sStatus='error',
+			sMsg='Read %d packets, expected %d'%(nPkts, nRecs + 2)))
+	else:
+		lOut.append(result('PacketReader', dCase, nBytes, nRecs, lSec))
+
+	(lSec, lDs) = timeRuns(lambda a: das2.read_stream(BytesIO(xStream)), nRepeat)
+	if lDs[0].shape[0] != nRecs:
+		lOut.append(result('read_stream', dCase, nBytes, nRecs, sStatus='error',
+			sMsg='Read %d records, expected %d'%(lDs[0].shape[0], nRecs)))
+	else:
+		lOut.append(result('read_stream', dCase, nBytes, nRecs, lSec))
+
+	# libdas2 reader and conversion of it's output
+	sFile = os.path.join(sTmpDir, 'bench.d%s'%('2s' if sVersion == '2.2' else '3b'))
+	with open(sFile, 'wb') as fOut: fOut.write(xStream)
+
+	if not hasattr(_das2, 'read_file'):
+		lOut.append(result('_das2.read_file', dCase, nBytes, nRecs, sStatus='skipped',
+			sMsg='_das2 has no read_file'))
+		lOut.append(result('ds_from_raw', dCase, nBytes, nRecs, sStatus='skipped',
+			sMsg='_das2 has no read_file'))
+	else:
+		try:
+			(lSec, lRaw) = timeRuns(lambda a: _das2.read_file(sFile), nRepeat)
+			lOut.append(result('_das2.read_file', dCase, nBytes, nRecs, lSec))
+
+			(lSec, lDs) = timeRuns(lambda a: [das2.ds_from_raw(d) for d in lRaw], nRepeat)
+			lOut.append(result('ds_from_raw', dCase, nBytes, nRecs, lSec))
+		except Exception as e:
+			lOut.append(result('_das2.read_file', dCase, nBytes, nRecs,
+				sStatus='error', sMsg=str(e)))
+
+	# Dataset functions, on records read out of time order
+	dShuf = dict(dCase, shuffled=True)
+	fBuf = BytesIO()
+	genStream(fBuf, sVersion, nRecs, nItems, sEnc, nSeed, bShuffle=True)
+	xShuffled = fBuf.getvalue()
+
+	def sort(ds): ds.sort('coords:time:center')
+	try:
+		(lSec, ret) = timeRuns(
+			sort, nRepeat, lambda: das2.read_stream(BytesIO(xShuffled))[0]
+		)
+		lOut.append(result('Dataset.sort', dShuf, nBytes, nRecs, lSec))
+	except Exception as e:
+		lOut.append(result('Dataset.sort', dShuf, nBytes, nRecs,
+			sStatus='error', sMsg='%s: %s'%(type(e).__name__, str(e))))
+
+	# Four consecutive pieces of the same timeline
+	lPieces = []
+	nPiece = max(nRecs//4, 1)
+	for i in range(4):
+		fBuf = BytesIO()
+		genStream(fBuf, sVersion, nPiece, nItems, sEnc, nSeed + i, nFirst=i*nPiece)
+		lPieces.append(das2.read_stream(BytesIO(fBuf.getvalue()))[0])
+	try:
+		(lSec, ds) = timeRuns(lambda a: das2.ds_union(lPieces), nRepeat)
+		lOut.append(result('ds_union', dCase, nBytes, nPiece*4, lSec))
+	except Exception as e:
+		lOut.append(result('ds_union', dCase, nBytes, nPiece*4,
+			sStatus='error', sMsg='%s: %s'%(type(e).__name__, str(e))))
+
+	return lOut
+
+# ########################################################################### #
+
+def compare(lResults, sBaseline, rTolerance):
+	"""Check results against a previous run
+
+	Returns (list): Descriptions of benchmarks that are slower than the
+		baseline by more than rTolerance
+	"""
+	with open(sBaseline) as fIn:
+		dBase = dict((caseKey(d), d) for d in json.load(fIn)['results'])
+
+	lSlow = []
+	for dRes in lResults:
+		dOld = dBase.get(caseKey(dRes), None)
+		if dRes['status'] != 'ok' or dOld is None or dOld['status'] != 'ok':
+			continue
+		rRatio = dRes['best_s'] / dOld['best_s']
+		dRes['baseline_ratio'] = rRatio
+		if rRatio > 1.0 + rTolerance:
+			lSlow.append('%s: %.3f s, baseline %.3f s (%+.0f%%)'%(
+				caseKey(dRes), dRes['best_s'], dOld['best_s'], (rRatio - 1.0)*100
+			))
+	return lSlow
+
+def main(argv):
+
+	psr = argparse.ArgumentParser(
+		description="Time the das2 stream readers, dataset builders and "+\
+		"dataset functions on generated streams and write the results as JSON."
+	)
+
+	psr.add_argument(
+		'-n', '--records', type=int, default=20000, dest='nRecs', metavar='N',
+		help="Records in each generated stream, default is %(default)s"
+	)
+	psr.add_argument(
+		'-i', '--items', type=int, default=64, dest='nItems', metavar='N',
+		help="Values per record in rank 2 streams, default is %(default)s"
+	)
+	psr.add_argument(
+		'-r', '--repeat', type=int, default=3, dest='nRepeat', metavar='N',
+		help="Number of times to run each benchmark, default is %(default)s"
+	)
+	psr.add_argument(
+		'-s', '--seed', type=int, default=1, dest='nSeed', metavar='N',
+		help="Random number seed for the generated data, default is %(default)s"
+	)
+	psr.add_argument(
+		'-v', '--version', action='append', choices=g_lVersions, dest='lVersions',
+		help="Only generate streams of this version, may be given more than once"
+	)
+	psr.add_argument(
+		'-e', '--encoding', action='append', choices=g_lEncodings, dest='lEncodings',
+		help="Only generate streams with this encoding, may be given more than once"
+	)
+	psr.add_argument(
+		'--rank', type=int, action='append', choices=(1, 2), dest='lRanks',
+		help="Only generate datasets of this rank, may be given more than once"
+	)
+	psr.add_argument(
+		'-o', '--output', default=None, dest='sOut', metavar='file',
+		help="Write JSON results to FILE instead of standard output"
+	)
+	psr.add_argument(
+		'-b', '--baseline', default=None, dest='sBaseline', metavar='file',
+		help="Compare against results from a previous run"
+	)
+	psr.add_argument(
+		'-t', '--tolerance', type=float, default=0.2, dest='rTolerance',
+		help="Allowed slow down relative to the baseline, default is %(default)s"
+	)
+
+	opts = psr.parse_args(argv[1:])
+
+	lResults = []
+	with tempfile.TemporaryDirectory() as sTmpDir:
+		for sVersion in (opts.lVersions or g_lVersions):
+			for sEnc in (opts.lEncodings or g_lEncodings):
+				if sEnc == 'utf8' and sVersion == '2.2': continue
+				for nRank in (opts.lRanks or (1, 2)):
+					nItems = opts.nItems if nRank == 2 else 1
+					perr("Running v%s %s rank %d ..."%(sVersion, sEnc, nRank))
+					lResults += benchCase(
+						sVersion, sEnc, nItems, opts.nRecs, opts.nRepeat, opts.nSeed,
+						sTmpDir
+					)
+
+	for dRes in lResults:
+		if dRes['status'] == 'ok':
+			perr("  %-52s %9.4f s %9.1f MB/s"%(caseKey(dRes), dRes['best_s'], dRes['mb_per_s']))
+		else:
+			perr("  %-52s %s: %s"%(caseKey(dRes), dRes['status'], dRes.get('message', '')))
+
+	lSlow = []
+	if opts.sBaseline:
+		lSlow = compare(lResults, opts.sBaseline, opts.rTolerance)
+		for sSlow in lSlow: perr("SLOWER %s"%sSlow)
+
+	dOut = {
+		'das2':das2.__version__,
+		'python':platform.python_version(),
+		'numpy':numpy.__version__,
+		'platform':platform.platform(),
+		'machine':platform.machine(),
+		'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'results':lResults
+	}
+	sOut = json.dumps(dOut, indent=1)
+	if opts.sOut:
+		with open(opts.sOut, 'w') as fOut: fOut.write(sOut)
+	else:
+		sys.stdout.write(sOut)
+		sys.stdout.write('\n')
+
+	return 1 if lSlow else 0
+
+# ########################################################################### #
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
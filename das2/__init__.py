@@ -38,6 +38,9 @@ from das2.dataset   import *
 from das2.auth      import *
 from das2.util      import *
 from das2.reader    import *
+from das2.builder   import *
+from das2.index     import *
+from das2.writer    import *
 
 # Pull up a function or two from the C module:
 from _das2 import convert
@@ -83,11 +86,24 @@ def read_cmd(sCmd):
 
 
 
-def read_file(sFileName):
+def read_file(sFileName, time=None, ids=None, vars=None):
 	"""Read datasets from a file
 
 	Args:
-		sFileName (str) : the name of the file to read
+		sFileName (str) : the name of the file to read.  Gzip, bz2 and xz
+			compressed files are decompressed as they are read.
+
+		time (tuple, optional) : A (begin, end) time range.  If given, the
+			file is read by the pure python reader and only data packets that
+			overlap the range are decoded.  The sidecar index written by
+			das2.write_index() or the das_index program is used if it's
+			up to date, otherwise the file is scanned first.
+
+		ids (set, optional) : Only read packets with these IDs, the content
+			of other data packets is skipped.
+
+		vars (set, optional) : Only decode these data dimensions, by name.
+			Coordinates are always decoded.
 
 	Returns: list
 		A list of Dataset objects created from the message body, or None if
@@ -95,8 +111,18 @@ def read_file(sFileName):
 		on if data packetes were part of the response.
 	"""
 
+	if time is not None:
+		return read_time_range(sFileName, time[0], time[1], ids, vars)
+
+	# libdas2 reads files directly, compressed files go through the
+	# python reader so that they are inflated as they are parsed
+	with open(sFileName, 'rb') as fIn:
+		sCompress = compression(fIn.peek(6)[:6])
+		if sCompress:
+			return read_stream(decompress(fIn, sCompress), ids, vars)
+
 	try:
-		lDs = _das2.read_file(sFileName)
+		lDs = _das2.read_file(sFileName, ids=ids, vars=vars)
 	except Exception as e:
 		sys.stderr.write("Error running '%s': %s\n"%(sFileName, str(e)))
 		return None
@@ -110,7 +136,36 @@ def read_file(sFileName):
 	raise _das2.Error("Unable to retrieve data using %s"%sUrl)
 
 
-def read_http(sUrl, rTimeOut=3.0, sAgent=None):
+def read_stream(fIn, ids=None, vars=None):
+	"""Read datasets from a das2.2, das3 or QStream without using libdas2
+
+	The stream is parsed by a PacketReader and decoded in bulk by a
+	DatasetBuilder.
+
+	Args:
+		fIn (file-like) : An object with a read() method that returns bytes,
+			for example a file opened in 'rb' mode.
+
+		ids (set, optional) : Only read packets with these IDs, see
+			PacketReader.
+
+		vars (set, optional) : Only decode these data dimensions, see
+			DatasetBuilder.
+
+	Returns: list
+		A list of Dataset objects, one for each data header in the stream.
+		The return datasets may or may not have data depending on if data
+		packets followed the headers.
+	"""
+
+	builder = DatasetBuilder(vars=vars)
+	for pkt in PacketReader(fIn, ids=ids):
+		builder.add(pkt)
+
+	return builder.datasets()
+
+
+def read_http(sUrl, rTimeOut=3.0, sAgent=None, ids=None, vars=None):
 	"""Issue an HTTP GET command to a remote server and output a list of
 	datasets.
 
@@ -131,6 +186,11 @@ def read_http(sUrl, rTimeOut=3.0, sAgent=None):
 		sAgent (str, options) : The user-agent string to set in the HTTP/HTTPs
 			header.  If not specified a default string will be sent.
 
+		ids (set, optional) : Only output datasets for these packet IDs
+
+		vars (set, optional) : Only output these data dimensions, by name.
+			Coordinates are always output.
+
 	Returns: list
 		A list of Dataset objects created from the message body, or None if
 		in error occured.  The return datasets may or may not have data depending
@@ -138,10 +198,7 @@ def read_http(sUrl, rTimeOut=3.0, sAgent=None):
 	"""
 
 	try:
-		if sAgent:
-			lDs = _das2.read_server(sUrl, rTimeOut, sAgent)
-		else:
-			lDs = _das2.read_server(sUrl, rTimeOut)
+		lDs = _das2.read_server(sUrl, rTimeOut, sAgent, ids=ids, vars=vars)
 	except Exception as e:
 		sys.stderr.write("Error retrieving '%s': %s\n"%(sUrl, str(e)))
 		return None
@@ -0,0 +1,1492 @@
+# The MIT License
+#
+# Copyright 2022 Chris Piker
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Pure Python dataset builder.  Turns packets from a PacketReader into
+Dataset objects without using libdas2.  Packet bytes are decoded with NumPy
+structured dtypes derived from each data header.
+"""
+
+from collections import namedtuple
+
+import numpy
+import numpy.ma
+from lxml import etree
+
+from . import dastime
+from . dataset import Dataset, RaggedArray, _mk_prop_from_raw, _GrowAry, \
+	_GrowRagged
+from . reader import HeaderError, DataError, HdrPkt, DataHdrPkt, DataPkt, \
+	SkippedDataPkt
+
+# ########################################################################### #
+# Value encodings
+
+# das2.2 binary type names, the size is tacked on the end of each one
+g_dDas2Binary = {
+	'little_endian_real':'<f', 'big_endian_real':'>f', 'sun_real':'>f',
+	'little_endian_int':'<i', 'big_endian_int':'>i'
+}
+
+# das3 binary encodings
+g_dDas3Binary = {
+	'byte':'i', 'ubyte':'u', 'LEint':'<i', 'BEint':'>i', 'LEuint':'<u',
+	'BEuint':'>u', 'LEreal':'<f', 'BEreal':'>f'
+}
+
+# Units that really denote points in time, (epoch, nanoseconds per unit)
+g_dEpochUnits = {
+	'us2000':('2000-01-01', 1000),
+	't2000': ('2000-01-01', 1000000000),
+	't1970': ('1970-01-01', 1000000000),
+	'ms1970':('1970-01-01', 1000000),
+	'ns1970':('1970-01-01', 1),
+	'mj1958':('1958-01-01', 86400000000000),
+	'us1980':('1980-01-01', 1000),
+	'mjd':   ('1858-11-17', 86400000000000)
+}
+
+# Autoplot style "<units> since <time>" units, nanoseconds per unit
+g_dSinceUnits = {
+	'ns':1, 'nanoseconds':1, 'us':1000, 'microseconds':1000,
+	'ms':1000000, 'milliseconds':1000000, 's':1000000000, 'sec':1000000000,
+	'seconds':1000000000, 'min':60000000000, 'minutes':60000000000,
+	'hr':3600000000000, 'hours':3600000000000, 'days':86400000000000
+}
+
+# Leap second aware nanoseconds since 2000-01-01T11:58:55.816 UTC
+g_lTT2000Units = ('TT2000', 'cdfTT2000')
+
+# Dates at which TAI - UTC took on a new value, starting with 10 s in 1972
+g_lLeapDates = [
+	'1972-07-01', '1973-01-01', '1974-01-01', '1975-01-01', '1976-01-01',
+	'1977-01-01', '1978-01-01', '1979-01-01', '1980-01-01', '1981-07-01',
+	'1982-07-01', '1983-07-01', '1985-07-01', '1988-01-01', '1990-01-01',
+	'1991-01-01', '1992-07-01', '1993-07-01', '1994-07-01', '1996-01-01',
+	'1997-07-01', '1999-01-01', '2006-01-01', '2009-01-01', '2012-07-01',
+	'2015-07-01', '2017-01-01'
+]
+
+g_lFreqUnits = ('Hz', 'kHz', 'MHz', 'GHz')
+
+def _epochUnits(sUnits):
+	"""Get (epoch, nanoseconds per unit) for units that denote points in time
+	as offsets from an epoch, or None for any other units.  Both the das
+	short names, ex: 't2000', and units of the form 'seconds since 2010-01-01'
+	are understood.
+	"""
+	if sUnits is None: return None
+	if sUnits in g_dEpochUnits: return g_dEpochUnits[sUnits]
+
+	lParts = sUnits.split(None, 2)
+	if len(lParts) == 3 and lParts[1] == 'since' and lParts[0] in g_dSinceUnits:
+		try:
+			sEpoch = str(dastime.DasTime(lParts[2].strip().rstrip('Z')))
+		except ValueError:
+			return None
+		return (sEpoch, g_dSinceUnits[lParts[0]])
+
+	return None
+
+def _isTime(sUnits):
+	return (sUnits is not None) and ((sUnits.upper() == 'UTC') or \
+		(sUnits in g_lTT2000Units) or (_epochUnits(sUnits) is not None))
+
+def _tt2000ToTime(aNs):
+	"""Convert TT2000 values to datetime64[ns] by removing leap seconds.
+	Times during a leap second are reported as the first moment of the next
+	day.
+	"""
+	aNs = aNs.astype('int64')
+	aNaive = numpy.datetime64('2000-01-01T11:58:55.816', 'ns') + aNs.astype('m8[ns]')
+
+	# Leap seconds added since 2000, where they take effect in naive time
+	aLeap = numpy.arange(len(g_lLeapDates)) + 11 - 32
+	aAt = numpy.array(g_lLeapDates, dtype='M8[ns]') + aLeap.astype('m8[s]')
+	aIdx = numpy.searchsorted(aAt, aNaive, side='right')
+	aSince = numpy.concatenate(([10 - 32], aLeap))[aIdx]
+
+	return aNaive - aSince.astype('m8[s]')
+
+def _localName(el):
+	"""Element tag without any namespace"""
+	return etree.QName(el).localname
+
+# ########################################################################### #
+# Property handling
+
+def _mk_prop_from_p(el, sVersion):
+	"""Convert a <p> element to a property value using the same rules as
+	properties from the libdas2 builder.
+	"""
+	sType = el.attrib.get('type', 'string')
+	sVal = ' '.join((el.text or '').split())
+	sUnits = el.attrib.get('units', None)
+
+	if sVersion < '3':
+		# das2.2 types are the same as the libdas2 types, give or take case
+		tProp = (sType, sVal)
+	else:
+		if sType == 'real':
+			if sUnits: tProp = ('datum', '%s %s'%(sVal, sUnits))
+			else: tProp = ('double', sVal)
+		elif sType in ('realRange', 'intRange'):
+			if sUnits: tProp = ('datumrange', '%s %s'%(sVal, sUnits))
+			else: tProp = ('datumrange', sVal)
+		elif sType == 'datetimeRange': tProp = ('timerange', sVal)
+		elif sType == 'datetime': tProp = ('time', sVal)
+		elif sType == 'bool': tProp = ('boolean', sVal)
+		else: tProp = (sType, sVal)
+
+	try:
+		return _mk_prop_from_raw(tProp)
+	except ValueError:
+		return sVal  # Unknown type or empty value, keep the string
+
+# QStream property types, anything else is kept as a string
+g_dQsPropTypes = {
+	'double':'double', 'float':'double', 'number':'double', 'int':'int',
+	'integer':'int', 'long':'int', 'boolean':'boolean', 'datum':'datum',
+	'rank0dataset':'datum', 'datumrange':'datumrange'
+}
+
+def _mk_prop_from_property(el):
+	"""Convert a QStream <property> element to a property value"""
+	sType = el.attrib.get('type', 'String').lower()
+	sVal = el.attrib.get('value', '').strip()
+	try:
+		return _mk_prop_from_raw((g_dQsPropTypes.get(sType, 'string'), sVal))
+	except ValueError:
+		return sVal
+
+def _propsFromEl(elParent, sVersion):
+	"""Get a property dictionary from the <properties> child of an element"""
+	dProps = {}
+	for el in elParent:
+		if not isinstance(el.tag, str): continue  # comments
+		if _localName(el) != 'properties': continue
+		for elP in el:
+			if not isinstance(elP.tag, str): continue
+			if sVersion == 'qstream':
+				if _localName(elP) != 'property': continue
+				if elP.attrib.get('type', '') == 'qdataset': continue  # links
+				dProps[elP.attrib['name']] = _mk_prop_from_property(elP)
+				continue
+			if _localName(elP) != 'p': continue
+			dProps[elP.attrib['name']] = _mk_prop_from_p(elP, sVersion)
+	return dProps
+
+def _splitAxisProp(sName):
+	"""Split das2.2 style axis properties, ex: 'xLabel' -> ('x','label')
+
+	Returns: (axis, name), axis is None for properties with no axis prefix
+	"""
+	if len(sName) > 1 and sName[0] in 'xyz' and sName[1].isupper():
+		return (sName[0], sName[1].lower() + sName[2:])
+	return (None, sName)
+
+# ########################################################################### #
+# Packet layouts
+
+VarDef = namedtuple('VarDef',
+	'sCat sDim sRole sUnits sField tItems nAxis sValType sEnc aValues fill'
+)
+VarDef.__doc__ = """Defines how to make one Variable from a packet layout
+
+	sCat - 'coord' or 'data'
+	sDim - The name of the Dimension in the dataset
+	sRole - The role of the variable in the dimension, ex: 'center'
+	sUnits - The units string for the variable values
+	sField - The record field holding the values, None for header values
+	tItems - The shape of the values in each record, () for scalars, None
+	         if the number of values changes from record to record
+	nAxis - The first dataset axis the values map to
+	sValType - One of 'real', 'int', 'datetime', 'bool', 'string'
+	sEnc - One of 'binary', 'text', or 'header'
+	aValues - Fixed values for variables defined in the header, else None
+	fill - The fill value for the variable, if any
+"""
+
+class PktLayout(object):
+	"""The record structure of a single data packet type along with the
+	instructions for turning the decoded records into a Dataset.
+
+	Special members of this class are:
+
+		- .dtype - A NumPy structured dtype matching one data packet, None
+		  for variable length packets
+		- .lVars - A list of VarDef tuples
+		- .tShape - The dataset shape in all but the record axis
+		- .bVarLen - True if packets may have different lengths
+
+	Variable length das3 packets are described by .lSegs, a list of
+	(sField, sDtype, nItems, nBytes, sTerm) tuples, one per <packet> element
+	in order, with None for '*' item counts and sizes.
+	"""
+
+	def __init__(self, nPktId, sVersion, sName, sGroup):
+		self.nPktId = nPktId
+		self.sVersion = sVersion
+		self.sName = sName
+		self.sGroup = sGroup
+		self.props = {}
+		self.dDimProps = {}   # (sCat, sDim) -> properties
+		self.lFields = []     # NumPy dtype specification
+		self.lVars = []
+		self.tShape = ()
+		self.dtype = None
+		self.lSegs = []
+		self.bVarLen = False
+
+	def _addField(self, sType, tItems=()):
+		"""Add a field to the record and return it's name"""
+		sField = 'f%d'%len(self.lFields)
+		if len(tItems) == 0: self.lFields.append( (sField, sType) )
+		else: self.lFields.append( (sField, sType, tItems) )
+		return sField
+
+	def _addSeg(self, nLine, sType, nItems, nBytes, sTerm=None):
+		"""Add a das3 packet segment that may be variable length and return
+		it's field name.
+
+		Only one variable item count is allowed per packet, and since there
+		is no item count terminator the segments after it must have a fixed
+		size.
+		"""
+		for (sField, sPrevType, nPrevItems, nPrevBytes, sPrevTerm) in self.lSegs:
+			if nPrevItems is not None: continue
+			if nItems is None:
+				raise HeaderError(nLine, "Only one variable item count is "
+				                  "supported in packet %d"%self.nPktId)
+			if (nPrevBytes is None) or (nBytes is None):
+				raise HeaderError(nLine, "Items after a variable item count "
+				                  "must have a fixed size in packet %d"%self.nPktId)
+
+		if (nItems is None) or (nBytes is None):
+			sField = 'v%d'%len(self.lSegs)
+			self.bVarLen = True
+		else:
+			sField = self._addField(sType, (nItems,) if nItems > 1 else ())
+
+		self.lSegs.append( (sField, sType, nItems, nBytes, sTerm) )
+		return sField
+
+	def project(self, setVars):
+		"""Drop the data dimensions that aren't listed.  The packet bytes
+		for dropped variables are never decoded.
+
+		Args:
+			setVars (set) - The data dimension names to keep, coordinates are
+				always kept.
+		"""
+		self.lVars = [
+			vd for vd in self.lVars if (vd.sCat == 'coord') or (vd.sDim in setVars)
+		]
+
+	def _dimProps(self, sCat, sDim):
+		if (sCat, sDim) not in self.dDimProps: self.dDimProps[(sCat, sDim)] = {}
+		return self.dDimProps[(sCat, sDim)]
+
+	def _finish(self):
+		if not self.bVarLen: self.dtype = numpy.dtype(self.lFields)
+
+	def recBytes(self):
+		"""The size in bytes of one record, None for variable length packets"""
+		if self.bVarLen: return None
+		return self.dtype.itemsize
+
+	def minBytes(self):
+		"""The size in bytes of the fixed length parts of a record"""
+		if not self.bVarLen: return self.dtype.itemsize
+		nMin = 0
+		for (sField, sType, nItems, nBytes, sTerm) in self.lSegs:
+			if (nItems is not None) and (nBytes is not None): nMin += nItems*nBytes
+		return nMin
+
+	def timeVar(self):
+		"""Get the position in lVars of the record varying time coordinate
+
+		Returns (int): The first coordinate variable with datetime values that
+			is read from the packets, preferring the 'center', 'reference' and
+			'min' roles in that order, or None if there isn't one.
+		"""
+		lTime = [
+			i for i in range(len(self.lVars)) if self.lVars[i].sField and
+			self.lVars[i].sCat == 'coord' and self.lVars[i].sValType == 'datetime'
+		]
+		for sRole in ('center', 'reference', 'min'):
+			for i in lTime:
+				if self.lVars[i].sRole == sRole: return i
+		if len(lTime) > 0: return lTime[0]
+		return None
+
+	def firstTime(self, xPkt):
+		"""Decode just the first time value from a data packet
+
+		Returns (numpy.datetime64): The first value of the timeVar() variable,
+			or NaT if the packet has no time coordinate.
+		"""
+		iVar = self.timeVar()
+		if iVar is None: return numpy.datetime64('NaT', 'ns')
+
+		vd = self.lVars[iVar]
+		if self.bVarLen:
+			aVals = self.decode(xPkt, [len(xPkt)])[iVar]
+			if isinstance(aVals, RaggedArray): aVals = aVals.values
+		else:
+			aRaw = numpy.frombuffer(xPkt, dtype=self.dtype, count=1)[vd.sField]
+			if vd.sEnc == 'text': aVals = _decodeText(aRaw, vd)
+			else: aVals = _decodeBinary(aRaw, vd)
+		if (aVals.dtype.kind != 'M') or (aVals.size == 0):
+			return numpy.datetime64('NaT', 'ns')
+		return aVals.ravel()[0]
+
+	# Decoding ############################################################ #
+
+	def decode(self, xRecs, lLens=None):
+		"""Decode a buffer of whole records into arrays
+
+		Args:
+			xRecs (bytes-like) - Some multiple of recBytes() bytes of packet
+				payload data, or for variable length packets, the payloads of
+				a number of packets end to end.
+			lLens (list, optional) - The length of each packet in xRecs.
+				Required for variable length packets, ignored otherwise.
+
+		Returns (list): One array per VarDef in lVars (None for header
+			defined values).  The first index of each array is the record
+			number.  Variables with a different number of values in each
+			record are output as RaggedArray objects.
+		"""
+		if self.bVarLen:
+			dRaw = self._splitVarLen(xRecs, lLens)
+		else:
+			aRecs = numpy.frombuffer(xRecs, dtype=self.dtype)
+			dRaw = dict((vd.sField, (aRecs[vd.sField], None)) for vd in self.lVars
+			            if vd.sField)
+		lOut = []
+		for vd in self.lVars:
+			if vd.sField is None:
+				lOut.append(None)
+				continue
+
+			(aRaw, aCounts) = dRaw[vd.sField]
+			if vd.sEnc == 'text':
+				aVals = _decodeText(aRaw, vd)
+			else:
+				aVals = _decodeBinary(aRaw, vd)
+
+			if aCounts is not None: aVals = RaggedArray.fromLengths(aVals, aCounts)
+			lOut.append(aVals)
+
+		return lOut
+
+	def _splitVarLen(self, xRecs, lLens):
+		"""Pull the raw values for each output field out of variable length
+		packets.
+
+		Returns (dict): sField -> (aRaw, aCounts).  For fixed item counts
+			aRaw has the record number as the first index and aCounts is None.
+			For variable item counts aRaw is flat and aCounts gives the number
+			of items in each record.
+		"""
+		aLens = numpy.asarray(lLens, dtype='int64')
+		aStart = numpy.zeros(len(aLens), dtype='int64')
+		numpy.cumsum(aLens[:-1], out=aStart[1:])
+
+		setOut = set(vd.sField for vd in self.lVars if vd.sField)
+
+		for (sField, sType, nItems, nBytes, sTerm) in self.lSegs:
+			if nBytes is None:
+				return self._splitPackets(xRecs, aStart, aLens, setOut)
+
+		# All items have a fixed size and only one item count varies, the
+		# position of everything is known up front so no per-packet loop
+		aBytes = numpy.frombuffer(xRecs, dtype='u1')
+		nHead = 0
+		nTail = 0
+		bTail = False
+		for (sField, sType, nItems, nBytes, sTerm) in self.lSegs:
+			if nItems is None:
+				bTail = True
+				nVarBytes = nBytes
+			elif bTail: nTail += nItems*nBytes
+			else: nHead += nItems*nBytes
+
+		aVar = aLens - nHead - nTail
+		if numpy.any(aVar < 0) or numpy.any(aVar % nVarBytes):
+			raise DataError('Pd', self.nPktId, None,
+				"Variable length values are not a multiple of %d bytes"%nVarBytes
+			)
+
+		dOut = {}
+		nOff = 0
+		for (sField, sType, nItems, nBytes, sTerm) in self.lSegs:
+			if nItems is None:
+				if sField in setOut:
+					# Select the variable bytes of every packet at once
+					aEdge = numpy.zeros(len(aBytes) + 1, dtype='int8')
+					aEdge[aStart + nHead] += 1
+					aEdge[aStart + nHead + aVar] -= 1
+					aSel = numpy.cumsum(aEdge[:-1], dtype='int32') > 0
+					dOut[sField] = (aBytes[aSel].view(sType), aVar // nBytes)
+				nOff = -nTail
+				continue
+
+			nSize = nItems*nBytes
+			if sField in setOut:
+				aBase = aStart + nOff if nOff >= 0 else aStart + aLens + nOff
+				aPos = aBase[:,None] + numpy.arange(nSize)
+				aRaw = aBytes[aPos].view(sType)
+				if nItems == 1: aRaw = aRaw[:,0]
+				dOut[sField] = (aRaw, None)
+			nOff += nSize
+
+		return dOut
+
+	def _splitPackets(self, xRecs, aStart, aLens, setOut):
+		"""Walk through packets with variable width items one at a time"""
+		dItems = dict((sField, []) for sField in setOut)
+		dCounts = dict((sField, []) for sField in setOut)
+
+		for iPkt in range(len(aLens)):
+			xPkt = bytes(xRecs[aStart[iPkt]:aStart[iPkt] + aLens[iPkt]])
+			iPos = 0
+			for iSeg in range(len(self.lSegs)):
+				(sField, sType, nItems, nBytes, sTerm) = self.lSegs[iSeg]
+				lItems = []
+
+				if nBytes is not None:
+					nCount = nItems
+					if nCount is None:
+						nCount = (len(xPkt) - iPos - self._tailBytes(iSeg)) // nBytes
+					nEnd = iPos + nCount*nBytes
+					if (nCount < 0) or (nEnd > len(xPkt)): self._shortPkt(iPkt)
+					lItems = [xPkt[iPos:nEnd]]
+					iPos = nEnd
+				else:
+					while (len(lItems) < nItems) if nItems else (iPos < len(xPkt)):
+						(xItem, iPos) = self._nextItem(xPkt, iPos, sTerm, iPkt)
+						lItems.append(xItem)
+					nCount = len(lItems)
+
+				if sField in setOut:
+					dItems[sField] += lItems
+					dCounts[sField].append(nCount)
+
+			if iPos != len(xPkt):
+				raise DataError('Pd', self.nPktId, None,
+					"Packet %d in the current run has %d bytes past the last "
+					"item"%(iPkt, len(xPkt) - iPos)
+				)
+
+		dOut = {}
+		for (sField, sType, nItems, nBytes, sTerm) in self.lSegs:
+			if sField not in setOut: continue
+			if nBytes is not None:
+				aRaw = numpy.frombuffer(b''.join(dItems[sField]), dtype=sType)
+			elif len(dItems[sField]) == 0:
+				aRaw = numpy.zeros(0, dtype='S1')
+			else:
+				aRaw = numpy.array(dItems[sField], dtype='S')
+
+			if nItems is None:
+				dOut[sField] = (aRaw, numpy.array(dCounts[sField], dtype='int64'))
+			elif nItems == 1:
+				dOut[sField] = (aRaw, None)
+			else:
+				dOut[sField] = (aRaw.reshape(len(aLens), nItems), None)
+
+		return dOut
+
+	def _tailBytes(self, iSeg):
+		nTail = 0
+		for (sField, sType, nItems, nBytes, sTerm) in self.lSegs[iSeg+1:]:
+			nTail += nItems*nBytes
+		return nTail
+
+	def _shortPkt(self, iPkt):
+		raise DataError('Pd', self.nPktId, None,
+			"Packet %d in the current run is shorter than it's header allows"%iPkt
+		)
+
+	def _nextItem(self, xPkt, iPos, sTerm, iPkt):
+		"""Get a variable width item that is either terminated or preceded
+		by a |nnn| length"""
+		if sTerm:
+			iEnd = xPkt.find(sTerm.encode('utf-8'), iPos)
+			if iEnd < 0: self._shortPkt(iPkt)
+			return (xPkt[iPos:iEnd], iEnd + len(sTerm))
+
+		iEnd = xPkt.find(b'|', iPos + 1)
+		if (xPkt[iPos:iPos+1] != b'|') or (iEnd < 0):
+			raise DataError('Pd', self.nPktId, None,
+				"Expected a |length| before variable width item at byte %d of "
+				"packet %d in the current run"%(iPos, iPkt)
+			)
+		nLen = int(xPkt[iPos+1:iEnd], 10)
+		if iEnd + 1 + nLen > len(xPkt): self._shortPkt(iPkt)
+		return (xPkt[iEnd+1:iEnd+1+nLen], iEnd + 1 + nLen)
+
+	# Output ############################################################## #
+
+	def mkDataset(self, lArrays, nRecs, dStreamProps):
+		"""Make a dataset from decoded arrays
+
+		Args:
+			lArrays (list) - One array per VarDef, as output by decode() but
+				containing all records.
+			nRecs (int) - The number of records
+			dStreamProps (dict) - Properties from the stream header.  For
+				das2.2 streams, axis properties such as 'yLabel' are moved to
+				the matching dimensions.
+
+		Returns (Dataset)
+		"""
+		ds = Dataset(self.sName, self.sGroup)
+		ds.shape = tuple([nRecs] + list(self.tShape))
+
+		dDimProps = dict((k, dict(self.dDimProps[k])) for k in self.dDimProps)
+		if self.sVersion < '3':
+			# Packet properties override stream properties
+			self._mergeDas2Props(ds.props, dDimProps, self.props)
+			self._mergeDas2Props(ds.props, dDimProps, dStreamProps)
+		else:
+			ds.props.update(dStreamProps)
+			ds.props.update(self.props)
+
+		# Record varying values first so that the header values broadcast into
+		# the full shape
+		lOrder = [i for i in range(len(self.lVars)) if self.lVars[i].sField]
+		lOrder += [i for i in range(len(self.lVars)) if not self.lVars[i].sField]
+
+		for i in lOrder:
+			vd = self.lVars[i]
+			if vd.sCat == 'coord': dim = ds.coord(vd.sDim)
+			else: dim = ds.data(vd.sDim)
+
+			if vd.sField:
+				aVals = lArrays[i]
+				if vd.tItems is not None:
+					aVals = aVals.reshape( (nRecs,) + vd.tItems )
+			else:
+				aVals = vd.aValues
+
+			sUnits = vd.sUnits
+			if vd.sValType == 'datetime': sUnits = 'UTC'
+
+			fill = vd.fill
+			if fill is None and self.sVersion < '3' and vd.sCat == 'data' and \
+			   vd.sValType == 'real':
+				# das2.2 data always have a fill value
+				fill = dDimProps.get(('data', vd.sDim), {}).get('fill', -1.0e+31)
+				if not isinstance(fill, (int, float)): fill = -1.0e+31
+
+			# Ragged values are masked when padded, if that ever happens
+			if (fill is not None) and vd.sCat == 'data' and \
+			   (vd.sValType in ('real', 'int')) and aVals.dtype.kind in 'fiu' \
+			   and not isinstance(aVals, RaggedArray):
+				aVals = numpy.ma.masked_values(aVals, fill, copy=False)
+
+			dim.var(vd.sRole, aVals, sUnits, axis=vd.nAxis, fill=fill)
+
+		setDims = set((vd.sCat, vd.sDim) for vd in self.lVars)
+		for (sCat, sDim) in dDimProps:
+			if (sCat, sDim) not in setDims: continue  # Removed by project()
+			if sCat == 'coord': ds.coord(sDim).props.update(dDimProps[(sCat, sDim)])
+			else: ds.data(sDim).props.update(dDimProps[(sCat, sDim)])
+
+		return ds
+
+	def _mergeDas2Props(self, dDsProps, dDimProps, dProps):
+		"""das2.2 streams put axis properties at the top level, ex: yLabel.
+		Move these to the dimensions for each axis, existing values are kept.
+		"""
+		for sKey in dProps:
+			(sAx, sName) = _splitAxisProp(sKey)
+			lDims = self.dAxisDims.get(sAx, []) if sAx else []
+			if len(lDims) == 0:
+				if sKey not in dDsProps: dDsProps[sKey] = dProps[sKey]
+				continue
+			for tDim in lDims:
+				if tDim not in dDimProps: dDimProps[tDim] = {}
+				if sName not in dDimProps[tDim]: dDimProps[tDim][sName] = dProps[sKey]
+
+# ########################################################################### #
+
+def _decodeBinary(aRaw, vd):
+	"""Copy binary values out of the record buffer in native byte order"""
+	aOut = aRaw.astype(aRaw.dtype.base.newbyteorder('='))
+
+	if vd.sValType == 'datetime' and vd.sUnits in g_lTT2000Units:
+		aOut = _tt2000ToTime(aOut)
+
+	elif vd.sValType == 'datetime' and _epochUnits(vd.sUnits):
+		(sEpoch, nScale) = _epochUnits(vd.sUnits)
+		if aOut.dtype.kind in 'iu':
+			aNs = aOut.astype('int64')*nScale   # Exact, ex: ns1970
+		else:
+			aNs = numpy.rint(aOut * float(nScale)).astype('int64')
+		aOut = numpy.datetime64(sEpoch, 'ns') + aNs.astype('m8[ns]')
+
+	elif vd.sValType == 'bool':
+		aOut = aOut.astype(bool)
+
+	return aOut
+
+def _textToTime(aText):
+	"""Bulk convert ISO-8601 time strings to datetime64[ns]
+
+	Calendar dates are handled by NumPy's own parser, day-of-year dates
+	(YYYY-DDDThh:mm:ss) are split apart and assembled from day offsets.
+
+	Args:
+		aText (numpy.ndarray) - Stripped unicode strings
+
+	Returns (numpy.ndarray): datetime64[ns] values
+
+	Raises:
+		ValueError - If any of the strings are in some other format
+	"""
+	aText = numpy.char.rstrip(aText, 'Z')
+	try:
+		return aText.astype('M8[ns]')
+	except ValueError:
+		pass
+
+	aParts = numpy.char.partition(aText, 'T')
+	aDate = numpy.char.partition(aParts[...,0], '-')
+	if not (numpy.all(aDate[...,1] == '-') and \
+	        numpy.all(numpy.char.str_len(aDate[...,2]) == 3)):
+		raise ValueError("Unknown time format")
+
+	aYear = aDate[...,0].astype('int64') - 1970
+	aDays = aDate[...,2].astype('int64') - 1
+	aOut = aYear.astype('M8[Y]').astype('M8[ns]') + aDays.astype('m8[D]')
+
+	aTime = aParts[...,2]
+	if numpy.any(aTime != ''):
+		aTime = numpy.where(aTime == '', '00:00', aTime)
+		aOut += numpy.char.add('1970-01-01T', aTime).astype('M8[ns]') - \
+			numpy.datetime64('1970-01-01', 'ns')
+
+	return aOut
+
+def _decodeText(aRaw, vd):
+	"""Convert fixed width text fields to values.
+
+	The fields are converted as whole arrays.  If that fails, the values are
+	converted one at a time so that uncommon formats are still handled and
+	bad values give a useful error.
+	"""
+	aStrip = numpy.char.strip(aRaw)
+
+	try:
+		if vd.sValType == 'datetime' and vd.sUnits in g_lTT2000Units:
+			return _decodeBinary(aStrip.astype('int64'), vd)
+		elif vd.sValType == 'datetime' and _epochUnits(vd.sUnits):
+			return _decodeBinary(aStrip.astype('float64'), vd)
+		elif vd.sValType == 'datetime':
+			return _textToTime(numpy.char.decode(aStrip, 'utf-8'))
+		elif vd.sValType == 'int':
+			return aStrip.astype('int64')
+		elif vd.sValType == 'real':
+			return aStrip.astype('float64')
+		elif vd.sValType == 'bool':
+			return numpy.isin(numpy.char.lower(aStrip), [b'true', b'1', b'yes'])
+		else:
+			return numpy.char.decode(aStrip, 'utf-8')
+	except (ValueError, UnicodeDecodeError):
+		pass
+
+	lText = [x.decode('utf-8') for x in aStrip.ravel()]
+
+	if vd.sValType == 'datetime':
+		aOut = numpy.array(
+			[numpy.datetime64(str(dastime.DasTime(s)), 'ns') for s in lText],
+			dtype='M8[ns]'
+		)
+	elif vd.sValType == 'int':
+		aOut = numpy.array([int(s, 10) for s in lText], dtype='int64')
+	else:
+		aOut = numpy.array([float(s) for s in lText], dtype='float64')
+
+	return aOut.reshape(aRaw.shape)
+
+# ########################################################################### #
+# das2.2 headers
+
+def _das2Type(sType, nLine):
+	"""Get (dtype string, encoding, value type) for a das2.2 type name"""
+
+	for sPre in g_dDas2Binary:
+		if sType.startswith(sPre):
+			sSz = sType[len(sPre):]
+			if sSz not in ('4', '8'):
+				raise HeaderError(nLine, "Unknown value type '%s'"%sType)
+			sDtype = g_dDas2Binary[sPre] + sSz
+			return (sDtype, 'binary', 'int' if 'i' in sDtype else 'real')
+
+	for sPre, sValType in (('ascii','real'), ('time','datetime'), ('char','string')):
+		if sType.startswith(sPre):
+			sSz = sType[len(sPre):]
+			if not sSz.isdigit():
+				raise HeaderError(nLine, "Unknown value type '%s'"%sType)
+			return ('S%s'%sSz, 'text', sValType)
+
+	raise HeaderError(nLine, "Unknown value type '%s'"%sType)
+
+def _das2TimeType(sUnits, sValType):
+	"""Get (units, value type) for a das2.2 plane.  Binary and ascii numbers
+	in time units are times, as are timeNN strings, which are ISO-8601 no
+	matter what units are given.
+	"""
+	if sValType == 'datetime': return ('UTC', sValType)
+	if _isTime(sUnits) and sValType in ('real', 'int'): return (sUnits, 'datetime')
+	return (sUnits, sValType)
+
+def _das2YTags(elYscan, nItems):
+	"""Get the coordinate values for a <yscan> element"""
+	if 'yTags' in elYscan.attrib:
+		sTags = elYscan.attrib['yTags'].replace(',', ' ')
+		aTags = numpy.array([float(s) for s in sTags.split()])
+		if len(aTags) != nItems:
+			raise HeaderError(elYscan.sourceline,
+				"Found %d yTags, expected %d"%(len(aTags), nItems)
+			)
+		return aTags
+
+	rMin = float(elYscan.attrib.get('yTagMin', '0.0'))
+	rInterval = float(elYscan.attrib.get('yTagInterval', '1.0'))
+	return rMin + rInterval*numpy.arange(nItems)
+
+def _das2Layout(pkt, elRoot):
+	"""Define a packet layout from a das2.2 <packet> element
+
+	das2.2 has no explicit dimension names.  The <x> plane becomes the 'time'
+	coordinate if it has time units, <yscan> tags become the 'frequency'
+	coordinate for frequency units.  Otherwise the name attributes are used
+	with 'x', 'y' and 'z' as fallbacks.  If <z> planes are present the <y>
+	planes are coordinates, otherwise they are data.
+	"""
+	lY = [el for el in elRoot if el.tag == 'y']
+	lZ = [el for el in elRoot if el.tag == 'z']
+	lYscan = [el for el in elRoot if el.tag == 'yscan']
+
+	bYCoord = (len(lZ) + len(lYscan)) > 0
+	lData = lZ + lYscan if bYCoord else lY
+	sGroup = 'ds'
+	for el in lData:
+		if el.attrib.get('name', ''):
+			sGroup = el.attrib['name']
+			break
+
+	layout = PktLayout(pkt.id, pkt.sver, '%s_%02d'%(sGroup, pkt.id), sGroup)
+	layout.props = _propsFromEl(elRoot, pkt.sver)
+	layout.dAxisDims = {'x':[], 'y':[], 'z':[]}
+
+	nItems = None
+	lTags = []        # (yTags array, yUnits, dim name)
+	setNames = set()
+
+	def dimName(sName):
+		"""Get a unique dimension name"""
+		sOut = sName
+		i = 1
+		while sOut in setNames:
+			sOut = '%s_%d'%(sName, i)
+			i += 1
+		setNames.add(sOut)
+		return sOut
+
+	for el in elRoot:
+		if el.tag not in ('x', 'y', 'z', 'yscan'): continue
+
+		(sDtype, sEnc, sValType) = _das2Type(el.attrib['type'], el.sourceline)
+		dElProps = _propsFromEl(el, pkt.sver)
+
+		if el.tag == 'x':
+			(sUnits, sValType) = _das2TimeType(el.attrib['units'], sValType)
+			if sValType == 'datetime':
+				sDim = dimName(el.attrib.get('name', '') or 'time')
+			else:
+				sDim = dimName(el.attrib.get('name', '') or 'x')
+			sField = layout._addField(sDtype)
+			layout.lVars.append(VarDef(
+				'coord', sDim, 'center', sUnits, sField, (), 0, sValType, sEnc,
+				None, None
+			))
+			layout.dAxisDims['x'].append(('coord', sDim))
+			sCat = 'coord'
+
+		elif el.tag in ('y', 'z'):
+			(sUnits, sValType) = _das2TimeType(el.attrib['units'], sValType)
+			sCat = 'coord' if (el.tag == 'y' and bYCoord) else 'data'
+			sDim = dimName(el.attrib.get('name', '') or el.tag)
+			sField = layout._addField(sDtype)
+			layout.lVars.append(VarDef(
+				sCat, sDim, 'center', sUnits, sField, (), 0, sValType, sEnc,
+				None, None
+			))
+			layout.dAxisDims[el.tag].append((sCat, sDim))
+
+		else:  # yscan
+			n = int(el.attrib['nitems'], 10)
+			if nItems is None:
+				nItems = n
+			elif nItems != n:
+				raise HeaderError(el.sourceline,
+					"<yscan> planes with differing nitems in packet %d are not "
+					"supported"%pkt.id
+				)
+
+			sField = layout._addField(sDtype, (n,))
+			sDim = dimName(el.attrib.get('name', '') or 'z')
+			layout.lVars.append(VarDef(
+				'data', sDim, 'center', el.attrib['zUnits'], sField, (n,), 0,
+				sValType, sEnc, None, None
+			))
+			layout.dAxisDims['z'].append(('data', sDim))
+			sCat = 'data'
+
+			# Share a coordinate dimension with any yscan that has the same tags
+			aTags = _das2YTags(el, n)
+			sYUnits = el.attrib['yUnits']
+			sTagDim = None
+			for (aPrev, sPrevUnits, sPrevDim) in lTags:
+				if sPrevUnits == sYUnits and numpy.array_equal(aPrev, aTags):
+					sTagDim = sPrevDim
+					break
+			if sTagDim is None:
+				sTagDim = dimName('frequency' if sYUnits in g_lFreqUnits else 'y')
+				lTags.append( (aTags, sYUnits, sTagDim) )
+				layout.lVars.append(VarDef(
+					'coord', sTagDim, 'center', sYUnits, None, (), 1, 'real',
+					'header', aTags, None
+				))
+				layout.dAxisDims['y'].append(('coord', sTagDim))
+
+		# Properties on a plane belong to it's dimension, drop any axis prefix
+		dProps = layout._dimProps(sCat, sDim)
+		for sKey in dElProps:
+			dProps[_splitAxisProp(sKey)[1]] = dElProps[sKey]
+
+	if nItems is not None: layout.tShape = (nItems,)
+
+	layout._finish()
+	return layout
+
+# ########################################################################### #
+# das3 headers
+
+def _das3Sizes(el):
+	"""Get the j and k sizes for an element, None for empty or missing"""
+	lOut = []
+	for sIdx in ('jSize', 'kSize'):
+		sSz = el.attrib.get(sIdx, '').strip()
+		if len(sSz) == 0: lOut.append(None)
+		elif sSz == '*': lOut.append('*')
+		else: lOut.append(int(sSz, 10))
+	return lOut
+
+def _das3Values(el, elVar, sValType, nItems):
+	"""Get the values for <values> and <sequence> elements"""
+	if _localName(el) == 'sequence':
+		rMin = float(el.attrib['minval'])
+		rInterval = float(el.attrib['interval'])
+		return rMin + rInterval*numpy.arange(nItems)
+
+	sSep = el.attrib.get('valSep', ';')
+	if sSep == '\\n': sSep = '\n'
+	lVals = [s.strip() for s in (el.text or '').split(sSep)]
+	lVals = [s for s in lVals if len(s) > 0]
+	if len(lVals) != nItems:
+		raise HeaderError(el.sourceline, "Expected %d values, found %d"%(
+			nItems, len(lVals)
+		))
+	if sValType == 'int':
+		return numpy.array([int(s, 10) for s in lVals], dtype='int64')
+	return numpy.array([float(s) for s in lVals], dtype='float64')
+
+def _das3Layout(pkt, elRoot):
+	"""Define a packet layout from a das3 <dataset> element
+
+	Each <xCoord>, <yCoord>, etc. and each <data> element becomes a
+	Dimension named by it's physDim attribute.  Scalars become Variables with
+	their 'use' attribute as the role.  Vectors and <extData> objects are
+	stepped over in the packet but are not output.
+	"""
+	sName = elRoot.attrib.get('name', 'ds')
+	layout = PktLayout(pkt.id, pkt.sver, sName, sName)
+	layout.props = _propsFromEl(elRoot, pkt.sver)
+	layout.dAxisDims = {}
+
+	(nDsJ, nDsK) = _das3Sizes(elRoot)
+	tShape = []
+	if nDsJ not in (None, '*'): tShape.append(nDsJ)
+	if nDsK not in (None, '*'):
+		if len(tShape) == 0:
+			raise HeaderError(elRoot.sourceline, "kSize given without a jSize")
+		tShape.append(nDsK)
+	layout.tShape = tuple(tShape)
+
+	for elDim in elRoot:
+		if not isinstance(elDim.tag, str): continue
+		sDimTag = _localName(elDim)
+		if sDimTag in ('properties', 'extension'): continue
+
+		if sDimTag.endswith('Coord'): sCat = 'coord'
+		elif sDimTag == 'data': sCat = 'data'
+		else: sCat = None      # extData, just skip the bytes
+
+		if sCat:
+			sDim = elDim.attrib['physDim']
+			dDimProps = _propsFromEl(elDim, pkt.sver)
+			layout._dimProps(sCat, sDim).update(dDimProps)
+
+		for elVar in elDim:
+			if not isinstance(elVar.tag, str): continue
+			sVarTag = _localName(elVar)
+			if sVarTag not in ('scalar', 'vector', 'object'): continue
+
+			lStore = [el for el in elVar if isinstance(el.tag, str) and \
+			          _localName(el) in ('packet', 'values', 'sequence')]
+
+			bOutput = (sCat is not None) and (sVarTag == 'scalar')
+
+			for elStore in lStore:
+				_das3AddVar(layout, pkt, elVar, elStore, bOutput,
+				            sCat, sDim if sCat else None,
+				            dDimProps if sCat else {})
+
+	layout._finish()
+	return layout
+
+def _das3AddVar(layout, pkt, elVar, elStore, bOutput, sCat, sDim, dDimProps):
+	"""Add a record field and/or variable definition for a das3 variable"""
+
+	sStore = _localName(elStore)
+	sValType = elVar.attrib.get('valType', 'real')
+	sUnits = elVar.attrib.get('units', '')
+	sRole = elVar.attrib.get('use', 'center')
+	(nJ, nK) = _das3Sizes(elVar)
+
+	# Fill values come from the variable, or from the dimension properties
+	fill = None
+	if 'fill' in elVar.attrib:
+		try: fill = float(elVar.attrib['fill'])
+		except ValueError: pass
+	elif 'fill' in dDimProps:
+		fill = dDimProps['fill']
+		if not isinstance(fill, (int, float)): fill = None
+
+	if _isTime(sUnits) and sValType in ('real', 'int'): sValType = 'datetime'
+
+	if sStore == 'packet':
+		# Item counts and sizes of '*' are variable, given as None
+		sItems = elStore.attrib['numItems']
+		sBytes = elStore.attrib['itemBytes']
+		nItems = None if sItems == '*' else int(sItems, 10)
+		nBytes = None if sBytes == '*' else int(sBytes, 10)
+		sTerm = elStore.attrib.get('valTerm', None)
+		if sTerm == '\\n': sTerm = '\n'
+		sEncoding = elStore.attrib['encoding']
+
+		if sEncoding == 'utf8':
+			sDtype = 'S%d'%nBytes if nBytes else 'S'
+			sEnc = 'text'
+		elif sEncoding in g_dDas3Binary:
+			if nBytes is None:
+				if bOutput:
+					raise HeaderError(elStore.sourceline,
+						"Variable width binary values in packet %d are not supported"%pkt.id
+					)
+				sDtype = 'V'            # Opaque, just skipped
+			elif sEncoding in ('byte','ubyte') and nBytes != 1:
+				sDtype = 'V%d'%nBytes   # Opaque, not a number
+				bOutput = False
+			else:
+				sDtype = g_dDas3Binary[sEncoding] + str(nBytes)
+			sEnc = 'binary'
+		else:
+			raise HeaderError(elStore.sourceline, "Unknown encoding '%s'"%sEncoding)
+
+		sField = layout._addSeg(elStore.sourceline, sDtype, nItems, nBytes, sTerm)
+
+		if not bOutput: return
+
+		if nItems is None:
+			# Different number of values in each record
+			layout.lVars.append(VarDef(
+				sCat, sDim, sRole, sUnits, sField, None, 0, sValType, sEnc, None,
+				fill
+			))
+			return
+
+		tItems = (nItems,) if nItems > 1 else ()
+
+		# Reshape items to the variable's index space if needed
+		lShape = [n for n in (nJ, nK) if n not in (None, '*')]
+		if nItems > 1:
+			nProd = 1
+			for n in lShape: nProd *= n
+			if len(lShape) > 0 and nProd == nItems: tItems = tuple(lShape)
+
+		layout.lVars.append(VarDef(
+			sCat, sDim, sRole, sUnits, sField, tItems, 0, sValType, sEnc, None,
+			fill
+		))
+		return
+
+	if not bOutput: return
+
+	# Header values, these don't vary by record
+	lShape = []
+	nAxis = None
+	if nJ not in (None, '*'):
+		lShape.append(nJ)
+		nAxis = 1
+	if nK not in (None, '*'):
+		lShape.append(nK)
+		if nAxis is None: nAxis = 2
+
+	if nAxis is None:
+		raise HeaderError(elStore.sourceline,
+			"Header values for %s:%s must vary in the j or k index"%(sDim, sRole)
+		)
+
+	nItems = 1
+	for n in lShape: nItems *= n
+	aValues = _das3Values(elStore, elVar, sValType, nItems).reshape(lShape)
+
+	layout.lVars.append(VarDef(
+		sCat, sDim, sRole, sUnits, None, (), nAxis, sValType, 'header',
+		aValues, fill
+	))
+
+# ########################################################################### #
+# QStream headers
+
+# QStream binary encodings, the byte order comes from the stream header
+g_dQsBinary = {
+	'double':'f8', 'real8':'f8', 'float':'f4', 'real4':'f4', 'long':'i8',
+	'int8':'i8', 'int':'i4', 'int4':'i4', 'integer':'i4', 'uint':'u4',
+	'uint4':'u4', 'short':'i2', 'int2':'i2', 'ushort':'u2', 'uint2':'u2',
+	'byte':'i1', 'int1':'i1', 'ubyte':'u1', 'uint1':'u1'
+}
+
+# Properties that link one qdataset to another, (axis or role)
+g_dQsLinks = {
+	'DEPEND_0':0, 'DEPEND_1':1, 'DEPEND_2':2, 'DEPEND_3':3,
+	'DELTA_PLUS':'max_error', 'DELTA_MINUS':'min_error',
+	'BIN_MIN':'min', 'BIN_MAX':'max'
+}
+
+# QDataSet property names that have das equivalents
+g_dQsDimProps = {
+	'LABEL':'label', 'TITLE':'title', 'DESCRIPTION':'summary',
+	'VALID_MIN':'validMin', 'VALID_MAX':'validMax', 'TYPICAL_MIN':'scaleMin',
+	'TYPICAL_MAX':'scaleMax', 'SCALE_TYPE':'scaleType', 'FORMAT':'format'
+}
+
+class QStreamState(object):
+	"""Stream wide information needed to interpret QStream packet headers.
+
+	QStream packet headers can refer to qdatasets defined in earlier
+	headers, typically non-streaming DEPEND_1 values given inline, and the
+	byte order of binary values is set in the stream header.  One of these
+	is kept per stream and handed to mkLayout().
+	"""
+
+	def __init__(self):
+		self.sByteOrder = '>'   # Java's default
+		self.sDatasetId = None  # The main qdataset in the stream
+		self.dInline = {}       # qdataset id -> (VarDef, properties)
+
+	def streamHdr(self, elRoot):
+		"""Pick up the main dataset and byte order from a QStream <stream>
+		element
+		"""
+		self.sDatasetId = elRoot.attrib.get('dataset_id', None)
+		if elRoot.attrib.get('byte_order', 'big_endian') == 'little_endian':
+			self.sByteOrder = '<'
+		else:
+			self.sByteOrder = '>'
+
+def _qsType(sEnc, sByteOrder, sUnits, nLine):
+	"""Get (dtype string, encoding, value type) for a QStream <values>
+	encoding
+	"""
+	if sEnc in g_dQsBinary:
+		sDtype = g_dQsBinary[sEnc]
+		if sDtype[1] != '1': sDtype = sByteOrder + sDtype
+		if _isTime(sUnits): sValType = 'datetime'
+		elif sDtype[-2] == 'f': sValType = 'real'
+		else: sValType = 'int'
+		return (sDtype, 'binary', sValType)
+
+	for sPre, sValType in (('ascii', 'real'), ('time', 'datetime')):
+		if sEnc.startswith(sPre) and sEnc[len(sPre):].isdigit():
+			if sValType == 'real' and _isTime(sUnits): sValType = 'datetime'
+			return ('S%s'%sEnc[len(sPre):], 'text', sValType)
+
+	raise HeaderError(nLine, "Unknown QStream encoding '%s'"%sEnc)
+
+def _qsDimProps(dDimProps, dProps):
+	"""Copy qdataset properties to a dimension using das names where known"""
+	for sKey in dProps:
+		if sKey in ('UNITS', 'NAME', 'FILL_VALUE'): continue
+		dDimProps[g_dQsDimProps.get(sKey, sKey)] = dProps[sKey]
+
+def _qsShape(elVals):
+	"""The per-record shape from a <values> length attribute"""
+	lShape = []
+	for sLen in elVals.attrib.get('length', '').split(','):
+		if len(sLen.strip()) == 0: continue
+		try:
+			lShape.append(int(sLen, 10))
+		except ValueError:
+			raise HeaderError(elVals.sourceline, "Invalid length '%s'"%sLen)
+	return tuple(lShape)
+
+def _qsLayout(pkt, elRoot, qs):
+	"""Define a packet layout from a QStream <packet> element
+
+	Each streaming <qdataset> becomes a record field.  Datasets referenced by
+	DEPEND_N properties are coordinates for axis N, the ones referenced by
+	DELTA_PLUS, DELTA_MINUS, BIN_MIN and BIN_MAX are extra variables in the
+	dimension of the dataset that refers to them, and unreferenced datasets
+	are data.  The qdataset ids are used for dimension names.
+
+	Qdatasets with inline values are saved in the stream state for use by
+	later packets.
+
+	Returns (PktLayout): The layout, or None if the packet only defines
+		inline values and thus is never followed by data.
+	"""
+	lQds = []   # (id, element, <values>, properties, links)
+	for elQds in elRoot:
+		if not isinstance(elQds.tag, str) or _localName(elQds) != 'qdataset':
+			continue
+		sId = elQds.attrib.get('id', '')
+		lVals = [el for el in elQds if isinstance(el.tag, str) and _localName(el) == 'values']
+		if len(sId) == 0 or len(lVals) != 1:
+			raise HeaderError(elQds.sourceline,
+				"<qdataset> needs an id and one <values> element in packet %d"%pkt.id
+			)
+
+		dLinks = {}
+		for el in elQds.iter('property'):
+			if el.attrib.get('type', '') == 'qdataset' and el.attrib.get('name') in g_dQsLinks:
+				dLinks[el.attrib['name']] = el.attrib.get('value', '')
+
+		lQds.append( (sId, elQds, lVals[0], _propsFromEl(elQds, pkt.sver), dLinks) )
+
+	# Header only qdatasets
+	lStream = []
+	for (sId, elQds, elVals, dProps, dLinks) in lQds:
+		if 'values' not in elVals.attrib:
+			lStream.append( (sId, elQds, elVals, dProps, dLinks) )
+			continue
+
+		sUnits = dProps.get('UNITS', None)
+		lText = elVals.attrib['values'].replace(',', ' ').split()
+		try:
+			aValues = numpy.array([float(s) for s in lText])
+		except ValueError:
+			raise HeaderError(elVals.sourceline, "Invalid values for qdataset '%s'"%sId)
+		if len(_qsShape(elVals)) > 1:
+			raise HeaderError(elVals.sourceline,
+				"Inline values for qdataset '%s' must be rank 1"%sId
+			)
+		vd = VarDef(
+			'coord', sId, 'center', sUnits, None, (), 1,
+			'datetime' if _isTime(sUnits) else 'real', 'header', aValues,
+			dProps.get('FILL_VALUE', None)
+		)
+		if vd.sValType == 'datetime': vd = vd._replace(aValues=_decodeBinary(aValues, vd))
+		qs.dInline[sId] = (vd, dProps)
+
+	if len(lStream) == 0: return None
+
+	# Sort out what everything is from the links
+	dRefs = {}  # referenced id -> (category unknown yet, axis or role, referrer)
+	for (sId, elQds, elVals, dProps, dLinks) in lStream:
+		for sLink in dLinks:
+			if dLinks[sLink] not in dRefs: dRefs[dLinks[sLink]] = (g_dQsLinks[sLink], sId)
+
+	lData = [t[0] for t in lStream if t[0] not in dRefs]
+	if len(lData) == 0:
+		raise HeaderError(elRoot.sourceline, "No data qdataset in packet %d"%pkt.id)
+
+	sName = lData[0]
+	if qs.sDatasetId in lData: sName = qs.sDatasetId
+
+	layout = PktLayout(pkt.id, pkt.sver, sName, sName)
+
+	def dimOf(sId):
+		"""Get (category, dimension, role, axis) for a qdataset"""
+		if sId not in dRefs: return ('data', sId, 'center', 0)
+		(link, sFrom) = dRefs[sId]
+		if isinstance(link, int): return ('coord', sId, 'center', link)
+		(sCat, sDim, sRole, nAxis) = dimOf(sFrom)
+		return (sCat, sDim, link, nAxis)
+
+	tShape = ()
+	for (sId, elQds, elVals, dProps, dLinks) in lStream:
+		sUnits = dProps.get('UNITS', None)
+		(sDtype, sEnc, sValType) = _qsType(
+			elVals.attrib.get('encoding', ''), qs.sByteOrder, sUnits, elVals.sourceline
+		)
+		if sValType == 'datetime' and sEnc == 'text': sUnits = 'UTC'
+
+		tItems = _qsShape(elVals)
+		(sCat, sDim, sRole, nAxis) = dimOf(sId)
+		if nAxis != 0 and len(tItems) == 0:
+			raise HeaderError(elQds.sourceline,
+				"Streaming qdataset '%s' is used for axis %d but has no length"%(sId, nAxis)
+			)
+		if len(tItems) > 0:
+			if len(tShape) > 0 and tItems != tShape:
+				raise HeaderError(elVals.sourceline,
+					"Length of qdataset '%s' doesn't match the others in packet %d"%(
+					sId, pkt.id
+				))
+			tShape = tItems
+
+		sField = layout._addField(sDtype, tItems)
+		layout.lVars.append(VarDef(
+			sCat, sDim, sRole, sUnits, sField, tItems, 0, sValType, sEnc, None,
+			dProps.get('FILL_VALUE', None)
+		))
+
+		if sRole == 'center': _qsDimProps(layout._dimProps(sCat, sDim), dProps)
+
+	# Header only values referenced by the streaming qdatasets
+	setStream = set(t[0] for t in lStream)
+	setDone = set()
+	for (sId, elQds, elVals, dProps, dLinks) in lStream:
+		for sLink in dLinks:
+			sRef = dLinks[sLink]
+			if (sRef in setStream) or (sRef in setDone): continue
+			if sRef not in qs.dInline:
+				raise HeaderError(elQds.sourceline,
+					"Unknown qdataset '%s' for %s of '%s'"%(sRef, sLink, sId)
+				)
+			setDone.add(sRef)
+
+			# Inline errors and bin edges have no record axis to map to
+			link = g_dQsLinks[sLink]
+			if not isinstance(link, int): continue
+
+			(vd, dRefProps) = qs.dInline[sRef]
+			if (link < 1) or (link > len(tShape)) or (len(vd.aValues) != tShape[link-1]):
+				raise HeaderError(elQds.sourceline,
+					"Inline values for '%s' don't fit axis %d of '%s'"%(sRef, link, sId)
+				)
+			layout.lVars.append(vd._replace(nAxis=link))
+			_qsDimProps(layout._dimProps(vd.sCat, vd.sDim), dRefProps)
+
+	layout.tShape = tShape
+	layout._finish()
+	return layout
+
+def mkLayout(pkt, qs=None):
+	"""Create a packet layout for a data header packet
+
+	Args:
+		pkt (DataHdrPkt) - A data header packet from a PacketReader
+		qs (QStreamState, optional) - Information from earlier headers in the
+			same QStream, only used for QStream packets.
+
+	Returns (PktLayout): For QStreams, None is returned for packets that only
+		define inline values.
+
+	Raises:
+		HeaderError - If the header can not be represented as NumPy records,
+			or as variable length das3 records with at most one variable
+			item count.
+	"""
+	elRoot = pkt.docTree().getroot()
+	if pkt.sver == 'qstream':
+		return _qsLayout(pkt, elRoot, qs if qs is not None else QStreamState())
+	elif pkt.sver < '3':
+		return _das2Layout(pkt, elRoot)
+	else:
+		return _das3Layout(pkt, elRoot)
+
+# ########################################################################### #
+
+def _grower(aFirst):
+	if aFirst is None: return None
+	if isinstance(aFirst, RaggedArray): return _GrowRagged(aFirst)
+	return _GrowAry(aFirst)
+
+class _PktAccum(object):
+	"""Collects the data for a single packet definition"""
+
+	def __init__(self, layout):
+		self.layout = layout
+		self.xRun = bytearray()  # Undecoded payloads for the current run
+		self.lLens = []          # Payload lengths, variable length packets only
+		self.nRecs = 0
+		self.lGrow = None
+
+	def flush(self):
+		"""Decode the current run of packets with one frombuffer call"""
+		if len(self.xRun) == 0 and len(self.lLens) == 0: return
+
+		lArys = self.layout.decode(self.xRun, self.lLens)
+		if self.lGrow is None:
+			self.lGrow = [_grower(a) for a in lArys]
+		else:
+			for i in range(len(lArys)):
+				if lArys[i] is not None: self.lGrow[i].append(lArys[i])
+
+		self.xRun = bytearray()
+		self.lLens = []
+
+	def dataset(self, dStreamProps):
+		self.flush()
+		lArys = []
+		for i in range(len(self.layout.lVars)):
+			vd = self.layout.lVars[i]
+			if vd.sField is None:
+				lArys.append(None)
+			elif self.lGrow is None:
+				# No data, empty arrays with the proper type
+				aEmpty = self.layout.decode(b'', [])[i]
+				lArys.append(aEmpty)
+			else:
+				lArys.append(self.lGrow[i].values())
+
+		return self.layout.mkDataset(lArys, self.nRecs, dStreamProps)
+
+
+class DatasetBuilder(object):
+	"""Build Dataset objects from das2.2, das3 and QStream packets.
+
+	Packets are handed to the builder one at a time via add().  Data packets
+	with the same ID that arrive back to back are saved as raw bytes and then
+	decoded as a group with a single numpy.frombuffer call.  Decoded values
+	are kept in growable arrays until datasets() is called.
+
+	Example:
+
+		builder = das2.DatasetBuilder()
+		for pkt in das2.PacketReader(open('my_file.d3b', 'rb')):
+			builder.add(pkt)
+		lDs = builder.datasets()
+	"""
+
+	def __init__(self, nRunMax=16777216, vars=None):
+		"""
+		Args:
+			nRunMax (int) - Decode runs of packets when they exceed this many
+				bytes even if the packet ID has not changed.
+
+			vars (set, optional) - Only decode these data dimensions, by name.
+				Coordinates are always decoded.  To skip whole packet IDs, use
+				the ids argument of the PacketReader.
+		"""
+		self.nRunMax = nRunMax
+		self.setVars = None if vars is None else set(vars)
+		self.dStreamProps = {}
+		self.dAccum = {}     # Current definition for each packet ID
+		self.lAccum = []     # All definitions in order seen
+		self.nLastId = None
+		self.nPkts = 0
+		self.qs = QStreamState()
+
+	def add(self, pkt):
+		"""Add a single packet to the builder
+
+		Args:
+			pkt (Packet) - Any packet from a PacketReader.  Stream headers,
+				data headers and data packets are used.  Comments and
+				exceptions are ignored.
+
+		Raises:
+			DataError: If the packet doesn't match it's header, or is a
+				SkippedDataPkt placeholder with no content
+		"""
+		self.nPkts += 1
+
+		if isinstance(pkt, DataPkt):
+			if isinstance(pkt, SkippedDataPkt):
+				raise DataError(pkt.tag, pkt.id, self.nPkts,
+					"Packet content was skipped by the reader, streams read with "
+					"bSkipData=True can't be built into datasets"
+				)
+			if pkt.id not in self.dAccum:
+				raise DataError(pkt.tag, pkt.id, self.nPkts,
+					"Data packet received before it's header"
+				)
+
+			accum = self.dAccum[pkt.id]
+			nRecBytes = accum.layout.recBytes()
+			if nRecBytes is None:
+				if pkt.length < accum.layout.minBytes():
+					raise DataError(pkt.tag, pkt.id, self.nPkts,
+						"Packet too short, expected at least %d read %d"%(
+						accum.layout.minBytes(), pkt.length
+					))
+				accum.lLens.append(pkt.length)
+			elif pkt.length != nRecBytes:
+				raise DataError(pkt.tag, pkt.id, self.nPkts,
+					"Packet size mismatch, expected %d read %d"%(
+					nRecBytes, pkt.length
+				))
+
+			if self.nLastId != pkt.id and self.nLastId in self.dAccum:
+				self.dAccum[self.nLastId].flush()
+			self.nLastId = pkt.id
+
+			accum.xRun += pkt.content
+			accum.nRecs += 1
+			if len(accum.xRun) >= self.nRunMax: accum.flush()
+
+		elif isinstance(pkt, DataHdrPkt):
+			if pkt.id in self.dAccum: self.dAccum[pkt.id].flush()
+
+			layout = mkLayout(pkt, self.qs)
+			if layout is None:  # QStream inline values, no data will follow
+				self.dAccum.pop(pkt.id, None)
+				return
+			if self.setVars is not None: layout.project(self.setVars)
+
+			accum = _PktAccum(layout)
+			self.dAccum[pkt.id] = accum
+			self.lAccum.append(accum)
+
+		elif isinstance(pkt, HdrPkt) and pkt.tag == 'Sx':
+			elRoot = pkt.docTree().getroot()
+			self.dStreamProps = _propsFromEl(elRoot, pkt.sver)
+			if pkt.sver == 'qstream': self.qs.streamHdr(elRoot)
+
+	def datasets(self):
+		"""Get all the datasets defined so far.
+
+		Returns (list): One Dataset for each data header in the stream,
+			including those that never received any data.
+		"""
+		return [accum.dataset(self.dStreamProps) for accum in self.lAccum]
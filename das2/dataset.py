@@ -27,9 +27,10 @@
 a thin layer on ndarrays"""
 
 import sys
+import copy
 import numpy
 import numpy.ma
-from collections import Counter, namedtuple
+from collections import namedtuple
 import datetime
 
 import _das2
@@ -438,6 +439,337 @@ class Quantity(namedtuple('Quantity', 'value unit')):
 
 
 
+# ############################################################################ #
+
+class RaggedArray(object):
+	"""Records with a variable number of values stored end to end.
+
+	All values live in a single flat ndarray.  Record i is given by
+	values[offsets[i]:offsets[i+1]] so the offsets array is one longer than
+	the number of records.  Indexing a single record returns a view, nothing
+	is copied.
+
+	Special members of this class are:
+
+	  - .values - The flat ndarray of all values
+	  - .offsets - The int64 start of each record in .values, plus the end
+	        of the last record
+	"""
+
+	def __init__(self, values, offsets):
+		"""Create a ragged array
+
+		Args:
+			values (ndarray) : The values of all records, end to end
+
+			offsets (list, ndarray) : The start of each record in values,
+				followed by the end of the last record.
+		"""
+		self.values = numpy.asanyarray(values)
+		self.offsets = numpy.asarray(offsets, dtype='int64')
+		if (self.offsets.ndim != 1) or (len(self.offsets) < 1):
+			raise ValueError("Ragged array offsets must be a non-empty 1-D array")
+		if (self.offsets[0] < 0) or (self.offsets[-1] > len(self.values)) or \
+		   numpy.any(self.offsets[1:] < self.offsets[:-1]):
+			raise ValueError("Ragged array offsets are not increasing or out "
+			                 "of range for %d values"%len(self.values))
+
+	@staticmethod
+	def fromLengths(values, lengths):
+		"""Create a ragged array from the number of values in each record"""
+		aOffsets = numpy.zeros(len(lengths) + 1, dtype='int64')
+		numpy.cumsum(lengths, out=aOffsets[1:])
+		return RaggedArray(values, aOffsets)
+
+	@property
+	def dtype(self):
+		return self.values.dtype
+
+	@property
+	def nbytes(self):
+		return self.values.nbytes + self.offsets.nbytes
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, key):
+		"""Get one record as a view, or a range of records as a RaggedArray
+		sharing the same values."""
+		if isinstance(key, slice):
+			(nBeg, nEnd, nStep) = key.indices(len(self))
+			if nStep != 1:
+				raise IndexError("Ragged arrays only support contiguous slices")
+			return RaggedArray(self.values, self.offsets[nBeg:max(nBeg, nEnd)+1])
+
+		i = int(key)
+		if i < 0: i += len(self)
+		if (i < 0) or (i >= len(self)):
+			raise IndexError("Record %d out of range for %d records"%(key, len(self)))
+		return self.values[self.offsets[i]:self.offsets[i+1]]
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self.values[self.offsets[i]:self.offsets[i+1]]
+
+	def take(self, indices):
+		"""Copy the given records, in order, into a new compact ragged array"""
+		aIdx = numpy.asarray(indices, dtype='int64')
+		aStart = self.offsets[:-1][aIdx]
+		aLens = self.offsets[1:][aIdx] - aStart
+
+		aOffsets = numpy.zeros(len(aIdx) + 1, dtype='int64')
+		numpy.cumsum(aLens, out=aOffsets[1:])
+		aSrc = numpy.repeat(aStart - aOffsets[:-1], aLens) + \
+		       numpy.arange(aOffsets[-1], dtype='int64')
+		return RaggedArray(self.values[aSrc], aOffsets)
+
+	def lengths(self):
+		"""The number of values in each record"""
+		return numpy.diff(self.offsets)
+
+	def width(self):
+		"""The number of values in the longest record"""
+		if len(self) == 0: return 0
+		return int(self.lengths().max())
+
+	def padded(self, fill=None, nWidth=None):
+		"""Copy the records into a rectangular masked array
+
+		Args:
+			fill (optional) : Values equal to fill are masked along with the
+				padding, and fill is used as the masked array fill_value.
+
+			nWidth (int, optional) : The size of the second index, defaults
+				to width().  Must be at least width().
+
+		Returns (numpy.ma.MaskedArray): An array of shape (len, nWidth) where
+			positions past the end of each record are masked.
+		"""
+		aLen = self.lengths()
+		nMax = self.width()
+		if nWidth is None: nWidth = nMax
+		elif nWidth < nMax:
+			raise ValueError("Pad width %d is less than the longest record, %d"%(
+				nWidth, nMax
+			))
+
+		aData = numpy.zeros((len(self), nWidth), dtype=self.values.dtype)
+		aMask = numpy.ones((len(self), nWidth), dtype=bool)
+
+		aRow = numpy.repeat(numpy.arange(len(self)), aLen)
+		aCol = numpy.arange(len(aRow)) - numpy.repeat(self.offsets[:-1] - self.offsets[0], aLen)
+		aVals = self.values[self.offsets[0]:self.offsets[-1]]
+		aData[aRow, aCol] = numpy.ma.getdata(aVals)
+
+		aValMask = numpy.ma.getmaskarray(aVals)
+		if fill is not None:
+			try:
+				aValMask = aValMask | (numpy.ma.getdata(aVals) == fill)
+			except TypeError:
+				pass
+		aMask[aRow, aCol] = aValMask
+
+		aOut = numpy.ma.MaskedArray(aData, mask=aMask)
+		if fill is not None:
+			try: aOut.fill_value = fill
+			except (TypeError, ValueError): pass
+		return aOut
+
+# ############################################################################ #
+
+def _bcastTo(array, shape):
+	"""Broadcast an array to a shape, masks are broadcast too.  Missing
+	trailing axes are added first."""
+	shape = tuple(shape)
+	nExtra = len(shape) - array.ndim
+	if nExtra > 0:
+		array = array[(Ellipsis,) + (None,)*nExtra]
+	if array.shape == shape: return array
+
+	if isinstance(array, numpy.ma.MaskedArray):
+		aOut = numpy.ma.MaskedArray(
+			numpy.broadcast_to(array.data, shape),
+			mask=numpy.broadcast_to(numpy.ma.getmaskarray(array), shape)
+		)
+		try: aOut.fill_value = array.fill_value
+		except (TypeError, ValueError): pass
+		return aOut
+
+	return numpy.broadcast_to(array, shape)
+
+def _concat(lArrays):
+	"""Concatenate arrays along the first axis, keeping masks if present"""
+	if len(lArrays) == 1: return lArrays[0]
+	for a in lArrays:
+		if isinstance(a, numpy.ma.MaskedArray):
+			aOut = numpy.ma.concatenate(lArrays, axis=0)
+			try: aOut.fill_value = a.fill_value
+			except (TypeError, ValueError): pass
+			return aOut
+	return numpy.concatenate(lArrays, axis=0)
+
+def _core(var, lUnique):
+	"""The smallest part of a variable's values that holds all the given
+	unique axes, other axes are cut to size 1"""
+	tKey = tuple(slice(None) if b else slice(0, 1) for b in lUnique)
+	return var.array[tKey]
+
+def _sameValues(a, b):
+	"""Compare array values and masks"""
+	return numpy.array_equal(numpy.ma.getdata(a), numpy.ma.getdata(b)) and \
+	       numpy.array_equal(numpy.ma.getmaskarray(a), numpy.ma.getmaskarray(b))
+
+class ChunkedArray(object):
+	"""Arrays joined end to end along the first index without copying.
+
+	The chunks are kept as given, typically views of arrays from several
+	datasets.  Indexing a single record returns a view, the chunks are only
+	concatenated when the whole array is needed.
+
+	Special members of this class are:
+
+	  - .chunks - The list of ndarrays, all have the same shape after the
+	        first index
+	  - .offsets - The int64 start of each chunk in the first index, plus
+	        the end of the last chunk
+	"""
+
+	def __init__(self, chunks):
+		"""Create a chunked array
+
+		Args:
+			chunks (list) : The ndarrays to join, in order.  All must have the
+				same dtype kind and the same shape after the first index.
+		"""
+		self.chunks = [numpy.asanyarray(a) for a in chunks]
+		if len(self.chunks) == 0:
+			raise ValueError("Chunked arrays need at least one chunk")
+		for a in self.chunks[1:]:
+			if (a.ndim < 1) or (a.shape[1:] != self.chunks[0].shape[1:]):
+				raise ValueError("Chunk shapes %s and %s don't match after the "
+				                 "first index"%(self.chunks[0].shape, a.shape))
+
+		self.offsets = numpy.zeros(len(self.chunks) + 1, dtype='int64')
+		numpy.cumsum([len(a) for a in self.chunks], out=self.offsets[1:])
+
+	@property
+	def dtype(self):
+		return self.chunks[0].dtype
+
+	@property
+	def shape(self):
+		return (int(self.offsets[-1]),) + self.chunks[0].shape[1:]
+
+	@property
+	def nbytes(self):
+		return sum(a.nbytes for a in self.chunks)
+
+	def __len__(self):
+		return int(self.offsets[-1])
+
+	def __getitem__(self, key):
+		"""Get one record as a view, or a range of records as a ChunkedArray
+		sharing the same chunks."""
+		if isinstance(key, slice):
+			(nBeg, nEnd, nStep) = key.indices(len(self))
+			if nStep != 1:
+				raise IndexError("Chunked arrays only support contiguous slices")
+			nEnd = max(nBeg, nEnd)
+			lOut = []
+			for i in range(len(self.chunks)):
+				(nOff, nNext) = (self.offsets[i], self.offsets[i+1])
+				if (nNext <= nBeg) or (nOff >= nEnd): continue
+				lOut.append(self.chunks[i][max(nBeg - nOff, 0):min(nEnd, nNext) - nOff])
+			if len(lOut) == 0: lOut = [self.chunks[0][0:0]]
+			return ChunkedArray(lOut)
+
+		i = int(key)
+		if i < 0: i += len(self)
+		if (i < 0) or (i >= len(self)):
+			raise IndexError("Record %d out of range for %d records"%(key, len(self)))
+		iChunk = numpy.searchsorted(self.offsets, i, side='right') - 1
+		return self.chunks[iChunk][i - self.offsets[iChunk]]
+
+	def __iter__(self):
+		for a in self.chunks:
+			for i in range(len(a)): yield a[i]
+
+	def concatenate(self):
+		"""Copy all chunks into a single array"""
+		return _concat(self.chunks)
+
+	def __array__(self, dtype=None, copy=None):
+		if dtype is None: return numpy.asarray(self.concatenate())
+		return numpy.asarray(self.concatenate(), dtype=dtype)
+
+class _GrowAry(object):
+	"""An array that grows along axis 0 by doubling it's capacity.  Masks
+	are kept in a second growing array."""
+
+	def __init__(self, aFirst):
+		self.nLen = len(aFirst)
+		self.array = numpy.empty(
+			(max(self.nLen, 16),) + aFirst.shape[1:], dtype=aFirst.dtype
+		)
+		self.array[:self.nLen] = numpy.ma.getdata(aFirst)
+		self.mask = None
+		self.fill = None
+		if isinstance(aFirst, numpy.ma.MaskedArray):
+			self.mask = _GrowAry(numpy.ma.getmaskarray(aFirst))
+			self.fill = aFirst.fill_value
+
+	def append(self, aMore):
+		if isinstance(aMore, numpy.ma.MaskedArray):
+			if self.mask is None:
+				self.mask = _GrowAry(
+					numpy.zeros((self.nLen,) + self.array.shape[1:], dtype=bool)
+				)
+				self.fill = aMore.fill_value
+			self.mask.append(numpy.ma.getmaskarray(aMore))
+			aMore = aMore.data
+		elif self.mask is not None:
+			self.mask.append(numpy.zeros(aMore.shape, dtype=bool))
+
+		# Variable width strings may need a wider type
+		if aMore.dtype.kind in 'SU' and aMore.dtype.itemsize > self.array.dtype.itemsize:
+			self.array = self.array.astype(aMore.dtype)
+
+		nNeed = self.nLen + len(aMore)
+		if nNeed > len(self.array):
+			nCap = len(self.array)
+			while nCap < nNeed: nCap *= 2
+			aNew = numpy.empty((nCap,) + self.array.shape[1:], dtype=self.array.dtype)
+			aNew[:self.nLen] = self.array[:self.nLen]
+			self.array = aNew
+		self.array[self.nLen:nNeed] = aMore
+		self.nLen = nNeed
+
+	def values(self):
+		if self.mask is None: return self.array[:self.nLen]
+
+		aOut = numpy.ma.MaskedArray(
+			self.array[:self.nLen], mask=self.mask.values(), copy=False
+		)
+		try: aOut.fill_value = self.fill
+		except (TypeError, ValueError): pass
+		return aOut
+
+
+class _GrowRagged(object):
+	"""A RaggedArray that grows by records"""
+
+	def __init__(self, aFirst):
+		self.gVals = _GrowAry(aFirst.values[aFirst.offsets[0]:aFirst.offsets[-1]])
+		self.gOffs = _GrowAry(aFirst.offsets - aFirst.offsets[0])
+
+	def append(self, aMore):
+		nEnd = self.gOffs.array[self.gOffs.nLen - 1]
+		self.gVals.append(aMore.values[aMore.offsets[0]:aMore.offsets[-1]])
+		self.gOffs.append(aMore.offsets[1:] - aMore.offsets[0] + nEnd)
+
+	def values(self):
+		return RaggedArray(self.gVals.values(), self.gOffs.values())
+
 # ############################################################################ #
 
 # Variables could easily have been based off of Quantities in Astropy, and
@@ -458,6 +790,14 @@ class Variable(object):
 	  - .name  - A name for this variable, defaults to it's role in the dimension
 	  - .unique - A list of indicies in which these values are (potentially)
 	        unique.
+	  - .ragged - For variables with a different number of values in each
+	        record, the compact RaggedArray holding the values, else None.
+	        The padded .array is not created until it's first used.
+	  - .chunked - For variables joined from several datasets without
+	        copying, the ChunkedArray holding the values, else None.  The
+	        concatenated .array is not created until it's first used.
+	  - .grow - For variables in a dataset that is being appended to, the
+	        buffer holding the values, else None.  See Dataset.append().
 
 	Variables are very similar to Quantities in AstroPy.  Users of both das2py
 	and astropy are encouraged to use the astrohelp.py to generate Quantity
@@ -471,9 +811,12 @@ class Variable(object):
 
 			role (str) : The role this variable plays in the dimension
 
-			values (list, tuple, ndarray) : The actual data values.  If the
-				values are an array od datetime64 types, they must be in units
-				of nanoseconds since 1970-01-01
+			values (list, tuple, ndarray, RaggedArray, ChunkedArray) : The
+				actual data values.  If the values are an array od datetime64
+				types, they must be in units of nanoseconds since 1970-01-01.
+				RaggedArray values always map to the first two indices of the
+				dataset.  ChunkedArray values always start at the first index,
+				chunk axes of size 1 are broadcast to the dataset shape.
 
 			units (str) : The units for these values.  Units will be re-calculated
 				automatically when Variables are combinded.
@@ -489,10 +832,21 @@ class Variable(object):
 		self.dim = dim
 		self.name = role
 		self.units = units
+		self.ragged = None
+		self.chunked = None
+		self.grow = None
 		self.array = None
 		self.fill = fill
 		self.subrank = 0
 
+		if isinstance(values, RaggedArray):
+			self._initRagged(values, axis)
+			return
+
+		if isinstance(values, ChunkedArray):
+			self._initChunked(values, axis)
+			return
+
 		# make sure we store time arrays in ns1970
 		if units.upper() == 'UTC':
 
@@ -609,6 +963,101 @@ class Variable(object):
 			)
 
 
+	def _initRagged(self, ragged, axis):
+		"""Setup a variable with a different number of values in each record"""
+
+		if axis not in (None, 0):
+			raise DatasetError(
+				"Ragged values for %s:%s must start at the first index"%(
+				self.dim.name, self.name
+			))
+
+		if self.units.upper() == 'UTC':
+			ragged = RaggedArray(
+				ragged.values.astype('M8[ns]', copy=False), ragged.offsets
+			)
+
+		ds_shape = list(self.dim.ds.shape)
+		if (len(ds_shape) > 0) and (ds_shape[0] != len(ragged)):
+			raise DatasetError(
+				"Ragged values for %s:%s have %d records, dataset has %d"%(
+				self.dim.name, self.name, len(ragged), ds_shape[0]
+			))
+
+		nWidth = ragged.width()
+		if len(ds_shape) > 1: nWidth = max(nWidth, ds_shape[1])
+
+		shape = tuple([len(ragged), nWidth] + ds_shape[2:])
+		self.ragged = ragged
+		self.unique = [True, True] + [False]*(len(shape) - 2)
+		self._tShape = shape
+		self.dim.ds._bcast(shape)
+
+	def _initChunked(self, chunked, axis):
+		"""Setup a variable with values spread over a list of arrays"""
+
+		if axis not in (None, 0):
+			raise DatasetError(
+				"Chunked values for %s:%s must start at the first index"%(
+				self.dim.name, self.name
+			))
+
+		if self.units.upper() == 'UTC':
+			chunked = ChunkedArray(
+				[a.astype('M8[ns]', copy=False) for a in chunked.chunks]
+			)
+
+		ds_shape = list(self.dim.ds.shape)
+		if (len(ds_shape) > 0) and (ds_shape[0] != len(chunked)):
+			raise DatasetError(
+				"Chunked values for %s:%s have %d records, dataset has %d"%(
+				self.dim.name, self.name, len(chunked), ds_shape[0]
+			))
+
+		# Chunk axes of size 1 repeat to fill the dataset, extra dataset
+		# axes are added to the right
+		lShape = list(chunked.shape)
+		self.unique = [True]*len(lShape)
+		for i in range(1, len(lShape)):
+			if (i < len(ds_shape)) and (lShape[i] == 1) and (ds_shape[i] != 1):
+				lShape[i] = ds_shape[i]
+				self.unique[i] = False
+
+		if len(ds_shape) > len(lShape):
+			self.unique += [False]*(len(ds_shape) - len(lShape))
+			lShape += ds_shape[len(lShape):]
+
+		self.chunked = chunked
+		self._tShape = tuple(lShape)
+		self.dim.ds._bcast(self._tShape)
+
+	@property
+	def array(self):
+		"""The values as an ndarray with the same shape as the dataset"""
+		if (self._array is None) and (self.ragged is not None):
+			# Ragged values are padded out on first use only
+			array = self.ragged.padded(self.fill, self._tShape[1])
+			nExtra = len(self._tShape) - 2
+			if nExtra:
+				array = array[(slice(None), slice(None)) + (None,)*nExtra]
+				array = numpy.broadcast_to(array, self._tShape, subok=True)
+			self._array = array
+
+		elif (self._array is None) and (self.chunked is not None):
+			# Chunks are only joined on first use
+			self._array = _bcastTo(self.chunked.concatenate(), self._tShape)
+
+		return self._array
+
+	@array.setter
+	def array(self, array):
+		# Once new values are assigned the compact copy is out of date
+		self._array = array
+		if array is not None:
+			self.ragged = None
+			self.chunked = None
+			self.grow = None
+
 	def __str__(self):
 		lIdx = []
 		#lRng = []
@@ -625,9 +1074,23 @@ class Variable(object):
 		#sRng = ', '.join(lRng)
 
 		#return "%s['%s'][%s] %s | %s"%(self.dim.name, self.name, sIdx, self.units, sRng)
-		return "%s['%s'][%s] (%s) %s"%(self.dim.name, self.name, sIdx, self.array.dtype, self.units)
+		if self._array is None and self.ragged is not None: dtype = self.ragged.dtype
+		elif self._array is None and self.chunked is not None: dtype = self.chunked.dtype
+		else: dtype = self.array.dtype
+		return "%s['%s'][%s] (%s) %s"%(self.dim.name, self.name, sIdx, dtype, self.units)
 
 	def _bcast(self, shape):
+		if (self._array is None) and \
+		   ((self.ragged is not None) or (self.chunked is not None)):
+			# Not padded or joined yet, just remember the final shape
+			if len(shape) > len(self.unique):
+				self.unique += [False]*(len(shape) - len(self.unique))
+			if self.chunked is not None:
+				for i in range(1, len(self._tShape)):
+					if (self._tShape[i] == 1) and (shape[i] != 1): self.unique[i] = False
+			self._tShape = tuple(shape)
+			return
+
 		if shape == self.array.shape: return
 
 		# The bcast can't ask me to shift to the right, but it can ask me to
@@ -643,6 +1106,119 @@ class Variable(object):
 		# Okay, I have extra dimensions, now broadcast
 		self.array = numpy.broadcast_to(self.array, shape)
 
+	def _slice(self, dim, tKey, tShape):
+		"""Get a copy of this variable for a subset of it's dataset.  The new
+		array is a view of this one, broadcast axes stay broadcast.
+
+		Args:
+			dim (Dimension) : The dimension in the subset dataset
+
+			tKey (tuple) : One slice object for each dataset axis
+
+			tShape (tuple) : The shape of the subset dataset
+		"""
+		var = copy.copy(self)
+		var.dim = dim
+		var.unique = list(self.unique)
+		var.grow = None
+
+		if (self._array is None) and (self.ragged is not None):
+			# Whole records can be taken without padding the values
+			bWhole = tKey[0].step in (None, 1)
+			for i in range(1, len(tKey)):
+				if tKey[i].indices(self._tShape[i]) != (0, self._tShape[i], 1):
+					bWhole = False
+			if bWhole:
+				var.ragged = self.ragged[tKey[0]]
+				var._tShape = tShape
+				return var
+
+		if (self._array is None) and (self.chunked is not None):
+			# Contiguous records can be taken without joining the chunks
+			bWhole = tKey[0].step in (None, 1)
+			for i in range(1, len(tKey)):
+				if tKey[i].indices(self._tShape[i]) != (0, self._tShape[i], 1):
+					bWhole = False
+			if bWhole:
+				var.chunked = self.chunked[tKey[0]]
+				var._tShape = tShape
+				return var
+
+		var.array = self.array[tKey]
+		return var
+
+	def _append(self, new, tShape):
+		"""Add the values of a variable from another dataset to the end of
+		this one's, see Dataset.append()"""
+
+		if self.grow is None:
+			if self.ragged is not None: self.grow = _GrowRagged(self.ragged)
+			else: self.grow = _GrowAry(_core(self, self.unique))
+
+		if isinstance(self.grow, _GrowRagged):
+			self.grow.append(new.ragged)
+			self.ragged = self.grow.values()
+			self._array = None
+			self._tShape = tShape
+			return
+
+		lUnique = [bSelf or bNew for (bSelf, bNew) in zip(self.unique, new.unique)]
+		aNew = _core(new, lUnique)
+
+		if not lUnique[0]:
+			aOld = self.grow.values()
+			if (len(aOld) > 0) and (len(aNew) > 0) and not _sameValues(aOld, aNew):
+				lUnique[0] = True
+
+		if lUnique != self.unique:
+			# Copy the existing values out to the new unique axes, only
+			# happens once per axis
+			self.grow = _GrowAry(_core(self, lUnique))
+			self.unique = lUnique
+
+		if lUnique[0]: self.grow.append(_core(new, lUnique))
+		elif self.grow.nLen == 0: self.grow = _GrowAry(aNew)
+
+		self._array = _bcastTo(self.grow.values(), tShape)
+
+	def _take(self, aOrder, lAxes):
+		"""Put values in a new order along a continuous set of axes, used
+		by Dataset.sort().  Variables that are degenerate in all of these
+		axes are not changed.
+
+		Args:
+			aOrder (ndarray) : The new order of the values with the axes
+				raveled together
+
+			lAxes (list) : The continuous axes to re-order
+		"""
+		if not any(self.unique[i] for i in lAxes): return
+
+		# Whole records of ragged values can be moved without padding
+		if (lAxes == [0]) and (self._array is None) and (self.ragged is not None):
+			self.ragged = self.ragged.take(aOrder)
+			return
+
+		tShape = self.array.shape
+		lUnique = list(self.unique)
+		for i in lAxes: lUnique[i] = True
+
+		aCore = _core(self, lUnique)
+		(nBeg, nEnd) = (lAxes[0], lAxes[-1] + 1)
+		tCore = aCore.shape
+		nRavel = 1
+		for n in tCore[nBeg:nEnd]: nRavel *= n
+
+		aRaveled = aCore.reshape(tCore[:nBeg] + (nRavel,) + tCore[nEnd:])
+		aSorted = aRaveled.take(aOrder, axis=nBeg).reshape(tCore)
+		if isinstance(aCore, numpy.ma.MaskedArray):
+			# MaskedArray.take doesn't keep the fill value
+			try: aSorted.fill_value = aCore.fill_value
+			except (TypeError, ValueError): pass
+
+		self.array = _bcastTo(aSorted, tShape)
+		self.unique = lUnique
+
 	def __add__(self, other):
 		# Check that the units are compatable
 		if not _das2.can_merge(self.units, '+', other.units):
@@ -1012,11 +1588,16 @@ class Dataset(object):
 
 		Returns:
 			Dimension or Dataset
+
+		Subsets have the same rank, dimensions and properties as this dataset
+		and their arrays are views of the arrays in this dataset, so nothing
+		is copied.  Broadcast axes are still broadcast in the subset.  Ex::
+
+			dsHour = ds[100:460]      # Records 100 to 459
+			dsLow = ds[:, 0:16]       # The first 16 frequencies of each record
 		"""
 		if isinstance(key, (slice, tuple, int)):
-			#TODO: Add code here to create sub datasets by applying a tuple of
-			#      slices to all the variables.
-			raise NotImplementedError("Slicing whole datasets is not yet implemented (but wouldn't be hard to do if desired)")
+			return self._subset(key)
 
 
 		if key.startswith('coord:'):
@@ -1033,6 +1614,148 @@ class Dataset(object):
 		else:
 			return self.dCoord[key]
 
+	def _subset(self, key):
+		"""Get a dataset with views of this dataset's arrays"""
+		if not isinstance(key, tuple): key = (key,)
+		if len(key) > len(self.shape):
+			raise IndexError("Too many indices for a rank %d dataset"%len(self.shape))
+		for k in key:
+			if not isinstance(k, slice):
+				raise TypeError("Datasets are indexed by slices, use [i:i+1] to "
+				                "get a single record")
+
+		tKey = tuple(key) + (slice(None),)*(len(self.shape) - len(key))
+		tShape = tuple(
+			len(range(*tKey[i].indices(self.shape[i]))) for i in range(len(tKey))
+		)
+
+		ds = Dataset(self.name, self.group)
+		ds.rank = self.rank
+		ds.props = dict(self.props)
+		ds.shape = tShape
+
+		for (dIn, dOut) in ((self.dCoord, ds.dCoord), (self.dData, ds.dData)):
+			for sDim in dIn:
+				dim = Dimension(ds, sDim)
+				dim.props = dict(dIn[sDim].props)
+				for sRole in dIn[sDim].vars:
+					dim.vars[sRole] = dIn[sDim].vars[sRole]._slice(dim, tKey, tShape)
+				dOut[sDim] = dim
+
+		return ds
+
+	def append(self, records):
+		"""Add records to the end of this dataset.
+
+		The first call switches the dataset to growing mode.  Values that
+		change by record are copied into buffers that double in size as
+		needed, so each record is only copied about twice no matter how many
+		times append is called.  Values that don't change by record are kept
+		once as long as the new records have the same values.
+
+		While growing, variable arrays are views of the buffers.  Call
+		freeze() when done to trim the buffers down to plain arrays.
+
+		Args:
+			records (Dataset) : New records with the same dimensions,
+				variables and units as this dataset, and the same shape after
+				the first index.  The number of values in ragged axes may
+				differ.  Datasets from read_file(), read_stream(), a
+				DatasetBuilder or ds_union() may be used.  If this dataset has
+				no variables, it takes on the structure of the records.
+
+		Returns (Dataset): This dataset, to allow chaining
+
+		Raises:
+			DatasetError: If the records don't match this dataset
+		"""
+		lVars = self._allVars()
+		if len(lVars) == 0:
+			# Take on the structure of the first records, the variables are
+			# views until the next append
+			dsNew = records._subset(())
+			self.rank = dsNew.rank
+			self.props.update(dsNew.props)
+			self.shape = dsNew.shape
+			for (dIn, dOut) in ((dsNew.dCoord, self.dCoord), (dsNew.dData, self.dData)):
+				for sDim in dIn:
+					dIn[sDim].ds = self
+					dOut[sDim] = dIn[sDim]
+			return self
+
+		# Check everything before changing anything
+		lPairs = []
+		for (dSelf, dNew) in ((self.dCoord, records.dCoord), (self.dData, records.dData)):
+			if sorted(dSelf) != sorted(dNew):
+				raise DatasetError("Incompatable dimensions, %s vs %s"%(
+				                   sorted(dNew), sorted(dSelf)))
+			for sDim in dSelf:
+				if sorted(dSelf[sDim].vars) != sorted(dNew[sDim].vars):
+					raise DatasetError("Incompatable variables for %s, %s vs %s"%(
+					     sDim, sorted(dNew[sDim].vars), sorted(dSelf[sDim].vars)))
+				for sRole in dSelf[sDim].vars:
+					var = dSelf[sDim].vars[sRole]
+					new = dNew[sDim].vars[sRole]
+					if var.units != new.units:
+						raise DatasetError("Incompatable units for %s:%s: %s vs %s"%(
+						                   sDim, sRole, var.units, new.units))
+					if (var.ragged is None) != (new.ragged is None):
+						raise DatasetError(
+							"Ragged and rectangular values for %s:%s can't be "
+							"joined"%(sDim, sRole))
+					lPairs.append( (var, new) )
+
+		if len(records.shape) != len(self.shape):
+			raise DatasetError("Can't append rank %d records to a rank %d "
+			                   "dataset"%(len(records.shape), len(self.shape)))
+
+		lShape = [self.shape[0] + records.shape[0]] + list(self.shape[1:])
+		for i in range(1, len(self.shape)):
+			if records.shape[i] == self.shape[i]: continue
+
+			# Ragged axes take the widest record, if nothing else needs them
+			bRagged = (i == 1) and any(var.ragged is not None for (var, new) in lPairs)
+			bFixed = any(
+				(var.ragged is None) and (var.unique[i] or new.unique[i])
+				for (var, new) in lPairs
+			)
+			if (not bRagged) or bFixed:
+				raise DatasetError("Can't append records of shape %s to dataset "
+				                   "shape %s"%(records.shape, self.shape))
+			lShape[i] = max(self.shape[i], records.shape[i])
+
+		tShape = tuple(lShape)
+		for (var, new) in lPairs: var._append(new, tShape)
+		self.shape = tShape
+
+		for (dSelf, dNew) in ((self.dCoord, records.dCoord), (self.dData, records.dData)):
+			for sDim in dSelf: dSelf[sDim].props.update(dNew[sDim].props)
+		self.props.update(records.props)
+
+		return self
+
+	def freeze(self):
+		"""Stop growing this dataset.
+
+		The record buffers from append() are trimmed down to plain arrays
+		so no extra capacity is held.  Appending again starts new buffers.
+
+		Returns (Dataset): This dataset, to allow chaining
+		"""
+		for var in self._allVars():
+			if var.grow is None: continue
+
+			if var.ragged is not None:
+				var.ragged = RaggedArray(
+					var.ragged.values.copy(), var.ragged.offsets.copy()
+				)
+				var._array = None
+			else:
+				var._array = _bcastTo(var.grow.values().copy(), var._array.shape)
+			var.grow = None
+
+		return self
+
 	def __iter__(self):
 		# In a multithreaded application we would store the iteration state
 		# somewhere else.  This doesn't seem to be a concern in python so
@@ -1243,6 +1966,12 @@ class Dataset(object):
 		that axis.  For example in a common time, frequency 2-D cube.  Sorting on
 		time will not affect frequency values and vice versa.
 
+		Only the unique values of the sort variables are sorted, and the new
+		order is applied along the sorted axes only.  Variables that are
+		degenerate in those axes are not touched and broadcast axes stay
+		broadcast, so sorting takes little more memory than the values that
+		actually move.
+
 		Args:
 			lSortOn (str) : A list of Variable path strings stating the first sort
 			   parameter, the second sort parameter and so on.  Variable path
@@ -1280,10 +2009,9 @@ class Dataset(object):
 		bShutup = ('nowarn' in kwargs) and (kwargs['nowarn'])
 
 
-		VarInfo = namedtuple('VarInfo', 'nOrder sName var')
+		VarInfo = namedtuple('VarInfo', 'nOrder var')
 		GrpInfo = namedtuple('GrpInfo', 'lVi lUni')
 
-		lNames = []
 		lSort = []
 		iOrder = 0
 		for s in tSortOn:
@@ -1293,7 +2021,7 @@ class Dataset(object):
 			#                  TODO: Drop already sorted vars when not doing a
 			#                        lex sort
 
-			lSort.append(VarInfo(iOrder, name.replace(':','_'), var))
+			lSort.append(VarInfo(iOrder, var))
 			iOrder += 1
 
 		if len(lSort) == 0:
@@ -1351,125 +2079,64 @@ class Dataset(object):
 					perr("INFO:     %d %s\n"%(vi.nOrder, vi.var))
 
 
-		# Setup identity indicies for axis that is not touched.
-		# The indicies makes an array where the first index is the
-		# dimension number.  For each dimension there is a sub array
-		# of the same shape as 'dataset.shape', that gives the identity
-		# index of an array value for fancy indexing.
-		#
-		#  So:
-		#	  aIndices = numpy.indices(ary.shape)
-		#
-		#  Provides indexes such that this:
-		#
-		#    ary == ary[ aIndices[0], aIndices[1], aIndices[2] ]
-		#
-		# Is true
-
+		if 0 in tuple(self.shape): return None  # Nothing to move
 
 		# Make a list of all vars in dataset, we'll need this at least once
 		lVars = self._allVars()
-		aIdentOrig = None
-		bMkIdentOrig = True
 
 		# Sort each group. Groups are non-intersecting sets of indices.
 		for grp in lGroups:
 
-			# Single index sorts, these are straight forward
-			if grp.lUni.count(True) == 1:
-
-				if bMkIdentOrig:
-					aIdentOrig = numpy.indices(self.shape)
-					bMkIdentOrig = False
-
-				lIdx = [aIdentOrig[i] for i in range(len(self.shape))]
-				iSort = grp.lUni.index(True)
-
-				# Single item in single index, these are real easy
-				if len(grp.lVi) == 1:
-					aSortMe = grp.lVi[0].var.array
-
-				# Multiple items in a single index, need a record array
-				else:
-					lArrays = [ vi.var.array for vi in grp.lVi]
-					lNames = [ vi.sName for vi in grp.lVi]
-					aSortMe = numpy.rec.fromarrays(lArrays, names=lNames)
-
-				# The actual sort
-				lIdx[iSort] = numpy.argsort(aSortMe, kind="mergesort", axis=iSort)
-
-				for var in lVars:
-					var.array = var.array[tuple(lIdx)]
-
+			lAxes = [i for i in range(len(grp.lUni)) if grp.lUni[i]]
+			if len(lAxes) == 0: continue   # Sort keys are constant
 
-			# Multiple index sorts:
-			else:
-
-				# First determine our new shape, make sure all raveled indicies
-				# are continuous can't have this:  False, True, True, False, True
-				nSwitch = 0
-				for i in range(1, len(self.shape)):
-					if grp.lUni[i] != grp.lUni[i-1]: nSwitch += 1
-
-				if nSwitch > 2:
-					raise DatasetError(
-						"Can't sort on variables that are unique in discontinuous"
-						"index positions.  You'll need to use Pandas"
-					)
-
-				lReshape = []
-				nRavel = 1
-				bRaveling = False
-				iSort = None
-				for i in range(len(self.shape)):
-					if grp.lUni[i]:
-						if iSort == None:  iSort = i
-						bRaveling = True
-						nRavel *= self.shape[i]
-					else:
-						if bRaveling:
-							lReshape.append(nRavel)
-							bRaveling = False
-						lReshape.append(self.shape[i])
-
-				if bRaveling: lReshape.append(nRavel)
-
-				if perr:
-					perr("INFO: Reshaping for multi-index sort: %s -> %s\n"%(
-					     list(self.shape), lReshape))
-
-				# Make the identity array for this new shape
-				aIdent = numpy.indices(lReshape)
-				lIdx = [aIdent[i] for i in range(len(lReshape))]
-
-				# Single item multi index.
-				if len(grp.lVi) == 1:
-					aReshaped = grp.lVi[0].var.array.reshape(lReshape)
-
-				# The biggest difficulty, multi-items multi-indexes
-				else:
-					lArrays = [ vi.var.array for vi in grp.lVi]
-					lNames = [ vi.sName for vi in grp.lVi]
-					aReshaped = numpy.rec.fromarrays(lArrays, names=lNames).reshape(lReshape)
-
-				# Issue a warning if duplicates are detected in multi-index
-				# sorting arrays.  This usually means axes are going to get
-				# mushed, which is typically not what people want!
-				if not bShutup:
-					lDupSlice = [slice(1)]*len(lReshape)
-					lDupSlice[iSort] = slice(None)
-					aDupTest = aReshaped[lDupSlice].squeeze()
-					lDup = [item for item,count in Counter(aDupTest).items() if count > 1]
-					if len(lDup) > 0:
-						sys.stderr.write("WARNING: For dataset %s! Duplicate items detected in "
-						                 "multi-index sort array. Your data may no "
-											  "longer make sense!\n"%self.name)
-
-				# The actual sort
-				lIdx[iSort] = numpy.argsort(aReshaped, kind="mergesort", axis=iSort)
-
-				for var in lVars:
-					var.array = var.array.reshape(lReshape)[lIdx].reshape(self.shape)
+			# Raveled indicies must be continuous can't have this:
+			# False, True, True, False, True
+			if lAxes[-1] - lAxes[0] + 1 != len(lAxes):
+				raise DatasetError(
+					"Can't sort on variables that are unique in discontinuous"
+					"index positions.  You'll need to use Pandas"
+				)
+
+			# Sort keys only vary in the group axes, so only that slice of
+			# each key is sorted.  The same order then applies at every
+			# position in the other axes.
+			tKey = tuple(
+				slice(None) if grp.lUni[i] else 0 for i in range(len(self.shape))
+			)
+			lKeys = []
+			for vi in grp.lVi:
+				aKey = vi.var.array[tKey].ravel()
+				if isinstance(aKey, numpy.ma.MaskedArray):
+					# Masked values go last, same as MaskedArray.argsort
+					lKeys.append(numpy.ma.getmaskarray(aKey))
+					aKey = aKey.data
+				lKeys.append(aKey)
+
+			if perr and (len(lAxes) > 1):
+				perr("INFO: Raveling axes %s for multi-index sort, %d values\n"%(
+				     ",".join(g_sIdxNames[i] for i in lAxes), len(lKeys[0])))
+
+			# lexsort is stable and takes the primary key last
+			aOrder = numpy.lexsort(lKeys[::-1])
+
+			# Issue a warning if duplicates are detected in multi-index
+			# sorting arrays.  This usually means axes are going to get
+			# mushed, which is typically not what people want!
+			if (len(lAxes) > 1) and (not bShutup) and (len(aOrder) > 1):
+				aDup = numpy.ones(len(aOrder) - 1, dtype=bool)
+				for aKey in lKeys:
+					aSorted = aKey[aOrder]
+					aDup &= (aSorted[1:] == aSorted[:-1])
+				if aDup.any():
+					sys.stderr.write("WARNING: For dataset %s! Duplicate items detected in "
+					                 "multi-index sort array. Your data may no "
+					                 "longer make sense!\n"%self.name)
+
+			# The actual sort, variables that are degenerate in these axes
+			# are left alone
+			for var in lVars:
+				var._take(aOrder, lAxes)
 
 
 	def ravel(self):
@@ -1657,7 +2324,11 @@ def _mk_var_from_raw(dim, dRawDs, sRole, sExp, sUnits, bMask=False):
 	# If I'm supposed to mask fill values do so (unless it's already been done)
 	# note this modifies dRawDs
 	fill = None
-	if bMask and not isinstance(array, numpy.ma.MaskedArray):
+	if bMask and isinstance(array, RaggedArray):
+		# Ragged values are masked when they are padded out, if ever
+		fill = dRawDs['fill'][sName]
+
+	elif bMask and not isinstance(array, numpy.ma.MaskedArray):
 		fill = dRawDs['fill'][sName]
 
 		if array.dtype.name.startswith('timedelta64'):
@@ -1727,6 +2398,17 @@ def ds_from_raw(dRawDs):
 
 	ds.shape = dRawDs['shape']
 
+	# Ragged arrays come across as (values, offsets) tuples.  The ragged
+	# index sizes are set by the variables that use them.
+	for sAry in dRawDs['arrays']:
+		if isinstance(dRawDs['arrays'][sAry], tuple):
+			dRawDs['arrays'][sAry] = RaggedArray(*dRawDs['arrays'][sAry])
+
+	for i in range(len(ds.shape)):
+		if ds.shape[i] < 0:
+			ds.shape = tuple(ds.shape[:i])
+			break
+
 	for sDim in dRawDs['data']:
 		dRawDim = dRawDs['data'][sDim]
 
@@ -1769,7 +2451,50 @@ def ds_strip_empty(lDatasets):
 	return lOut
 
 
-def ds_union(lDs, bAllowRankReduce=True):
+def _unionRagged(lVars):
+	"""Join the compact values of ragged variables, or None if any of the
+	variables has been padded out already"""
+	for var in lVars:
+		if (var._array is not None) or (var.ragged is None): return None
+
+	lValues = [var.ragged.values for var in lVars]
+	lOffsets = [lVars[0].ragged.offsets]
+	for var in lVars[1:]:
+		lOffsets.append(var.ragged.offsets[1:] + lOffsets[-1][-1])
+
+	return RaggedArray(_concat(lValues), numpy.concatenate(lOffsets))
+
+def _unionVar(lVars, tShape, bChunked):
+	"""Join the values of one variable from several datasets along the first
+	index.  Only unique axes are copied, the rest stay broadcast.
+
+	Returns (tuple) : The values, ndarray or ChunkedArray, and the list of
+		unique axes for the output variable.
+	"""
+	nAxes = len(tShape)
+	lUnique = [False]*nAxes
+	for var in lVars:
+		for i in range(min(nAxes, len(var.unique))):
+			if var.unique[i]: lUnique[i] = True
+
+	# Values that don't change by record are kept once if all inputs agree
+	if not lUnique[0]:
+		lCores = [_core(var, lUnique) for var in lVars if var.array.shape[0] > 0]
+		if len(lCores) == 0: lCores = [_core(lVars[0], lUnique)]
+		bSame = True
+		for a in lCores[1:]:
+			if not _sameValues(a, lCores[0]):
+				bSame = False
+				break
+		if bSame: return (_bcastTo(lCores[0], tShape), lUnique)
+		lUnique[0] = True
+
+	lCores = [_core(var, lUnique) for var in lVars]
+	if bChunked: return (ChunkedArray(lCores), lUnique)
+
+	return (_bcastTo(_concat(lCores), tShape), lUnique)
+
+def ds_union(lDs, bAllowRankReduce=True, bChunked=False):
 	"""Concatenate a list of datasets from the same group into a single
 	dataset.
 
@@ -1777,6 +2502,10 @@ def ds_union(lDs, bAllowRankReduce=True):
 	shape in axis 1 and all higher axes are not the same, the data will be
 	joined as scatter data and the rank of the resulting dataset will be 1.
 
+	Otherwise only the unique axes of each variable are copied.  Values that
+	are degenerate in the first index and the same in all inputs are kept
+	once and broadcast, ragged values are joined without padding.
+
 	Args:
 		lDs (list) : A list of datasets which must have the same physical
 			dimensions and variables, but not the same shape in index space.
@@ -1785,6 +2514,11 @@ def ds_union(lDs, bAllowRankReduce=True):
 			concatenated via rank reduction.   If reshaping is required to
 			create the union dataset and exception will be thrown instead.
 
+		bChunked (boolean, optional) : If True, values that differ by record
+			are not copied at all.  The output variables hold a ChunkedArray
+			of views into the inputs and are only joined if .array is used.
+			Not used when the rank is reduced.
+
 	Returns:
 		Dataset : A new dataset consisting of a union of all the provided
 		datasets is returned.  If only one dataset is provided it is returned
@@ -1849,21 +2583,31 @@ def ds_union(lDs, bAllowRankReduce=True):
 
 
 	# Merge all the arrays
+	if not bFlatten:
+		tShape = (sum(ds.shape[0] for ds in lDs),) + tuple(ds0.shape[1:])
+
 	for sDim in ds0:
 		dimOut = dsOut[sDim]
 
 		for sVar in ds0[sDim]:
-
-			if bFlatten:
-				lArys = [ds[sDim][sVar].array.ravel() for ds in lDs]
-			else:
-				lArys = [ds[sDim][sVar].array for ds in lDs]
-
-			aOut = numpy.concatenate(lArys, axis=0)
-
+			lVars = [ds[sDim][sVar] for ds in lDs]
 			sUnits = ds0[sDim][sVar].units
+			fill = ds0[sDim][sVar].fill
 
-			dsOut[sDim].var(sVar, aOut, sUnits)
+			# Scatter data has to be copied, every value is unique
+			if bFlatten:
+				aOut = _concat([var.array.ravel() for var in lVars])
+				dimOut.var(sVar, aOut, sUnits, fill=fill)
+				continue
+
+			ragged = _unionRagged(lVars)
+			if ragged is not None:
+				dimOut.var(sVar, ragged, sUnits, fill=fill)
+				continue
+
+			(values, lUnique) = _unionVar(lVars, tShape, bChunked)
+			var = dimOut.var(sVar, values, sUnits, fill=fill)
+			var.unique = lUnique
 
 	return dsOut
 
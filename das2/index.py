@@ -0,0 +1,360 @@
+# The MIT License
+#
+# Copyright 2022 Chris Piker
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Sidecar time indexes for das2.2 and das3 stream files.  An index maps the
+first time value of each data packet to it's location in the file so that
+time ranges can be pulled out of large files without decoding all of them.
+"""
+
+import os
+import os.path
+import datetime
+
+import numpy
+
+from . import dastime
+from . reader import PacketReader, MmapBuffer, HeaderError, HdrPkt, \
+	DataHdrPkt, DataPkt
+from . builder import DatasetBuilder, QStreamState, mkLayout
+from . dataset import ds_union
+
+g_sIdxExt = '.tidx'
+g_nIdxFormat = 1
+
+def index_path(sFile):
+	"""Get the name of the sidecar index file for a stream file"""
+	return sFile + g_sIdxExt
+
+def _toNs(time):
+	"""Convert a string, DasTime, datetime or datetime64 to datetime64[ns]"""
+	if isinstance(time, numpy.datetime64):
+		return time.astype('M8[ns]')
+	if isinstance(time, datetime.datetime):
+		return numpy.datetime64(time, 'ns')
+	return numpy.datetime64(str(dastime.DasTime(time)), 'ns')
+
+def _trimTime(ds, layout, nBeg, nEnd):
+	"""Keep only the records of a dataset with times in [nBeg, nEnd)"""
+	iTime = layout.timeVar()
+	if (iTime is None) or (len(ds.shape) == 0) or (ds.shape[0] == 0): return ds
+
+	vd = layout.lVars[iTime]
+	aTime = ds.dCoord[vd.sDim].vars[vd.sRole].array
+	aTime = aTime[(slice(None),) + (0,)*(aTime.ndim - 1)]
+	aKeep = (aTime >= nBeg) & (aTime < nEnd)
+	if aKeep.all(): return ds
+
+	# Starts and ends of each run of records to keep
+	aEdge = numpy.flatnonzero(numpy.diff(
+		numpy.concatenate(([0], aKeep.astype('int8'), [0]))
+	))
+	if len(aEdge) == 0: return ds[0:0]
+
+	dsOut = ds_union([ds[aEdge[i]:aEdge[i+1]] for i in range(0, len(aEdge), 2)])
+	dsOut.name = ds.name
+	return dsOut
+
+# ########################################################################### #
+
+class TimeIndex(object):
+	"""The packet time index for a single stream file.
+
+	Data packets are listed in stream order in the arrays:
+
+		- .aId - The packet ID of each data packet
+		- .aTime - The first time value in each packet, NaT if the packet
+		  has no time coordinate
+		- .aOffset - The file offset of the packet content
+		- .aLength - The length of the packet content
+
+	Header packets are kept whole so that a reader doesn't need to look at
+	anything before the first data packet it wants:
+
+		- .lHdrs - List of (nBefore, tag, id, content) tuples where nBefore
+		  is the number of data packets preceding the header.
+	"""
+
+	def __init__(self, sFile, nSize, nMtime, sVersion):
+		self.sFile = sFile
+		self.sVersion = sVersion
+		self.nSize = nSize
+		self.nMtime = nMtime
+		self.lHdrs = []
+		self.aId = numpy.zeros(0, dtype='int32')
+		self.aTime = numpy.zeros(0, dtype='M8[ns]')
+		self.aOffset = numpy.zeros(0, dtype='int64')
+		self.aLength = numpy.zeros(0, dtype='int64')
+
+	@staticmethod
+	def build(sFile):
+		"""Scan a stream file and create an index for it
+
+		Args:
+			sFile (str) - The file to index
+
+		Returns (TimeIndex)
+		"""
+		st = os.stat(sFile)
+		lId = []
+		lTime = []
+		lOffset = []
+		lLength = []
+		dLayouts = {}
+		qs = QStreamState()
+		rNaT = numpy.datetime64('NaT', 'ns')
+
+		with open(sFile, 'rb') as fIn, PacketReader(fIn, bMmap=True) as reader:
+			idx = TimeIndex(sFile, st.st_size, st.st_mtime_ns, reader.sVersion)
+			for pkt in reader:
+				if isinstance(pkt, DataPkt):
+					layout = dLayouts.get(pkt.id, None)
+					if layout: lTime.append(layout.firstTime(pkt.content))
+					else: lTime.append(rNaT)
+					lId.append(pkt.id)
+					lOffset.append(reader.nOffset - pkt.length)
+					lLength.append(pkt.length)
+					continue
+
+				if pkt.tag not in ('Sx', 'Hx'): continue  # Comments, etc.
+
+				idx.lHdrs.append( (len(lId), pkt.tag, pkt.id, pkt.content) )
+				if pkt.tag == 'Sx' and pkt.sver == 'qstream':
+					qs.streamHdr(pkt.docTree().getroot())
+				if isinstance(pkt, DataHdrPkt):
+					try:
+						dLayouts[pkt.id] = mkLayout(pkt, qs)
+					except HeaderError:
+						dLayouts[pkt.id] = None  # Not decodable, can't get times
+
+			pkt = None  # Data packets are views into the map
+
+		idx.aId = numpy.array(lId, dtype='int32')
+		idx.aTime = numpy.array(lTime, dtype='M8[ns]')
+		idx.aOffset = numpy.array(lOffset, dtype='int64')
+		idx.aLength = numpy.array(lLength, dtype='int64')
+		return idx
+
+	def save(self, sOut=None):
+		"""Write the index to a sidecar file
+
+		Args:
+			sOut (str, optional) - The output file, defaults to the stream
+				file name with '.tidx' appended.
+		"""
+		if sOut is None: sOut = index_path(self.sFile)
+
+		# Pack the headers into one byte array to avoid pickled objects
+		xHdrs = b''.join(t[3] for t in self.lHdrs)
+		aHdrLen = numpy.array([len(t[3]) for t in self.lHdrs], dtype='int64')
+
+		with open(sOut, 'wb') as fOut:
+			numpy.savez(fOut,
+				info=numpy.array([g_nIdxFormat, self.nSize, self.nMtime], dtype='int64'),
+				version=numpy.array(self.sVersion, dtype='U'),
+				hdr_before=numpy.array([t[0] for t in self.lHdrs], dtype='int64'),
+				hdr_tag=numpy.array([t[1] for t in self.lHdrs], dtype='S2'),
+				hdr_id=numpy.array([t[2] for t in self.lHdrs], dtype='int32'),
+				hdr_len=aHdrLen,
+				hdr_bytes=numpy.frombuffer(xHdrs, dtype='uint8'),
+				id=self.aId, time=self.aTime, offset=self.aOffset,
+				length=self.aLength
+			)
+
+	@staticmethod
+	def load(sFile, sIdx=None):
+		"""Read the sidecar index for a stream file
+
+		Args:
+			sFile (str) - The stream file that was indexed
+			sIdx (str, optional) - The index file, defaults to the stream
+				file name with '.tidx' appended.
+
+		Returns (TimeIndex): The index, or None if it's missing, in an
+			unknown format, or out of date with respect to the stream file.
+		"""
+		if sIdx is None: sIdx = index_path(sFile)
+		if not os.path.isfile(sIdx): return None
+
+		st = os.stat(sFile)
+		with numpy.load(sIdx, allow_pickle=False) as npz:
+			aInfo = npz['info']
+			if (aInfo[0] != g_nIdxFormat) or (aInfo[1] != st.st_size) or \
+			   (aInfo[2] != st.st_mtime_ns):
+				return None
+
+			idx = TimeIndex(sFile, st.st_size, st.st_mtime_ns, str(npz['version']))
+			xHdrs = npz['hdr_bytes'].tobytes()
+			aEnd = numpy.cumsum(npz['hdr_len'])
+			nBeg = 0
+			for i in range(len(aEnd)):
+				idx.lHdrs.append((
+					int(npz['hdr_before'][i]), npz['hdr_tag'][i].decode('utf-8'),
+					int(npz['hdr_id'][i]), xHdrs[nBeg:aEnd[i]]
+				))
+				nBeg = aEnd[i]
+
+			idx.aId = npz['id']
+			idx.aTime = npz['time']
+			idx.aOffset = npz['offset']
+			idx.aLength = npz['length']
+
+		return idx
+
+	def select(self, beg, end):
+		"""Find the data packets that overlap a time range
+
+		Since only the first time in each packet is indexed, the packet just
+		before the start time is included as well.  Packets with IDs that have
+		no time coordinate are always included.
+
+		Args:
+			beg - The start of the range, inclusive, as a string, DasTime,
+				datetime or numpy.datetime64
+			end - The end of the range, exclusive
+
+		Returns (numpy.ndarray): Sorted data packet numbers
+		"""
+		nBeg = _toNs(beg)
+		nEnd = _toNs(end)
+
+		lSel = []
+		for nId in numpy.unique(self.aId):
+			aPos = numpy.flatnonzero(self.aId == nId)
+			aTime = self.aTime[aPos]
+
+			if numpy.isnat(aTime).any():
+				lSel.append(aPos)
+				continue
+
+			if numpy.all(aTime[1:] >= aTime[:-1]):
+				i0 = max(numpy.searchsorted(aTime, nBeg, 'right') - 1, 0)
+				i1 = numpy.searchsorted(aTime, nEnd, 'left')
+				lSel.append(aPos[i0:i1])
+			else:
+				# Out of order times, no shortcuts
+				lSel.append(aPos[(aTime >= nBeg) & (aTime < nEnd)])
+
+		if len(lSel) == 0: return numpy.zeros(0, dtype='int64')
+		return numpy.sort(numpy.concatenate(lSel))
+
+	def read(self, beg, end, ids=None, vars=None):
+		"""Decode only the packets that overlap a time range
+
+		The stream file is memory mapped and the selected packets are read
+		directly from their recorded offsets.
+
+		Args:
+			beg - The start of the range, see select()
+			end - The end of the range, see select()
+			ids (set, optional) - Only read these packet IDs
+			vars (set, optional) - Only decode these data dimensions, see
+				DatasetBuilder
+
+		Returns (list): Dataset objects, one for each data header in effect
+			during the time range.  Records are trimmed to the time range
+			on the same time coordinate used to index the packets.
+		"""
+		aSel = self.select(beg, end)
+		if ids is not None:
+			aSel = aSel[numpy.isin(self.aId[aSel], list(ids))]
+		nFirst = aSel[0] if len(aSel) > 0 else len(self.aId)
+
+		# Headers before the first selected packet, only the last one of each
+		# kind is needed
+		dPrior = {}
+		iHdr = 0
+		while iHdr < len(self.lHdrs) and self.lHdrs[iHdr][0] <= nFirst:
+			(nBefore, sTag, nId, xHdr) = self.lHdrs[iHdr]
+			dPrior[(sTag, nId)] = iHdr
+			iHdr += 1
+
+		sVer = self.sVersion
+		builder = DatasetBuilder(vars=vars)
+
+		def addHdr(i):
+			(nBefore, sTag, nId, xHdr) = self.lHdrs[i]
+			if (ids is not None) and (sTag != 'Sx') and (nId not in ids): return
+			if sTag == 'Sx':
+				pkt = HdrPkt(sVer, sTag, nId, len(xHdr), xHdr)
+			else:
+				pkt = DataHdrPkt(sVer, sTag, nId, len(xHdr), xHdr)
+			builder.add(pkt)
+
+		with open(self.sFile, 'rb') as fIn, MmapBuffer(fIn) as buf:
+			for i in sorted(dPrior.values()): addHdr(i)
+
+			for nPkt in aSel:
+				while iHdr < len(self.lHdrs) and self.lHdrs[iHdr][0] <= nPkt:
+					addHdr(iHdr)
+					iHdr += 1
+
+				nLen = int(self.aLength[nPkt])
+				xData = buf.view(int(self.aOffset[nPkt]), nLen)
+				builder.add(DataPkt(sVer, 'Pd', int(self.aId[nPkt]), nLen, xData))
+
+			# Datasets copy the decoded values, so the map may be closed
+			xData = None
+			lDs = builder.datasets()
+
+		# Selected packets can start before the range or hold records past it
+		(nBeg, nEnd) = (_toNs(beg), _toNs(end))
+		return [
+			_trimTime(lDs[i], builder.lAccum[i].layout, nBeg, nEnd)
+			for i in range(len(lDs))
+		]
+
+# ########################################################################### #
+
+def write_index(sFile, sOut=None):
+	"""Index a stream file and save the result as a sidecar file
+
+	Args:
+		sFile (str) - The das2.2 or das3 stream file to index
+		sOut (str, optional) - The index file to write, defaults to the stream
+			file name with '.tidx' appended.
+
+	Returns (TimeIndex)
+	"""
+	idx = TimeIndex.build(sFile)
+	idx.save(sOut)
+	return idx
+
+def read_time_range(sFile, beg, end, ids=None, vars=None):
+	"""Read only the data packets of a stream file that overlap a time range
+
+	Uses the sidecar index if it's present and up to date, otherwise the
+	file is scanned to build a temporary index.
+
+	Args:
+		sFile (str) - The das2.2 or das3 stream file to read
+		beg - The start of the range, inclusive, as a string, DasTime,
+			datetime or numpy.datetime64
+		end - The end of the range, exclusive
+		ids (set, optional) - Only read these packet IDs
+		vars (set, optional) - Only decode these data dimensions
+
+	Returns (list): Dataset objects
+	"""
+	idx = TimeIndex.load(sFile)
+	if idx is None: idx = TimeIndex.build(sFile)
+	return idx.read(beg, end, ids, vars)
@@ -21,10 +21,14 @@
 # SOFTWARE.
 
 
-"""Small helpers for writing das2 and Q stream packets"""
+"""Small helpers for writing das2, das3 and Q stream packets"""
 
 import os
 import struct
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy
 
 EXCEPT_NODATA = "NoDataInInterval"
 EXCEPT_BADARG = "IllegalArgument"
@@ -46,19 +50,161 @@ except NameError:
 # code, what a PITA. 
 
 def fwrite(thing, stuff):
+	"""Write bytes to a binary file, or to the binary buffer under a text
+	file such as sys.stdout.  Text files are flushed first so that text
+	written to them earlier stays ahead of the bytes.
+	"""
 	try:
 		b = thing.buffer
 	except AttributeError:
 		b = thing
+	else:
+		thing.flush()
 	b.write(stuff)
 
+def _sent(fOut, bFlush):
+	"""Finish sending a packet, a StreamWriter decides on it's own when to
+	flush."""
+	if isinstance(fOut, StreamWriter): return
+	if bFlush: fOut.flush()
+
+##############################################################################
+class StreamWriter(object):
+	"""Coalesce packets into large writes.
+
+	All the send functions in this module accept a StreamWriter in place of
+	a file object.  Packets are kept, not copied, until the pending bytes
+	reach a size limit, the oldest pending packet reaches an age limit, or
+	flush() is called.  Pending packets are then output with a single
+	os.writev() call when the output has a file descriptor, otherwise they
+	are joined into one buffer and written at once.  Example:
+
+		with StreamWriter(sys.stdout) as fOut:
+			hdr.send(fOut)
+			for ...:
+				buf.add(...)
+				buf.send(fOut)
+
+	The age limit is checked as packets arrive, there is no timer thread.
+	Call flush() before waiting on anything slow, such as a database query,
+	so that clients are not left waiting on data that is already available.
+	"""
+
+	def __init__(self, fOut, nFlushBytes=1048576, rFlushSec=None):
+		"""
+		Args:
+			fOut (file) - The output, a binary file or a text file with a
+				binary .buffer member, such as sys.stdout
+
+			nFlushBytes (int) - Write out pending packets once at least this
+				many bytes are held
+
+			rFlushSec (float) - If not None, write out pending packets once
+				the oldest has been held at least this many seconds
+		"""
+		self.fText = None  # Text layer over fOut, if any
+		try:
+			self.fOut = fOut.buffer
+			self.fText = fOut
+		except AttributeError:
+			self.fOut = fOut
+
+		self.nFlushBytes = nFlushBytes
+		self.rFlushSec = rFlushSec
+		self.lPending = []
+		self.nPending = 0
+		self.rOldest = None
+
+		# Gather writes are only used for real files and sockets
+		self.nFd = None
+		self.nIovMax = 1024
+		if hasattr(os, 'writev'):
+			try:
+				self.nFd = self.fOut.fileno()
+			except (AttributeError, ValueError, IOError):
+				pass
+			try:
+				self.nIovMax = os.sysconf('SC_IOV_MAX')
+			except (AttributeError, ValueError, OSError):
+				pass
+
+	def write(self, stuff):
+		"""Hold a bytes-like object for output, strings are encoded as UTF-8.
+		The object must not be changed until it has been flushed.
+		"""
+		if isinstance(stuff, basestring) and not isinstance(stuff, bytes):
+			stuff = stuff.encode('utf-8')
+		mv = memoryview(stuff).cast('B')
+		if mv.nbytes == 0: return
+
+		if self.rOldest is None: self.rOldest = time.time()
+		self.lPending.append(mv)
+		self.nPending += mv.nbytes
+
+		if self.nPending >= self.nFlushBytes: self.flush()
+		elif (self.rFlushSec is not None) and \
+		     (time.time() - self.rOldest >= self.rFlushSec):
+			self.flush()
+
+	def pending(self):
+		"""Get the number of bytes waiting to be written"""
+		return self.nPending
+
+	def _writev(self):
+		"""Write all pending buffers to the file descriptor, handling short
+		writes"""
+		lBufs = self.lPending
+		while len(lBufs) > 0:
+			nWrote = os.writev(self.nFd, lBufs[:self.nIovMax])
+			while nWrote > 0:
+				if nWrote >= lBufs[0].nbytes:
+					nWrote -= lBufs[0].nbytes
+					lBufs = lBufs[1:]
+				else:
+					lBufs[0] = lBufs[0][nWrote:]
+					nWrote = 0
+
+	def flush(self):
+		"""Write out all pending packets now"""
+		if self.nPending > 0:
+			# Text written to the text layer directly goes out first
+			if self.fText is not None: self.fText.flush()
+			if self.nFd is not None:
+				self.fOut.flush()   # Anything written to the file directly
+				self._writev()
+			elif len(self.lPending) == 1:
+				self.fOut.write(self.lPending[0])
+			else:
+				self.fOut.write(b''.join(self.lPending))
+
+			self.lPending = []
+			self.nPending = 0
+			self.rOldest = None
+
+		self.fOut.flush()
+
+	def close(self):
+		"""Flush pending packets, the underlying file is not closed"""
+		self.flush()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, xType, xValue, traceback):
+		self.close()
+		return False
+
 ##############################################################################
 class HdrBuf(object):
-	"""Write a Das2 or QStream UTF-8 buffer"""
+	"""Write a Das2, das3 or QStream UTF-8 header buffer.  Use sFmt='das3'
+	for das3 variable length tags, ID 0 is the stream header '|Sx||LEN|' and
+	other IDs are dataset headers '|Hx|ID|LEN|'."""
 	
 	def __init__(self, nPktId, sFmt='das2'):
 		if nPktId < 0 or nPktId > 99:
 			raise ValueError("Invalid Packet ID: %s"%nPktId)
+		if sFmt not in ('das2', 'qstream', 'das3'):
+			raise ValueError("Unknown stream format '%s'"%sFmt)
 		
 		self.sFmt = sFmt
 		self.nPktId = nPktId
@@ -77,18 +223,23 @@ class HdrBuf(object):
 			self.lText.append(sTxt)
 	
 	
-	def send(self, fOut):
-		"""Sending clears the buffer"""
+	def send(self, fOut, bFlush=True):
+		"""Sending clears the buffer.  Set bFlush to False to leave flushing
+		the output up to the caller."""
 		uOut = u"".join(self.lText)
 		xOut = uOut.encode('utf-8')
 		nLen = len(xOut)
-		sHdr = '[%02d]%06d'%(self.nPktId, nLen)
+		if self.sFmt != 'das3':
+			sHdr = '[%02d]%06d'%(self.nPktId, nLen)
+		elif self.nPktId == 0:
+			sHdr = '|Sx||%d|'%nLen
+		else:
+			sHdr = '|Hx|%d|%d|'%(self.nPktId, nLen)
 		xHdr = sHdr.encode('utf-8')
 		
-		fwrite(fOut, xHdr)
-		fwrite(fOut, xOut)
+		fwrite(fOut, xHdr + xOut)
 		
-		fOut.flush()
+		_sent(fOut, bFlush)
 						
 		if self.sFmt == 'qstream':
 			self.lText = [u'<?xml version="1.0" encoding="UTF-8"?>\n']
@@ -99,19 +250,31 @@ class HdrBuf(object):
 
 ##############################################################################
 class PktBuf(object):
-	"""Write python data values to a das2 or Q stream, defaults to little 
-	endian"""
-	def __init__(self, nPktId):
+	"""Write python data values to a das2, das3 or Q stream, defaults to little 
+	endian.  das3 packets are tagged '|Pd|ID|LEN|' when sent, so each one
+	may have a different length."""
+	def __init__(self, nPktId, sFmt='das2'):
 		if nPktId < 0 or nPktId > 99:
 			raise ValueError("Invalid Packet ID: %s"%nPktId)
+		if sFmt not in ('das2', 'qstream', 'das3'):
+			raise ValueError("Unknown stream format '%s'"%sFmt)
 			
 		self.nPktId = nPktId
-		if g_nPyVer == 2:
+		self.sFmt = sFmt
+		self._reset()
+		
+	def _reset(self):
+		if self.sFmt == 'das3':
+			self.lBytes = []  # Tag depends on the length, added by send()
+		elif g_nPyVer == 2:
 			self.lBytes = [':%02d:'%self.nPktId]
 		else:
 			self.lBytes = [bytes(':%02d:'%self.nPktId, 'utf-8')]
 		
 		self.xOut = None
+
+	def _tag(self, nBytes):
+		return ('|Pd|%d|%d|'%(self.nPktId, nBytes)).encode('utf-8')
 		
 	def add(self, sTxt):
 		"""Add a string or bytearray to the output packet.  These are copied
@@ -141,10 +304,15 @@ class PktBuf(object):
 		elif isinstance(lVals, int):
 			sBytes = struct.pack(sFmt, float(lVals))
 			self.lBytes.append(sBytes)
+		elif isinstance(lVals, numpy.ndarray):
+			# Convert the whole array at once, sFmt is endian + type code
+			self.lBytes.append(lVals.astype(sFmt).tobytes())
 		else:
-			for fVal in lVals:
-				sBytes = struct.pack(sFmt, fVal)
-				self.lBytes.append(sBytes)
+			# One pack call for the whole sequence
+			lVals = list(lVals)
+			self.lBytes.append(struct.pack(
+				"%s%d%s"%(sFmt[0], len(lVals), sFmt[1:]), *lVals
+			))
 				
 		self.xOut = None
 	
@@ -174,9 +342,11 @@ class PktBuf(object):
 		"""Get the current size of the output buffer in bytes"""
 		if self.xOut == None:
 			if g_nPyVer == 2:
-				self.xOut = ''.join(self.lText)
+				self.xOut = ''.join(self.lBytes)
 			else:
-				self.xOut = b''.join(self.lText)
+				self.xOut = b''.join(self.lBytes)
+			if self.sFmt == 'das3':
+				self.xOut = self._tag(len(self.xOut)) + self.xOut
 			
 		# Following has to change for Python 3, but heck *everything* we do
 		# has to change for python 3 since we deal with binary data all the
@@ -184,35 +354,211 @@ class PktBuf(object):
 		# Guido, that dosen't affect us at all (ugh).
 		return len(self.xOut)
 		
-	def send(self, fOut):
-		"""Sending clears the buffer"""
+	def send(self, fOut, bFlush=True):
+		"""Sending clears the buffer.  Set bFlush to False to leave flushing
+		the output up to the caller."""
 		if self.xOut == None:
 			if g_nPyVer == 2:
 				self.xOut = ''.join(self.lBytes)
 			else:
 				self.xOut = b''.join(self.lBytes)
+			if self.sFmt == 'das3':
+				self.xOut = self._tag(len(self.xOut)) + self.xOut
 		
 		fwrite(fOut, self.xOut)	
-		fOut.flush()
-		
-		if g_nPyVer == 2:
-			self.lBytes = [':%02d:'%self.nPktId]
-		else:
-			self.lBytes = [bytes(':%02d:'%self.nPktId, 'utf-8')]
+		_sent(fOut, bFlush)
 		
-		self.xOut = None
+		self._reset()
 
 		
 
 ##############################################################################
-def sendComment(fOut, sType, sValue, sSource=""):
+def _columns(lCols):
+	"""Interleave column arrays into a packed structured array"""
+	lCols = [numpy.asarray(a) for a in lCols]
+	nRecs = len(lCols[0]) if lCols[0].ndim > 0 else 0
+	for a in lCols:
+		if a.ndim == 0 or len(a) != nRecs:
+			raise ValueError("All columns must have %d records"%nRecs)
+
+	aRecs = numpy.empty(nRecs, dtype=[
+		('f%d'%i, a.dtype, a.shape[1:]) for i, a in enumerate(lCols)
+	])
+	for i, a in enumerate(lCols): aRecs['f%d'%i] = a
+	return aRecs
+
+class PktArrayBuf(object):
+	"""Write many data packets from NumPy arrays, one packet per record.
+
+	All the records added before a send() are output in a single write.  The
+	packet tags and the record payloads are interleaved in one NumPy buffer,
+	no per-value packing is done in python.
+
+	Columns are written with their own dtypes, so the caller picks the byte
+	order and size, ex: '<f8' for little_endian_real8 or 'S10' for ascii10.
+	Example:
+
+		buf = PktArrayBuf(1)
+		buf.add(aTime.astype('<f8'), aSpectra.astype('<f4'))
+		buf.send(fOut)
+	"""
+
+	def __init__(self, nPktId, sFmt='das2'):
+		"""
+		Args:
+			nPktId (int) - The packet ID, 1 to 99
+
+			sFmt (str) - The stream type, 'das2' and 'qstream' packets are
+				tagged ':NN:' and 'das3' packets '|Pd|N|LEN|'.
+		"""
+		if nPktId < 1 or nPktId > 99:
+			raise ValueError("Invalid Packet ID: %s"%nPktId)
+		if sFmt not in ('das2', 'qstream', 'das3'):
+			raise ValueError("Unknown stream format '%s'"%sFmt)
+
+		self.nPktId = nPktId
+		self.sFmt = sFmt
+		self.lChunks = []  # memoryviews of finished packets
+
+	def _tag(self, nBytes):
+		if self.sFmt == 'das3':
+			return ('|Pd|%d|%d|'%(self.nPktId, nBytes)).encode('utf-8')
+		return (':%02d:'%self.nPktId).encode('utf-8')
+
+	def addRecords(self, aRecs):
+		"""Add one packet for each element of a structured array.
+
+		Args:
+			aRecs (numpy.ndarray) - A 1-D structured array, each element is
+				the payload of one packet.  The dtype should be packed, any
+				padding bytes are written as well.
+		"""
+		aRecs = numpy.ascontiguousarray(aRecs)
+		if aRecs.ndim != 1:
+			raise ValueError("Expected a 1-D record array, not %d-D"%aRecs.ndim)
+
+		nBytes = aRecs.dtype.itemsize
+		xTag = self._tag(nBytes)
+		aOut = numpy.empty(len(aRecs), dtype=[
+			('tag', 'S%d'%len(xTag)), ('data', 'V%d'%nBytes)
+		])
+		aOut['tag'] = xTag
+		aOut['data'] = aRecs.view('V%d'%nBytes)
+		self.lChunks.append(aOut.data)
+
+	def addVarRecords(self, lPayloads):
+		"""Add one das3 packet for each payload, payloads may have different
+		lengths.
+
+		Args:
+			lPayloads (list) - Bytes-like objects or NumPy arrays, each is the
+				whole content of one packet.
+		"""
+		if self.sFmt != 'das3':
+			raise ValueError("Variable length packets require das3 output")
+
+		lOut = []
+		for payload in lPayloads:
+			if isinstance(payload, numpy.ndarray):
+				payload = numpy.ascontiguousarray(payload).data
+			payload = memoryview(payload).cast('B')
+			lOut.append(self._tag(len(payload)))
+			lOut.append(payload)
+		self.lChunks.append(memoryview(b''.join(lOut)))
+
+	def addRagged(self, aValues, aCounts, *lCols):
+		"""Add one das3 packet for each run of values in a flat array, with
+		optional fixed size columns placed before the values.
+
+		Args:
+			aValues (numpy.ndarray) - The values of all packets end to end
+
+			aCounts (numpy.ndarray) - The number of values in each packet
+
+			lCols (numpy.ndarray) - Fixed size columns, one row per packet,
+				ex: a time tag for each spectrum.
+		"""
+		aValues = numpy.ascontiguousarray(aValues)
+		aCounts = numpy.asarray(aCounts, dtype='int64')
+		if aCounts.sum() != len(aValues):
+			raise ValueError("Value counts sum to %d, but %d values given"%(
+				aCounts.sum(), len(aValues)
+			))
+
+		nFixed = 0
+		if len(lCols) > 0:
+			aFixed = _columns(lCols)
+			if len(aFixed) != len(aCounts):
+				raise ValueError("All columns must have %d records"%len(aCounts))
+			nFixed = aFixed.dtype.itemsize
+
+		mvValues = memoryview(aValues.reshape(-1).view('u1'))
+		nItem = aValues.dtype.itemsize
+		lOut = []
+		iBeg = 0
+		for i in range(len(aCounts)):
+			nEnd = iBeg + int(aCounts[i])*nItem
+			lOut.append(self._tag(nFixed + nEnd - iBeg))
+			if nFixed: lOut.append(aFixed[i].data)
+			lOut.append(mvValues[iBeg:nEnd])
+			iBeg = nEnd
+		self.lChunks.append(memoryview(b''.join(lOut)))
+
+	def add(self, *lCols):
+		"""Add one packet for each row of a set of column arrays.
+
+		Args:
+			lCols (numpy.ndarray) - One array per packet value.  All arrays
+				must have the same length in the first axis.  Arrays with
+				more than one axis provide several values per packet, for
+				example a yscan.
+		"""
+		if len(lCols) == 0: return
+		self.addRecords(_columns(lCols))
+
+	def length(self):
+		"""Get the current size of the output buffer in bytes"""
+		return sum(mv.nbytes for mv in self.lChunks)
+
+	def send(self, fOut, bFlush=True):
+		"""Write all buffered packets in one call.  Sending clears the buffer.
+		Set bFlush to False to leave flushing the output up to the caller."""
+		if isinstance(fOut, StreamWriter):
+			for mv in self.lChunks: fOut.write(mv)  # No join needed
+		elif len(self.lChunks) == 1:
+			fwrite(fOut, self.lChunks[0])
+		elif len(self.lChunks) > 1:
+			fwrite(fOut, b''.join(self.lChunks))
+
+		_sent(fOut, bFlush)
+		self.lChunks = []
+
+
+##############################################################################
+def _sendDas2(fOut, sOut):
+	xOut = sOut.encode('utf-8')
+	fwrite(fOut, ('[xx]%06d'%len(xOut)).encode('utf-8') + xOut)
+
+def _sendDas3(fOut, sTag, sOut):
+	xOut = sOut.encode('utf-8')
+	fwrite(fOut, ('|%s||%d|'%(sTag, len(xOut))).encode('utf-8') + xOut)
+
+def sendComment(fOut, sType, sValue, sSource="", sFmt='das2'):
+	"""Send a comment packet, use sFmt='das3' for a das3 '|Cx|' packet"""
+	if sFmt == 'das3':
+		sOut = '<comment type=%s source=%s>%s</comment>\n'%(
+			quoteattr(sType), quoteattr(sSource), escape(sValue)
+		)
+		_sendDas3(fOut, 'Cx', sOut)
+		return
+
 	sFmt = '<comment type="%s" value="%s" source="%s"/>\n'
 	sOut = sFmt%(sType.replace('"', "'"), sValue.replace('"', "'"),
 	             sSource.replace('"', "'"))				 
-	fOut.write("[xx]%06d%s"%(len(sOut), sOut))
+	_sendDas2(fOut, sOut)
 	
 ##############################################################################
-def sendException(fOut, sType, sMsg):
+def sendException(fOut, sType, sMsg, sFmt='das2'):
 	"""Send a formatted Das2 exception
 	fOut - The file object to receive the XML error packet
 	sType - The exception type. Use one of the pre-defined strings
@@ -220,7 +566,12 @@ def sendException(fOut, sType, sMsg):
 	        EXCEPT_BADARG
 	        EXCEPT_SRVERR
 	sMsg - The error message
+	sFmt - Use 'das3' to send a das3 '|Ex|' packet
 	"""
+	if sFmt == 'das3':
+		sOut = '<exception type=%s>%s</exception>\n'%(quoteattr(sType), escape(sMsg))
+		_sendDas3(fOut, 'Ex', sOut)
+		return
 	
 	sFmt = '<exception type="%s" message="%s" />\n'
 	
@@ -228,12 +579,12 @@ def sendException(fOut, sType, sMsg):
 	
 	sOut = sFmt%(sType.replace('"', "'"), sMsg)
 	
-	fOut.write("[xx]%06d%s"%(len(sOut), sOut))
+	_sendDas2(fOut, sOut)
 
 ##############################################################################
 # Progress Messages
 
-def sendTaskSize(fOut, sWho, nSize, err_log_func=None):
+def sendTaskSize(fOut, sWho, nSize, err_log_func=None, sFmt='das2'):
 	"""Send a progress task size message.  This needs to be done first before
 	calling SendProgress.
 	
@@ -246,15 +597,20 @@ def sendTaskSize(fOut, sWho, nSize, err_log_func=None):
 	err_log_func: May be None.  A callback to also write the message somewhere else. 
 	       When this function is called any '<' and '>' characters are HTML
 			 esacaped.
+
+	sFmt: Use 'das3' to send a das3 '|Cx|' packet
 	"""
 	sPkt = '<comment type="taskSize" value="%d" source="%s" />\n'%(nSize, sWho)
 	if err_log_func != None:
 		err_log_func(sPkt.replace("<","&lt;").replace(">","&gt;"))
+
+	if sFmt == 'das3':
+		sendComment(fOut, 'taskSize', '%d'%nSize, sWho, sFmt)
+		return
 		
-	sOut = "[xx]%06d%s"%(len(sPkt), sPkt)
-	fOut.write(sOut)
+	_sendDas2(fOut, sPkt)
 	
-def sendProgress(fOut, sWho, nProg, err_log_func=None):
+def sendProgress(fOut, sWho, nProg, err_log_func=None, sFmt='das2'):
 	"""Send a progress status update, this should be a number between 0 and 
 	the size set in SendTaskSize
 
@@ -267,9 +623,15 @@ def sendProgress(fOut, sWho, nProg, err_log_func=None):
 	err_log_func: May be None.  A callback to also write the message somewhere else. 
 	       When this function is called any '<' and '>' characters are HTML
 			 esacaped.
+
+	sFmt: Use 'das3' to send a das3 '|Cx|' packet
 	"""
 	sPkt = '<comment type="taskProgress" value="%d" source="%s" />\n'%(nProg, sWho)
 	if err_log_func != None:
 		err_log_func(sPkt.replace("<","&lt;").replace(">","&gt;"))
-	sOut = "[xx]%06d%s"%(len(sPkt), sPkt)
-	fOut.write(sOut)
+
+	if sFmt == 'das3':
+		sendComment(fOut, 'taskProgress', '%d'%nProg, sWho, sFmt)
+		return
+
+	_sendDas2(fOut, sPkt)
@@ -21,8 +21,8 @@
 # SOFTWARE.
 
 
-"""Pure Python das2.2 and das3.0 stream reader.  Currently only supports
-das-basic-stream, but das-basic-doc is in the works.
+"""Pure Python das2.2 and das3.0 stream reader.  Supports das-basic-stream
+packets and das-basic-doc XML documents.
 """
 
 import sys
@@ -31,8 +31,19 @@ from os.path import join as pjoin
 from os.path import dirname as dname  
 from io import BytesIO
 import re
+import mmap
+import hashlib
+import heapq
+import copy
+import gzip
+import zlib
+import bz2
+import lzma
+from collections import namedtuple, OrderedDict
 from typing import Union
 
+import numpy
+
 import xml.parsers.expat  # Switch das2C to use libxml2 as well?
 from lxml import etree
 
@@ -82,12 +93,22 @@ def getSchemaName(sContent, sVersion, bNameSpace=False):
 
 	return None
 	
+# Compiled schemas, building an XMLSchema object takes much longer than
+# validating the typical header so only do it once per process
+g_dSchemaCache = {}  # (content, version, namespace) -> (schema, location)
+
+# Headers that have already passed validation, (schema, content hash)
+g_setValidHdrs = set()
+
 def loadSchema(sContent, sVersion, bNameSpace=False):
 	"""Load the appropriate das2 schema file from the package data location
 	typcially this one of the files:
 
 		$ROOT_DAS2_PKG/xsd/*.xsd
 
+	Compiled schemas are cached, so each schema file is only parsed once
+	per process.
+
 	Args:
 		sContent - one of 'das-baisc-stream' or 'das-basic-doc'
 		sVersion - The stream version number, typically 2.2 or 3.0
@@ -96,6 +117,10 @@ def loadSchema(sContent, sVersion, bNameSpace=False):
 		schema - An lxml.etree.XMLSchema object
 		location - Where the schema was loaded from
 	"""
+	tKey = (sContent, sVersion, bNameSpace)
+	if tKey in g_dSchemaCache:
+		return g_dSchemaCache[tKey]
+
 	sMyDir = dname(os.path.abspath( __file__))
 	sSchemaDir = pjoin(sMyDir, 'xsd')
 	
@@ -110,12 +135,33 @@ def loadSchema(sContent, sVersion, bNameSpace=False):
 
 	#print(sContent, sVersion, "-->", sPath)
 	
-	fSchema = open(sPath)
-	schema_doc = etree.parse(fSchema)
+	with open(sPath) as fSchema:
+		schema_doc = etree.parse(fSchema)
 	schema = etree.XMLSchema(schema_doc)
 	
+	g_dSchemaCache[tKey] = (schema, sPath)
 	return (schema,sPath)
 
+def validateHdr(pkt, schema, bOnce=False):
+	"""Validate a header packet against a schema
+
+	Args:
+		pkt (HdrPkt) - The header packet to check
+		schema (lxml.etree.XMLSchema) - The schema, typically from loadSchema()
+		bOnce (bool) - If True, skip headers whose content has already passed
+			validation against this schema in this process.
+
+	Raises:
+		lxml.etree.DocumentInvalid - If the header doesn't match the schema
+	"""
+	if bOnce:
+		tKey = (schema, hashlib.sha1(pkt.content).digest())
+		if tKey in g_setValidHdrs: return
+
+	schema.assertValid(pkt.docTree())
+
+	if bOnce: g_setValidHdrs.add(tKey)
+
 # ########################################################################### #
 # Calculating expected packet lengths, required for v2.2, optional for V3.0
 
@@ -223,6 +269,47 @@ def _getDas3PktLen(elDs, nPktId, bThrow=True) -> Union[int, None]:
 	
 	return nSize
 
+# QStream binary encodings and their sizes, several names are in use
+g_dQsValSz = {
+	'double':8, 'real8':8, 'float':4, 'real4':4, 'long':8, 'int8':8,
+	'int':4, 'int4':4, 'integer':4, 'uint':4, 'uint4':4, 'short':2, 'int2':2,
+	'ushort':2, 'uint2':2, 'byte':1, 'int1':1, 'ubyte':1, 'uint1':1
+}
+
+def _getQsValSz(sEnc, nLine):
+	"""QStream value sizes, text encodings end in the field width"""
+	if sEnc in g_dQsValSz: return g_dQsValSz[sEnc]
+	for sPre in ('ascii', 'time'):
+		if sEnc.startswith(sPre) and sEnc[len(sPre):].isdigit():
+			return int(sEnc[len(sPre):], 10)
+	raise HeaderError(nLine, "Unknown QStream encoding '%s'"%sEnc)
+
+def _getQsPktLen(elPkt, nPktId, bThrow=True):
+	"""Sum the sizes of the streamed <qdataset> values in a QStream <packet>.
+	Datasets with inline values take no space in data packets.
+	"""
+	nSize = 0
+	for elQds in elPkt:
+		if elQds.tag != 'qdataset': continue
+		for elVals in elQds:
+			if elVals.tag != 'values': continue
+			if 'values' in elVals.attrib: continue  # Inline, header only
+
+			try:
+				nItems = 1
+				for sLen in elVals.attrib.get('length', '').split(','):
+					if len(sLen.strip()) > 0: nItems *= int(sLen, 10)
+				nSize += _getQsValSz(elVals.attrib['encoding'], elVals.sourceline)*nItems
+			except (KeyError, ValueError, HeaderError):
+				if bThrow:
+					raise HeaderError(elVals.sourceline,
+						"Invalid <values> for qdataset '%s' in packet ID %d"%(
+						elQds.attrib.get('id', ''), nPktId
+					))
+				return None
+
+	return nSize
+
 def _getPktLen(elDs, sStreamVer, nPktId, bThrow=True):
 
 	"""Given a das <packet> element, or a das <dataset> element, recurse
@@ -232,7 +319,9 @@ def _getPktLen(elDs, sStreamVer, nPktId, bThrow=True):
 		None otherwise.
 	"""
 
-	if sStreamVer < "3":
+	if sStreamVer == 'qstream':
+		return _getQsPktLen(elDs, nPktId, bThrow)
+	elif sStreamVer < "3":
 		return _getDas2PktLen(elDs, nPktId, bThrow)
 	else:
 		return _getDas3PktLen(elDs, nPktId, bThrow)
@@ -348,6 +437,46 @@ class Das22HdrParser:
 
 # ########################################################################## #
 
+# ########################################################################## #
+# Parsed headers are shared by all readers.  Streams tend to repeat the same
+# few headers over and over (re-definitions, file aggregations, etc.) so
+# parse each distinct header only once.
+
+g_dHdrCache = OrderedDict()  # (version, header bytes) -> (tree, data length)
+g_nHdrCacheMax = 512
+
+def _parseHdr(sVersion, xDoc, nPktId):
+	"""Parse a header packet, or get the result of parsing identical bytes
+
+	Args:
+		sVersion (str) - The stream version, das2.2 headers use the
+			Das22HdrParser
+		xDoc (bytes) - The header packet content
+		nPktId (int) - The packet ID, only used for error messages
+
+	Returns: (tree, nDatLen) where tree is an ElementTree that must be treated
+		as read-only since it is shared, and nDatLen is the fixed data packet
+		length, or None if it can't be determined.
+	"""
+	tKey = (sVersion, xDoc)
+	if tKey in g_dHdrCache:
+		g_dHdrCache.move_to_end(tKey)
+		return g_dHdrCache[tKey]
+
+	fPkt = BytesIO(xDoc)
+	if sVersion == '2.2':
+		tree = Das22HdrParser().parse(fPkt)
+	else:
+		tree = etree.parse(fPkt)
+
+	nDatLen = _getPktLen(tree.getroot(), sVersion, nPktId, False)
+
+	g_dHdrCache[tKey] = (tree, nDatLen)
+	if len(g_dHdrCache) > g_nHdrCacheMax:
+		g_dHdrCache.popitem(last=False)
+
+	return (tree, nDatLen)
+
 class Packet(object):
 	"""Represents a single packet from a das2 or qstream.
 
@@ -367,7 +496,9 @@ class Packet(object):
 		content - Exther a bytestr (data packets) or a string (header 
 		     packets.  If the packet is a header then the bytes are 
 			  decode as utf-8. If the packet contains data the a raw
-			  bytestr is returned.
+			  bytestr is returned.  Data packets from a PacketReader are
+			  read-only memoryview objects that refer directly into the
+			  reader's input buffer, call bytes() on them to get a copy.
 	"""
 
 	def __init__(self, sver, tag, id, length, content):
@@ -406,17 +537,13 @@ class HdrPkt(Packet):
 			  <p name="zFill" type="double">-1.000000e+31</p>
 			  <p name="sourceId">das2_from_tagged_das1</p>
 			</properties>
+
+		Trees are cached by header content and shared between packets with
+		identical headers, so do not modify the returned tree.
 		"""
 
 		if not self.tree:
-
-			fPkt = BytesIO(self.content)
-
-			if self.sver == '2.2':
-				parser = Das22HdrParser()
-				self.tree = parser.parse(fPkt)
-			else:
-				self.tree = etree.parse(fPkt)
+			self.tree = _parseHdr(self.sver, bytes(self.content), self.id)[0]
 
 		return self.tree
 
@@ -435,7 +562,7 @@ class DataHdrPkt(HdrPkt):
 		Returns: The packet size for fixed length packets, None for variable
 			length items.
 		"""
-		if not self.nDatLen:
+		if self.nDatLen is None:
 			tree = self.docTree()
 			elRoot = tree.getroot()
 
@@ -451,6 +578,17 @@ class DataPkt(Packet):
 
 	# Nothing special defined for data packets yet
 
+class SkippedDataPkt(DataPkt):
+	"""A placeholder for a data packet whose content was not read.  Returned
+	by readers in skip data mode.
+
+	The content member is None, use .offset and .length to find the content
+	in the original input.
+	"""
+	def __init__(self, sver, tag, id, length, offset):
+		super(SkippedDataPkt, self).__init__(sver, tag, id, length, None)
+		self.offset = offset
+
 # ########################################################################## #
 def streamType(xFirst):
 	"""Read the first bytes of the stream and try to determine the stream 
@@ -512,12 +650,17 @@ def streamType(xFirst):
 	
 	iStart = m.start() + 7
 
+	# Only look in the stream start tag, QStream headers that follow have an
+	# <?xml version="1.0"?> prolog
+	iEnd = xFirst.find(b'>', iStart)
+	if iEnd < 0: iEnd = len(xFirst)
+
 	ptrn = re.compile(b'version\\s*=\\s*\\"(.*?)\\"')
-	l = ptrn.findall(xFirst[iStart:])
+	l = ptrn.findall(xFirst[iStart:iEnd])
 
 	if len(l) == 0:
 		# Just assume version 2.2 stream or qstream with fixed tags.
-		if xFirst.find(b'dataset_id') != -1:	
+		if xFirst.find(b'dataset_id', iStart, iEnd) != -1:
 			sContent = 'q-stream'
 			sVersion = None
 	else:
@@ -531,54 +674,714 @@ def streamType(xFirst):
 	return (sContent, sVersion, sTagStyle, bUsingNs)
 
 
+# ########################################################################## #
+# Compressed inputs
+
+# Leading bytes of the compressed formats that are read transparently.  None
+# of these can start a das stream, which always begins with a tag or '<'.
+g_lCompressMagic = (
+	(b'\x1f\x8b', 'gzip'),
+	(b'BZh', 'bz2'),
+	(b'\xfd7zXZ\x00', 'xz'),
+)
+
+def compression(xFirst):
+	"""Get the compression format of a stream from it's first bytes
+
+	Args:
+		xFirst (bytes) - At least the first 6 bytes of the input
+
+	Returns (str): One of 'gzip', 'bz2' or 'xz', or None if the input is
+		not compressed.
+	"""
+	for xMagic, sFormat in g_lCompressMagic:
+		if xFirst[:len(xMagic)] == xMagic: return sFormat
+	return None
+
+def decompress(fIn, sFormat):
+	"""Wrap a binary input in an incremental decompressor
+
+	Compressed bytes are pulled from fIn in blocks as decompressed bytes are
+	read, the full input is never inflated in memory or on disk.  Inputs
+	made of several concatenated gzip members or bz2 streams are read
+	through to the end.
+
+	Args:
+		fIn (file-like) - A binary input with a read() method
+
+		sFormat (str) - The compression format, as returned by compression()
+
+	Returns (file-like): A readable binary file object
+	"""
+	if sFormat == 'gzip': return gzip.GzipFile(fileobj=fIn, mode='rb')
+	if sFormat == 'bz2':  return bz2.BZ2File(fIn, mode='rb')
+	if sFormat == 'xz':   return lzma.LZMAFile(fIn, mode='rb')
+	raise ValueError("Unknown compression format '%s'"%sFormat)
+
+def _decompressor(sFormat):
+	"""Get an incremental decompressor for bytes that are pushed in, for
+	inputs that can't be wrapped by decompress().  Each decompressor handles
+	a single gzip member, bz2 stream or xz stream.
+	"""
+	if sFormat == 'gzip': return zlib.decompressobj(16 + zlib.MAX_WBITS)
+	if sFormat == 'bz2':  return bz2.BZ2Decompressor()
+	if sFormat == 'xz':   return lzma.LZMADecompressor()
+	raise ValueError("Unknown compression format '%s'"%sFormat)
+
+def open_stream(sFile):
+	"""Open a stream file for reading, decompressing it if needed
+
+	Args:
+		sFile (str) - The file to open, may be gzip, bz2 or xz compressed.
+			The format is determined from the file contents, not the name.
+
+	Returns (file-like): A readable binary file object
+	"""
+	with open(sFile, 'rb') as fIn:
+		sFormat = compression(fIn.read(6))
+
+	# The module level open functions close the file along with the
+	# decompressor, the file objects made by decompress() don't
+	if sFormat == 'gzip': return gzip.open(sFile, 'rb')
+	if sFormat == 'bz2':  return bz2.open(sFile, 'rb')
+	if sFormat == 'xz':   return lzma.open(sFile, 'rb')
+	return open(sFile, 'rb')
+
+
+# ########################################################################## #
+
+def _unshared(xBuf):
+	"""True if no views into a bytearray exist, it can't be resized if they do"""
+	try:
+		xBuf.append(0)
+	except BufferError:
+		return False
+	xBuf.pop()
+	return True
+
+class InputBuffer:
+	"""A refillable read buffer with a cursor, used under the packet readers.
+
+	Bytes are read from the underlying file in large chunks into a single
+	buffer.  Requests are answered with read-only memoryview slices of that
+	buffer so that packet payloads are never copied on the way out.  When a
+	request runs off the end of the buffer, the unread tail is moved to the
+	front and the remainder is filled directly from the file.
+
+	If no views into the buffer are still held, it is refilled in place.
+	Otherwise the previous buffer is used if it has been let go, or a new
+	one is allocated, and the old one is left untouched so views handed out
+	earlier stay valid for as long as the caller keeps them.  Note that any
+	view held, or any array made over one, keeps its whole chunk in memory,
+	copy small items that are kept for a long time.
+	"""
+
+	def __init__(self, fIn, nChunk=1048576):
+		"""
+		Args:
+			fIn (file-like) - Any object with a read() method, readinto() is
+				used if available.
+
+			nChunk (int) - The minimum number of bytes to request from fIn on
+				each refill.
+		"""
+		self.fIn = fIn
+		self.nChunk = nChunk
+		self._xBuf = None    # Writable storage under _mv, if any
+		self._xSpare = None  # The previous buffer, reused once it's free
+		self._mv = memoryview(b'')
+		self._iPos = 0       # Read cursor in the current buffer
+		self._nEnd = 0       # Valid bytes in the current buffer
+		self._nBufOffset = 0 # File offset of the start of the current buffer
+		self._bEof = False
+
+		# Decompressors claim to be seekable but only step forward by reading
+		# and can't seek from the end, so treat them as plain streams
+		self._bSeek = hasattr(fIn, 'seekable') and \
+			not isinstance(fIn, (gzip.GzipFile, bz2.BZ2File, lzma.LZMAFile)) and \
+			fIn.seekable()
+
+	@property
+	def offset(self):
+		"""The stream offset of the read cursor"""
+		return self._nBufOffset + self._iPos
+
+	def avail(self):
+		"""The number of bytes that may be read without touching the file"""
+		return self._nEnd - self._iPos
+
+	def _fill(self, nWant):
+		"""Make sure at least nWant unread bytes are in the buffer, unless
+		the end of the file is reached first.
+		"""
+		nAvail = self._nEnd - self._iPos
+		if nAvail >= nWant or self._bEof: return
+
+		nSize = max(self.nChunk, nWant)
+		xOld = self._xBuf
+		xNew = self._reclaim(nSize)
+		if xNew is xOld:
+			if nAvail > 0:
+				xNew[:nAvail] = xNew[self._iPos:self._nEnd]
+			mvNew = memoryview(xNew)
+		else:
+			mvNew = memoryview(xNew)
+			if nAvail > 0:
+				mvNew[:nAvail] = self._mv[self._iPos:self._nEnd]
+			self._xSpare = xOld  # Free again once the caller drops it's views
+
+		nRead = nAvail
+		while nRead < nWant:
+			if hasattr(self.fIn, 'readinto'):
+				n = self.fIn.readinto(mvNew[nRead:])
+			else:
+				x = self.fIn.read(len(xNew) - nRead)
+				n = len(x)
+				mvNew[nRead:nRead+n] = x
+
+			if not n:
+				self._bEof = True
+				break
+			nRead += n
+
+		self._nBufOffset += self._iPos
+		self._xBuf = xNew
+		self._mv = mvNew.toreadonly()
+		mvNew.release()
+		self._iPos = 0
+		self._nEnd = nRead
+
+	def _reclaim(self, nSize):
+		"""Get a buffer of at least nSize bytes to refill.  The current buffer
+		is reused if nothing outside this object holds a view into it, then
+		the spare buffer, otherwise a new one is allocated.
+
+		Returns (bytearray): The buffer, which is the current one if the
+			refill should happen in place.
+		"""
+		xBuf = None
+		if self._xBuf is not None:
+			try:
+				self._mv.release()
+			except BufferError:
+				pass  # Something was made directly over our view
+			else:
+				if _unshared(self._xBuf): xBuf = self._xBuf
+				else: self._mv = memoryview(self._xBuf).toreadonly()
+
+		if (xBuf is None) and (self._xSpare is not None) and \
+		   _unshared(self._xSpare):
+			(xBuf, self._xSpare) = (self._xSpare, None)
+
+		if xBuf is None: return bytearray(nSize)
+		if len(xBuf) < nSize: xBuf.extend(bytes(nSize - len(xBuf)))
+		return xBuf
+
+	def peek(self, nBytes):
+		"""Get up to nBytes without advancing the read cursor
+
+		Returns (memoryview): Fewer than nBytes are returned only at the end
+			of the input.
+		"""
+		self._fill(nBytes)
+		nEnd = min(self._iPos + nBytes, self._nEnd)
+		return self._mv[self._iPos:nEnd]
+
+	def read(self, nBytes):
+		"""Get up to nBytes and advance the read cursor
+
+		Returns (memoryview): Fewer than nBytes are returned only at the end
+			of the input.
+		"""
+		mv = self.peek(nBytes)
+		self._iPos += len(mv)
+		return mv
+
+	def skip(self, nBytes):
+		"""Advance the read cursor without returning any bytes.
+
+		Buffered bytes are passed over in memory.  Beyond that, seekable
+		inputs are moved forward with seek() and other inputs are read and
+		discarded.
+
+		Returns (int): The number of bytes skipped, which is less than nBytes
+			only at the end of the input.
+		"""
+		nAvail = self.avail()
+		if nBytes <= nAvail:
+			self._iPos += nBytes
+			return nBytes
+
+		if self._bEof:
+			self._iPos = self._nEnd
+			return nAvail
+
+		nSkip = nBytes - nAvail
+		if self._bSeek:
+			# Don't seek past the end, that would hide truncated inputs
+			nPos = self.fIn.tell()
+			nSize = self.fIn.seek(0, os.SEEK_END)
+			nSkip = min(nSkip, nSize - nPos)
+			self.fIn.seek(nPos + nSkip, os.SEEK_SET)
+		else:
+			nLeft = nSkip
+			while nLeft > 0:
+				x = self.fIn.read(min(nLeft, max(self.nChunk, 65536)))
+				if not x: break
+				nLeft -= len(x)
+			nSkip -= nLeft
+
+		# Start over with an empty buffer past the skipped bytes
+		self._nBufOffset += self._nEnd + nSkip
+		self._mv = memoryview(b'')
+		self._iPos = 0
+		self._nEnd = 0
+		if nSkip < nBytes - nAvail: self._bEof = True
+
+		return nAvail + nSkip
+
+	def find(self, xSub, nStart=0, nEnd=None):
+		"""Search the unread bytes for a sub-sequence without consuming them.
+
+		The search window is [nStart, nEnd) relative to the read cursor.  The
+		buffer is refilled as needed so that the whole window is searchable.
+
+		Returns (int): The position of xSub relative to the read cursor, or
+			-1 if not found in the window.
+		"""
+		if nEnd is None: nEnd = self.avail()
+		self._fill(nEnd)
+		nEnd = min(self._iPos + nEnd, self._nEnd)
+
+		# bytearray.find works on the underlying object without copying
+		n = self._mv.obj.find(xSub, self._iPos + nStart, nEnd)
+		if n < 0: return n
+		return n - self._iPos
+
+
+class MmapBuffer(InputBuffer):
+	"""An input buffer over a memory mapped file.
+
+	The whole file is visible at once so no refills are needed and every
+	view handed out refers directly into the map.  Unlike InputBuffer, the
+	read cursor may be moved to any offset.  Call close(), or use the buffer
+	in a with statement, to unmap the file once the views are no longer
+	needed.
+	"""
+
+	def __init__(self, fIn):
+		"""
+		Args:
+			fIn (file) - A file opened in binary mode that supports fileno()
+		"""
+		super(MmapBuffer, self).__init__(fIn)
+		try:
+			self._map = mmap.mmap(fIn.fileno(), 0, access=mmap.ACCESS_READ)
+		except (AttributeError, OSError) as e:
+			raise ValueError("Input can not be memory mapped: %s"%str(e))
+		except ValueError:
+			self._map = b''  # Empty files can't be mapped
+
+		self._mv = memoryview(self._map)
+		self._nEnd = len(self._mv)
+		self._bEof = True
+
+	def seek(self, nOffset):
+		"""Move the read cursor to an absolute offset"""
+		if nOffset < 0 or nOffset > self._nEnd:
+			raise ValueError("Offset %d is outside the file"%nOffset)
+		self._iPos = nOffset
+
+	def view(self, nOffset, nBytes):
+		"""Get nBytes starting at an absolute offset, without moving the read
+		cursor.
+		"""
+		return self._mv[nOffset:nOffset + nBytes]
+
+	def close(self):
+		"""Unmap the file, the underlying file is not closed.
+
+		Raises:
+			BufferError - If views handed out by this buffer are still held,
+				the buffer is left open.
+		"""
+		self._mv.release()
+		if not isinstance(self._map, bytes):
+			try:
+				self._map.close()
+			except BufferError:
+				self._mv = memoryview(self._map)
+				raise
+		self._mv = memoryview(b'')
+		self._map = b''
+		self._iPos = 0
+		self._nEnd = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, xType, xValue, traceback):
+		try:
+			self.close()
+		except BufferError:
+			# Views in the traceback are still alive, the map is released
+			# when they are
+			if xType is None: raise
+		return False
+
+
+PktLoc = namedtuple('PktLoc', 'offset tag id length')
+PktLoc.__doc__ = """The location of a packet in a memory mapped stream
+
+	offset - The file offset of the first byte of the packet tag
+	tag - The 2-character content tag, ex: 'Hx', 'Pd'
+	id - The packet integer ID
+	length - The length of the packet content, not including the tag
+"""
+
+class FeedBuffer(InputBuffer):
+	"""An input buffer that never reads on it's own.  Bytes are pushed in by
+	the owner with feed() before they are requested, which allows the
+	synchronous packet parsing code to run on data gathered by non-blocking
+	I/O.  Requests for more bytes than have been fed are answered short, just
+	like an InputBuffer at the end of a file.
+	"""
+
+	def __init__(self):
+		super(FeedBuffer, self).__init__(None)
+		self._bEof = True  # Disables _fill(), there is no file to read
+
+	def feed(self, lChunks):
+		"""Append bytes after any unread bytes in the buffer
+
+		Args:
+			lChunks (list) - Bytes-like objects to append, all are copied into
+				a new buffer in one pass.  As with InputBuffer, views handed out
+				earlier stay valid.
+		"""
+		nAvail = self.avail()
+		xNew = bytearray(nAvail + sum(len(x) for x in lChunks))
+		mvNew = memoryview(xNew)
+		mvNew[:nAvail] = self._mv[self._iPos:self._nEnd]
+		nPos = nAvail
+		for x in lChunks:
+			mvNew[nPos:nPos + len(x)] = x
+			nPos += len(x)
+
+		self._nBufOffset += self._iPos
+		self._mv = mvNew.toreadonly()
+		self._iPos = 0
+		self._nEnd = len(xNew)
+
+# ########################################################################## #
+
+class _BufferFile(object):
+	"""A minimal read-only file over an InputBuffer, lets the XML parser
+	pick up where the stream type sniffing left off"""
+
+	def __init__(self, buf):
+		self._buf = buf
+
+	def read(self, nBytes=-1):
+		if nBytes is None or nBytes < 0: nBytes = 1048576
+		return self._buf.read(nBytes).tobytes()
+
+
+class DocReader:
+	"""Read das v3.0 XML documents one dataset definition or data element
+	at a time.
+
+	Documents are parsed incrementally with lxml.etree.iterparse.  Each
+	<dataset> and <d> element is turned into a packet as soon as it's end tag
+	is seen and is then dropped from the partial tree, so memory use does not
+	grow with the size of the document.  The packets are the same types that
+	a PacketReader returns:
+
+		- HdrPkt 'Sx' - The <stream> element and it's <properties>
+		- DataHdrPkt 'Hx' - Each <dataset> element
+		- DataPkt 'Pd' - The text of each <d> element, or a SkippedDataPkt in
+		  skip data mode
+
+	Values in documents are always text and are variable width unless stated
+	otherwise.  Dataset definitions are filled out with the implied
+	encoding="utf8", itemBytes="*" and a default valTerm of ';' so that they
+	can be used by a DatasetBuilder in the same way as das3 stream headers.
+	"""
+
+	def __init__(self, fIn, sValidate=None, bSkipData=False):
+		"""
+		Args:
+			fIn (file-like) - The document, an object with a read() method
+				that returns bytes, or a file name.
+
+			sValidate (str) - If 'all' or 'once', check the document against
+				the das-basic-doc schema as it is parsed.  Invalid content
+				raises lxml.etree.XMLSyntaxError.
+
+			bSkipData (bool) - Return a SkippedDataPkt for each <d> element
+				instead of it's text.  The XML parser still reads the text,
+				but it isn't handed on for decoding.  Elements have no byte
+				offset in the input, so .offset is None and .length is the
+				UTF-8 size of the text.
+		"""
+		if sValidate not in (None, 'all', 'once'):
+			raise ValueError("Unknown validation mode '%s'"%sValidate)
+
+		self.fIn = fIn
+		self.bSkipData = bSkipData
+		self.sContent = 'das-basic-doc'
+		self.sVersion = '3.0'
+		self.dLastTerm = {}   # Packet ID -> terminator of the final value
+		self._elRoot = None
+
+		dArgs = {}
+		if sValidate: dArgs['schema'] = loadSchema(self.sContent, self.sVersion)[0]
+
+		self._iter = etree.iterparse(
+			fIn, events=('start','end'), remove_comments=True, huge_tree=True,
+			**dArgs
+		)
+		self._gen = self._packets()
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		return next(self._gen)
+
+	def _packets(self):
+		self._elRoot = None
+		nDepth = 0
+		xProps = b''
+		bSentSx = False
+
+		for (sEvent, el) in self._iter:
+			sTag = etree.QName(el).localname
+
+			if sEvent == 'start':
+				nDepth += 1
+				if nDepth == 1:
+					self._elRoot = el
+					if (sTag != 'stream') or (el.get('type') != 'das-basic-doc'):
+						raise ValueError("Not a das-basic-doc document")
+					self.sVersion = el.get('version', self.sVersion)
+
+				elif (nDepth == 2) and (not bSentSx) and (sTag in ('dataset', 'd')):
+					bSentSx = True
+					yield self._streamHdr(xProps)
+				continue
+
+			nDepth -= 1
+			if nDepth != 1: continue  # Only top level elements are complete items
+
+			pkt = None
+			if sTag == 'properties':
+				xProps = etree.tostring(el, with_tail=False)
+			elif sTag == 'dataset':
+				pkt = self._dataHdr(el)
+			elif sTag == 'd':
+				pkt = self._data(el)
+
+			# Drop everything that's been handled
+			el.clear()
+			while el.getprevious() is not None: del self._elRoot[0]
+
+			if pkt: yield pkt
+
+		if (not bSentSx) and (self._elRoot is not None):
+			yield self._streamHdr(xProps)
+
+	def _streamHdr(self, xProps):
+		xHdr = b'<stream type="das-basic-doc" version="%s">%s</stream>'%(
+			self.sVersion.encode('utf-8'), xProps
+		)
+		return HdrPkt(self.sVersion, 'Sx', 0, len(xHdr), xHdr)
+
+	def _pktId(self, el):
+		try:
+			nPktId = int(el.get('id', ''), 10)
+		except ValueError:
+			raise HeaderError(el.sourceline,
+				"Missing or invalid id attribute for <%s>"%etree.QName(el).localname
+			)
+		return nPktId
+
+	def _dataHdr(self, el):
+		nPktId = self._pktId(el)
+
+		# Fill in the implied packet attributes
+		sLastTerm = None
+		for elPkt in el.iter('{*}packet', 'packet'):
+			if 'encoding' not in elPkt.attrib: elPkt.set('encoding', 'utf8')
+			if 'itemBytes' not in elPkt.attrib: elPkt.set('itemBytes', '*')
+			if elPkt.get('itemBytes') == '*' and 'valTerm' not in elPkt.attrib:
+				elPkt.set('valTerm', ';')
+
+			if elPkt.get('itemBytes') == '*': sLastTerm = elPkt.get('valTerm')
+			else: sLastTerm = None
+
+		if sLastTerm == '\\n': sLastTerm = '\n'
+		self.dLastTerm[nPktId] = sLastTerm
+
+		xHdr = etree.tostring(el, with_tail=False)
+		return DataHdrPkt(self.sVersion, 'Hx', nPktId, len(xHdr), xHdr)
+
+	def _data(self, el):
+		nPktId = self._pktId(el)
+		if nPktId not in self.dLastTerm:
+			raise DataError('d', nPktId, None,
+				"Data element received before it's dataset definition"
+			)
+
+		if self.bSkipData:
+			return SkippedDataPkt(
+				self.sVersion, 'Pd', nPktId, len((el.text or '').encode('utf-8')),
+				None
+			)
+
+		# The final terminator is often left off in documents
+		xData = (el.text or '').strip().encode('utf-8')
+		sTerm = self.dLastTerm[nPktId]
+		if sTerm and (len(xData) > 0) and not xData.endswith(sTerm.encode('utf-8')):
+			xData += sTerm.encode('utf-8')
+
+		return DataPkt(self.sVersion, 'Pd', nPktId, len(xData), xData)
+
 # ########################################################################## #
 
 class PacketReader:
 	"""This packet reader can handle either das v2.2 or v3.0 streams as
-	well as das v3.0 documents
+	well as das v3.0 documents.  Documents are handed off to a DocReader,
+	random access is not available for them.
 	"""
 	
-	def __init__(self, fIn):
+	def __init__(
+		self, fIn, nChunk=1048576, bMmap=False, sValidate=None, bSkipData=False,
+		ids=None
+	):
+		"""
+		Args:
+			fIn (file-like) - The stream to read, an object with a read()
+				method that returns bytes.  Gzip, bz2 and xz compressed input
+				is detected and decompressed in chunks as it's read.
+
+			nChunk (int) - The minimum number of bytes to request from fIn
+				when more data are needed.
+
+			bMmap (bool) - If True, fIn must be a local file opened in binary
+				mode.  The file is memory mapped instead of being read in
+				chunks and an index of all packets is recorded as they are
+				read.  This enables the random access functions packet(),
+				packets() and index().  Compressed files can't be mapped.
+				Use close(), or the reader in a with statement, to unmap the
+				file.
+
+			sValidate (str) - Check header packets against the schema for
+				the stream type as they are read.  Use 'all' to validate every
+				header, or 'once' to validate headers only the first time their
+				content is seen in this process.  The schema is loaded when the
+				first header arrives.  Invalid headers raise
+				lxml.etree.DocumentInvalid.
+
+			bSkipData (bool) - Don't read data packet contents, return a
+				SkippedDataPkt for each one instead.  Seekable inputs are moved
+				past the content with seek(), so scanning a file for headers and
+				packet counts only reads a small part of it.
+
+			ids (set, optional) - Only return header and data packets with
+				these packet IDs.  The contents of other data packets are skipped
+				instead of read.  Stream headers, comments and exceptions are
+				always returned.
+		"""
+		self._initState(sValidate, bSkipData, ids)
 		self.fIn = fIn
+
+		if bMmap:
+			self._buf = MmapBuffer(fIn)
+			self.lIndex = []
+			self._lPayload = []  # File offset of each packet's content
+		else:
+			self._buf = InputBuffer(fIn, nChunk)
+
+		# Compressed inputs are read through a decompressor that pulls from
+		# the bytes already buffered, then from the file
+		self.sCompress = compression(self._buf.peek(6).tobytes())
+		if self.sCompress:
+			if bMmap:
+				self._buf.close()
+				raise ValueError(
+					"A %s compressed file can not be memory mapped"%self.sCompress
+				)
+			self._buf = InputBuffer(
+				decompress(_BufferFile(self._buf), self.sCompress), nChunk
+			)
+
+		# See if this stream is using variable tags and try to guess the content
+		# using the first 64K bytes.  Assume a das2.2 stream unless we see
+		# otherwise.  The reason we look at so many bytes up front is that the
+		# stream header may have many xml schema and namespace references for
+		# the all-in-one XML documents.  Peeking doesn't consume the bytes.
+		self._sniff()
+
+	def _initState(self, sValidate, bSkipData, ids):
+		"""Set the parsing state shared by all packet readers, the input
+		buffer is left to the caller.
+		"""
+		if sValidate not in (None, 'all', 'once'):
+			raise ValueError("Unknown validation mode '%s'"%sValidate)
+
 		self.lPktSize = [None]*1000
 		self.lPktDef  = [False]*1000
-		self.nOffset = 0
 		self.sContent = "das-basic-stream"
 		self.sVersion = "2.2"
 		self.sTagStyle = "fixed"  # Other choices are "var" and "none"
 		self.bUsingNs = False # True if explicit namespaces in use
-		
-		# See if this stream is using variable tags and try to guess the content
-		# using the first 1024 bytes.  Assume a das2.2 stream unless we see
-		# otherwise.  The reason we read so many bytes up front is that the
-		# stream header may have many xml schema and namespace references for
-		# the all-in-one XML documents
-		
-		self.xFirst = fIn.read(65536)
+		self.sCompress = None
+
+		self.sValidate = sValidate
+		self.schema = None
+		self.bSkipData = bSkipData
+		self.setIds = None if ids is None else set(ids)
 
-		(self.sContent, self.sVersion, self.sTagStyle, self.bUsingNs) = streamType(self.xFirst)
+		self.lIndex = None   # List of PktLoc, memory mapped inputs only
+		self._lPayload = None
+		self._bIndexed = False
+		self._doc = None     # DocReader for XML documents
 
-		if self.sContent not in ('das-basic-stream', 'das-basic-doc'):
+	def _sniff(self):
+		"""Set the stream type from the first bytes in the buffer"""
+		xFirst = self._buf.peek(65536).tobytes()
+
+		(self.sContent, self.sVersion, self.sTagStyle, self.bUsingNs) = streamType(xFirst)
+
+		if self.sContent not in ('das-basic-stream', 'das-basic-doc', 'q-stream'):
 			raise ValueError("Support stream type '%s' has not been implemented"%self.sContent)
 
-		if self.sTagStyle == 'none':
-			raise ValueError(
-				"Support for reading documents instead of packetize streams has not been implemented"
-			)
+		# QStreams have no version attribute, packets are marked 'qstream'
+		if self.sContent == 'q-stream':
+			if self.sValidate:
+				raise ValueError("No schema is available for q-stream content")
+			self.sVersion = 'qstream'
+
+		if self.sTagStyle == 'none': self._openDoc()
+
+	def _openDoc(self):
+		"""Read the rest of the input as an XML document"""
+		if self.lIndex is not None:
+			raise ValueError("Random access is not supported for XML documents")
+		self._doc = DocReader(_BufferFile(self._buf), self.sValidate, self.bSkipData)
+
+	@property
+	def nOffset(self):
+		"""The stream offset of the next unread byte"""
+		return self._buf.offset
 			
 	def streamType(self):
 		return (self.sContent, self.sVersion, self.sTagStyle, self.bUsingNs)		
 		
 	def _read(self, nBytes):
-		xOut = b''
-		if len(self.xFirst) > 0:
-			xOut = self.xFirst[0:nBytes]
-			self.xFirst = self.xFirst[nBytes:]
-			
-		if len(xOut) < nBytes:
-			xOut += self.fIn.read(nBytes - len(xOut))
-
-		return xOut
+		"""Read nBytes as a memoryview, zero copy"""
+		return self._buf.read(nBytes)
 
 	def setDataSize(self, nPktId, nBytes):
 		"""Callback used when parsing das2.2 and earlier streams.  These had
@@ -598,6 +1401,15 @@ class PacketReader:
 	def next(self):
 		return self.__next__()
 
+	def _wanted(self, pkt):
+		"""True if a packet passes the packet ID filter"""
+		if (self.setIds is None) or (pkt.tag in ('Sx', 'Cx', 'Ex')): return True
+		return pkt.id in self.setIds
+
+	def _skipData(self, nPktId):
+		"""True if the content of a data packet should not be read"""
+		return self.bSkipData or \
+			((self.setIds is not None) and (nPktId not in self.setIds))
 		
 	def __next__(self):
 		"""Get the next packet on the stream. Each iteration returns a Packet
@@ -609,28 +1421,57 @@ class PacketReader:
 			DataPkt: For known data containing packets
 					
 		The reader can iterate over all das2 streams, unless it has been
-		set to strict mode
+		set to strict mode.  Packets removed by the ID filter are read past
+		without being returned.
 		"""
-		x4 = self._read(4)
+		while True:
+			pkt = self._next()
+			if self._wanted(pkt): return pkt
+
+	def _next(self):
+		"""Get the next packet on the stream, ignoring the ID filter"""
+		if self._doc is not None:
+			# Documents are validated as a whole by the DocReader
+			return next(self._doc)
+
+		nBegOffset = self.nOffset
+
+		# Tags are tiny, copy them out so that normal bytes comparisons work
+		x4 = self._read(4).tobytes()
 		if len(x4) != 4:
+			self._bIndexed = True
 			raise StopIteration
-					
-		self.nOffset += 4
 		
 		# Try for a das v3 packet wrappers, fall back to v2.2 unless prevented
 		if x4[0:1] == b'|':
-			return self._nextVarTag(x4)
+			pkt = self._nextVarTag(x4)
 			
 		elif (x4[0:1] == b'[') or (x4[0:1] == b':'):
 
 			# In das v3, don't allow static tags
-			if self.sVersion != "2.2":
+			if self.sVersion not in ("2.2", "qstream"):
 				raise ValueError(
 					"Das version 2 packet tag '%s' detected in a version 3 stream"%x4
 				)
 
-			return self._nextStaticTag(x4)
-			
+			pkt = self._nextStaticTag(x4)
+		else:
+			pkt = None
+
+		if pkt:
+			if self.sValidate and isinstance(pkt, HdrPkt):
+				if self.schema is None:
+					self.schema = loadSchema(
+						self.sContent, self.sVersion, self.bUsingNs
+					)[0]
+				validateHdr(pkt, self.schema, self.sValidate == 'once')
+
+			if self.lIndex is not None:
+				# Content is always the last item read for a packet
+				self.lIndex.append(PktLoc(nBegOffset, pkt.tag, pkt.id, pkt.length))
+				self._lPayload.append(self.nOffset - pkt.length)
+			return pkt
+
 		raise ValueError(
 			"Unknown packet tag character %s at offset %d, %s"%(
 			str(x4[0:1]), self.nOffset - 4, 
@@ -638,31 +1479,135 @@ class PacketReader:
 		))
 	
 
+	# Random access, memory mapped inputs only ############################ #
+
+	def _checkMmap(self):
+		if self.lIndex is None:
+			raise ValueError(
+				"Random access requires a memory mapped reader, use bMmap=True"
+			)
+
+	def _indexTo(self, nPkt):
+		"""Read forward until packet number nPkt is in the index, or the
+		input ends.  Use nPkt = None to read to the end.
+		"""
+		while not self._bIndexed:
+			if (nPkt is not None) and (nPkt < len(self.lIndex)): break
+			try:
+				self.__next__()
+			except StopIteration:
+				break
+
+	def index(self):
+		"""Get the locations of every packet in the stream
+
+		Any packets not yet read are scanned to complete the index, so after
+		this call the reader is at the end of the input.
+
+		Returns (list): A PktLoc for each packet in stream order
+		"""
+		self._checkMmap()
+		self._indexTo(None)
+		return self.lIndex
+
+	def packet(self, nPkt):
+		"""Get a packet by it's position in the stream
+
+		Packet contents are views into the memory map, nothing is copied.
+		If nPkt is beyond the packets read so far the reader is advanced until
+		it's found.
+
+		Args:
+			nPkt (int) - The packet number, starting from 0.  Negative values
+				count back from the end of the stream.
+
+		Returns (Packet): A HdrPkt, DataHdrPkt or DataPkt
+
+		Raises:
+			IndexError - If the stream doesn't have that many packets
+		"""
+		self._checkMmap()
+		self._indexTo(None if nPkt < 0 else nPkt)
+
+		loc = self.lIndex[nPkt]
+		xContent = self._buf.view(self._lPayload[nPkt], loc.length)
+
+		if loc.tag == 'Pd':
+			return DataPkt(self.sVersion, loc.tag, loc.id, loc.length, xContent)
+
+		# Headers were validated as UTF-8 when first read
+		xContent = xContent.tobytes()
+		if loc.tag == 'Hx':
+			return DataHdrPkt(self.sVersion, loc.tag, loc.id, loc.length, xContent)
+		return HdrPkt(self.sVersion, loc.tag, loc.id, loc.length, xContent)
+
+	def packets(self, nPktId):
+		"""Get all the packets with a given ID
+
+		Args:
+			nPktId (int) - The packet ID, stream headers have ID 0 as do
+				comments and exceptions in das2.2 streams.
+
+		Returns (list): The headers and data packets with this ID in stream
+			order
+		"""
+		self._checkMmap()
+		self._indexTo(None)
+		return [
+			self.packet(i) for i in range(len(self.lIndex))
+			if self.lIndex[i].id == nPktId
+		]
+
+	def close(self):
+		"""Unmap the file of a memory mapped reader, the underlying file is
+		not closed.  Data packets from a memory mapped reader are views into
+		the map, so drop them before closing.  Does nothing for other readers.
+
+		Raises:
+			BufferError - If data packet contents are still held
+		"""
+		if isinstance(self._buf, MmapBuffer): self._buf.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, xType, xValue, traceback):
+		try:
+			self.close()
+		except BufferError:
+			# Views in the traceback are still alive, the map is released
+			# when they are
+			if xType is None: raise
+		return False
+
 	def _nextStaticTag(self, x4):
 		"""Return a das2.2 packet, this is complicated by the fact that pre das3
 		data packets don't have length value, parsing the associated header is required.
 		"""
-		
-		try:
-			nPktId = int(x4[1:3].decode('utf-8'), 10)
-		except ValueError:
-			raise ValueError("Invalid packet ID '%s'"%x4[1:3].decode('utf-8'))
+
+		if self.nOffset == 4 and (x4 != b'[00]'):
+			raise ValueError("Input does not start with '[00]' does not appear to be a das2 stream")
+
+		# Comment and exception packets use the ID 'xx', everything else is
+		# a two digit integer
+		if x4 in (b'[xx]', b'[XX]'):
+			nPktId = 0
+		else:
+			try:
+				nPktId = int(x4[1:3].decode('utf-8'), 10)
+			except ValueError:
+				raise ValueError("Invalid packet ID '%s'"%x4[1:3].decode('utf-8'))
 			
 		if (nPktId < 0) or (nPktId > 99):
 			raise ValueError("Invalid packet ID %s at byte offset %s"%(
 				x4[1:3].decode('utf-8'), self.nOffset
 			))
-			
-		if self.nOffset == 4 and (x4 != b'[00]'):
-			raise ValueError("Input does not start with '[00]' does not appear to be a das2 stream")
 		
 		if x4[0:1] == b'[' and x4[3:4] == b']':
 		
-			x6 = self._read(6)	
+			x6 = self._read(6).tobytes()
 			if len(x6) != 6:
 				raise ValueError("Premature end of packet %s"%x4.decode('utf-8'))
-				
-			self.nOffset += 6
 			
 			nLen = 0
 			try:
@@ -677,19 +1622,20 @@ class PacketReader:
 					"Packet length (%d) is to short for packet %s"%(
 					nLen, x4.decode('utf-8')
 				))
-					
-			xDoc = self._read(nLen)
-			self.nOffset += nLen
+			
+			# Headers are small and are decoded as text, so copy them out
+			xDoc = self._read(nLen).tobytes()
+			if len(xDoc) != nLen:
+				raise ValueError("Premature end of packet %s"%x4.decode('utf-8'))
+
 			sDoc = None
 			try:
 				sDoc = xDoc.decode("utf-8")
 			except UnicodeDecodeError:
-				ValueError("Header %s (length %d bytes) is not valid UTF-8 text"%(
+				raise ValueError("Header %s (length %d bytes) is not valid UTF-8 text"%(
 					x4.decode('utf-8'), nLen
 				))
 			
-			self.lPktDef[nPktId] = True
-			
 			# Higher level parser will have to give us the length.  This is an
 			# oversight in the das2 stream format that has been around for a while.
 			# self.lPktSize = ? 
@@ -698,31 +1644,33 @@ class PacketReader:
 			# so we have to read ahead to get the content tag
 			if x4 == b'[00]': 
 				sTag = 'Sx'
+				self.lPktDef[nPktId] = True
+				return HdrPkt(self.sVersion, sTag, nPktId, nLen, xDoc)
+
+			elif (x4 == b'[xx]') or (x4 == b'[XX]'):
+				if sDoc.startswith('<exception'): sTag = 'Ex'
+				elif sDoc.startswith('<comment'): sTag = 'Cx'
+				elif sDoc.find('comment') > 1: sTag = 'Cx'
+				elif sDoc.find('except') > 1: sTag = 'Ex'
+				else: sTag = 'Cx'
+
 				return HdrPkt(self.sVersion, sTag, nPktId, nLen, xDoc)
 
-			elif nPktId > 0: 
+			else:
 				sTag = 'Hx'
+				self.lPktDef[nPktId] = True
 				
 				# Here's where das2.2 DROPPED THE BALL.  We have to know about
 				# the higher level information just to get the size of a packet.
 				# Every other networking protocol in the world knows to include
 				# either lengths or terminators.  Geeeze.  Well... go parse it.
-				parser = Das22HdrParser()
-				fPkt = BytesIO(xDoc)
-				docTree = parser.parse(fPkt)
-				elRoot = docTree.getroot()
-				self.lPktSize[nPktId] = _getPktLen(elRoot, self.sVersion, nPktId, False)
+				(tree, nDatLen) = _parseHdr(self.sVersion, xDoc, nPktId)
+				self.lPktSize[nPktId] = nDatLen
 
-				return DataHdrPkt(self.sVersion, sTag, nPktId, nLen, xDoc)
-
-			elif (x4 == b'[xx]') or (x4 == b'[XX]'):
-				if sDoc.startswith('<exception'): sTag = 'Ex'
-				elif sDoc.startswith('<comment'): sTag = 'Cx'
-				elif sDoc.find('comment') > 1: sTag = 'Cx'
-				elif sDoc.find('except') > 1: sTag = 'Ex'
-				else: sTag = 'Cx'		
-
-			return HdrPkt(self.sVersion, sTag, nPktId, nLen, xDoc)
+				pkt = DataHdrPkt(self.sVersion, sTag, nPktId, nLen, xDoc)
+				pkt.tree = tree
+				pkt.nDatLen = nDatLen
+				return pkt
 		
 		elif (x4[0:1] == b':') and  (x4[3:4] == b':'):
 			# The old das2.2 packets which had no length, you had to parse the header.
@@ -738,8 +1686,15 @@ class PacketReader:
 					"Internal error, unknown length for data packet %d"%nPktId
 				)
 			
+			if self._skipData(nPktId):
+				nContent = self.nOffset
+				if self._buf.skip(self.lPktSize[nPktId]) != self.lPktSize[nPktId]:
+					raise ValueError("Premature end of packet data for id %d"%nPktId)
+				return SkippedDataPkt(
+					self.sVersion, 'Pd', nPktId, self.lPktSize[nPktId], nContent
+				)
+
 			xData = self._read(self.lPktSize[nPktId])
-			self.nOffset += len(xData)
 			
 			if len(xData) != self.lPktSize[nPktId]:
 				raise ValueError("Premature end of packet data for id %d"%nPktId)
@@ -760,23 +1715,23 @@ class PacketReader:
 		
 		nBegOffset = self.nOffset - 4
 		
-		# Accumulate the packet tag
-		xTag = x4
-		nPipes = 2
-		while nPipes < 4:
-			x1 = self._read(1)
-			if len(x1) == 0: break
-			self.nOffset += 1
-			xTag += x1
-			
-			if x1 == b'|':
-				nPipes += 1
-			
-			if len(xTag) > 38:
+		# Find the rest of the pipes with a buffer scan instead of byte-by-byte
+		# reads.  The tag, including the first four bytes, can't exceed 38 bytes.
+		nNeed = 4 - x4.count(b'|')
+		nTagEnd = 0
+		while nNeed > 0:
+			n = self._buf.find(b'|', nTagEnd, 38 - 4)
+			if n < 0:
+				if self._buf.avail() < 38 - 4: break  # Input ended, caught below
+
 				raise ValueError(
 					"Sanity limit of 38 bytes exceeded for packet tag '%s'"%(
-						str(xTag)[2:-1])
+						str(x4 + self._buf.peek(38 - 4).tobytes())[2:-1])
 				)
+			nTagEnd = n + 1
+			nNeed -= 1
+
+		xTag = x4 + self._read(nTagEnd).tobytes()
 		
 		try:
 			lTag = [x.decode('utf-8') for x in xTag.split(b'|')[1:4] ]
@@ -785,6 +1740,11 @@ class PacketReader:
 			raise ValueError(
 				"Packet tag '%s' is not utf-8 text at offset %d"%(xTag, nBegOffset)
 			)
+
+		if nNeed > 0:
+			raise ValueError("Pre-mature end of packet tag '%s' at offset %d"%(
+				str(xTag)[2:-1], nBegOffset
+			))
 		
 		sTag = lTag[0]
 		if sTag not in g_lValidTags:
@@ -817,8 +1777,21 @@ class PacketReader:
 				"Invalid packet length %d bytes at offset %d"%(nLen, nBegOffset)
 			)
 					
+		if sTag in ('Pd','XX') and self._skipData(nPktId):
+			if self.lPktSize[nPktId] and (nLen < self.lPktSize[nPktId]):
+				raise ValueError(
+					"Short data packet expected %d bytes found %d for |%s|%d| at offset %d"%(
+					self.lPktSize[nPktId], nLen, sTag, nPktId, self.nOffset
+				))
+
+			nContent = self.nOffset
+			if self._buf.skip(nLen) != nLen:
+				raise ValueError("Pre-mature end of packet %s|%d at offset %d"%(
+					sTag, nPktId, self.nOffset
+				))
+			return SkippedDataPkt(self.sVersion, 'Pd', nPktId, nLen, nContent)
+
 		xDoc = self._read(nLen)
-		self.nOffset += len(xDoc)
 			
 		if len(xDoc) != nLen:
 			raise ValueError("Pre-mature end of packet %s|%d at offset %d"%(
@@ -826,12 +1799,14 @@ class PacketReader:
 			))
 			
 		if sTag not in ('Pd','XX'):
-			# In a header packet, insure it decodes to text
+			# In a header packet, insure it decodes to text.  Headers are
+			# small, so copy them out of the read buffer.
+			xDoc = xDoc.tobytes()
 			sDoc = None
 			try:
 				sDoc = xDoc.decode("utf-8")
 			except UnicodeDecodeError:
-				ValueError("Header %s|%d (length %d bytes) is not valid UTF-8 text"%(
+				raise ValueError("Header %s|%d (length %d bytes) is not valid UTF-8 text"%(
 					sTag, nPktId, nLen
 				))
 			
@@ -840,15 +1815,14 @@ class PacketReader:
 			if sTag == 'Hx':
 
 				# Sanity check, make sure packet is big enough to hold minimum
-				# size das3/basic data.
-				fPkt = BytesIO(xDoc)
-				docTree = etree.parse(fPkt)
-				elRoot = docTree.getroot()
-
-				# Note, this can be None!
-				self.lPktSize[nPktId] = _getPktLen(elRoot, self.sVersion, nPktId, False)
-
-				return DataHdrPkt(self.sVersion, sTag, nPktId, nLen, xDoc)
+				# size das3/basic data.  Note, the length can be None!
+				(tree, nDatLen) = _parseHdr(self.sVersion, xDoc, nPktId)
+				self.lPktSize[nPktId] = nDatLen
+
+				pkt = DataHdrPkt(self.sVersion, sTag, nPktId, nLen, xDoc)
+				pkt.tree = tree
+				pkt.nDatLen = nDatLen
+				return pkt
 			else:
 				return HdrPkt(self.sVersion, sTag, nPktId, nLen, xDoc)
 		else:
@@ -859,5 +1833,295 @@ class PacketReader:
 					self.lPktSize[nPktId], nLen, sTag, nPktId, self.nOffset
 				))
 
-			# Return the bytes
+			# Return a read-only view of the payload bytes, no copy is made
 			return DataPkt(self.sVersion, 'Pd', nPktId, nLen, xDoc)
+
+
+# ########################################################################## #
+
+class AsyncPacketReader(PacketReader):
+	"""A packet reader for asyncio.StreamReader inputs.
+
+	Packets are the same as those returned by PacketReader, but the reader
+	is used with 'async for' and only waits on the stream, never blocks:
+
+		async def handle(stream_in, stream_out):
+			async for pkt in das2.AsyncPacketReader(stream_in):
+				...
+
+	Before each packet is parsed, enough bytes for the whole packet are
+	gathered from the stream.  The stream type is determined when the first
+	packet is requested.  As with PacketReader, gzip, bz2 and xz compressed
+	streams are detected and decompressed as the bytes arrive.
+	"""
+
+	def __init__(
+		self, stream, nChunk=65536, sValidate=None, bSkipData=False, ids=None
+	):
+		"""
+		Args:
+			stream (asyncio.StreamReader) - The input, anything with an
+				awaitable read(n) method that returns bytes.
+
+			nChunk (int) - The maximum number of bytes to request from the
+				stream in one read when more data are needed.
+
+			sValidate (str) - Header validation mode, see PacketReader
+
+			bSkipData (bool) - Return SkippedDataPkt placeholders, see
+				PacketReader.  Data still arrive over the stream but are not
+				handed to the caller.
+
+			ids (set, optional) - Packet ID filter, see PacketReader
+		"""
+		self._initState(sValidate, bSkipData, ids)
+		self.fIn = stream
+		self.nChunk = nChunk
+
+		self._buf = FeedBuffer()
+		self._bStreamEof = False
+		self._bSniffed = False
+		self._dec = None            # Decompressor for compressed streams
+		self._bCheckedComp = False
+
+	def _openDoc(self):
+		raise ValueError(
+			"XML documents can't be read asynchronously, use a PacketReader"
+		)
+
+	def _inflate(self, x):
+		"""Decompress bytes from the stream, starting a new decompressor for
+		each gzip member or bz2 stream.
+		"""
+		lOut = []
+		while x:
+			if self._dec.eof: self._dec = _decompressor(self.sCompress)
+			lOut.append(self._dec.decompress(x))
+			x = self._dec.unused_data if self._dec.eof else b''
+		return b''.join(lOut)
+
+	async def _readInput(self, nWant):
+		"""Read the next block of stream bytes, decompressed if needed.  The
+		compression format is detected on the first call.
+
+		Returns (bytes): Empty only at the end of the stream
+		"""
+		x = b''
+		if not self._bCheckedComp:
+			self._bCheckedComp = True
+			while len(x) < 6:
+				xMore = await self.fIn.read(max(nWant, 6) - len(x))
+				if not xMore: break
+				x += xMore
+
+			self.sCompress = compression(x)
+			if not self.sCompress: return x
+			self._dec = _decompressor(self.sCompress)
+			x = self._inflate(x)
+
+		while not x:
+			xRaw = await self.fIn.read(nWant)
+			if not xRaw:
+				if (self._dec is not None) and not self._dec.eof:
+					raise EOFError(
+						"The %s compressed stream ended before the end-of-stream "
+						"marker was reached"%self.sCompress
+					)
+				return b''
+			x = xRaw if self._dec is None else self._inflate(xRaw)
+		return x
+
+	async def _gather(self, nWant):
+		"""Wait until at least nWant unread bytes are buffered or the stream
+		ends.
+		"""
+		lChunks = []
+		nAvail = self._buf.avail()
+		while nAvail < nWant and not self._bStreamEof:
+			x = await self._readInput(max(self.nChunk, nWant - nAvail))
+			if not x:
+				self._bStreamEof = True
+				break
+			lChunks.append(x)
+			nAvail += len(x)
+
+		if len(lChunks) > 0: self._buf.feed(lChunks)
+
+	def _nextSize(self):
+		"""Get the number of bytes needed to parse the next packet using only
+		buffered bytes.  If the size can't be determined yet, the number of
+		bytes needed to learn more is returned.  Malformed input gives a small
+		size so that the synchronous parser reports the error.
+		"""
+		x4 = self._buf.peek(4).tobytes()
+		if len(x4) < 4: return 4
+
+		if x4[0:1] == b'|':
+			# Variable tag, find the three remaining pipes
+			nEnd = 0
+			for i in range(4 - x4.count(b'|')):
+				n = self._buf.find(b'|', 4 + nEnd, 38)
+				if n < 0: return 38
+				nEnd = n + 1 - 4
+			xTag = self._buf.peek(4 + nEnd).tobytes()
+			try:
+				nLen = int(xTag.split(b'|')[3].decode('utf-8'), 10)
+			except (ValueError, IndexError, UnicodeDecodeError):
+				return len(xTag)
+			return len(xTag) + max(nLen, 0)
+
+		if x4[0:1] == b'[':
+			x10 = self._buf.peek(10).tobytes()
+			if len(x10) < 10: return 10
+			try:
+				return 10 + max(int(x10[4:10].decode('utf-8'), 10), 0)
+			except (ValueError, UnicodeDecodeError):
+				return 10
+
+		if x4[0:1] == b':':
+			try:
+				nPktId = int(x4[1:3].decode('utf-8'), 10)
+			except (ValueError, UnicodeDecodeError):
+				return 4
+			if 0 <= nPktId < len(self.lPktSize) and self.lPktSize[nPktId]:
+				return 4 + self.lPktSize[nPktId]
+
+		return 4
+
+	async def _gatherPacket(self):
+		"""Wait until the next packet is entirely buffered, or the stream ends"""
+		while True:
+			nNeed = self._nextSize()
+			if self._buf.avail() >= nNeed or self._bStreamEof: return
+			await self._gather(nNeed)
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		"""Get the next packet on the stream, see PacketReader.__next__"""
+		if not self._bSniffed:
+			await self._gatherPacket()
+
+			# XML documents don't have packet tags, look further ahead
+			if self._buf.peek(1).tobytes() not in (b'[', b'|'):
+				await self._gather(65536)
+
+			self._sniff()
+			self._bSniffed = True
+
+		while True:
+			await self._gatherPacket()
+
+			try:
+				pkt = self._next()
+			except StopIteration:
+				raise StopAsyncIteration
+
+			if self._wanted(pkt): return pkt
+
+
+# ########################################################################## #
+# Merging time sorted streams
+
+def merge(lSources):
+	"""Merge several time sorted packet streams into a single time sorted
+	stream.
+
+	This is a k-way merge, only the next data packet from each source is
+	held at any one time, so sources of any size can be merged in one pass.
+	The sort key is the first time value in each data packet.  Records
+	within a packet are not split, so packets from different sources with
+	overlapping time spans are ordered by their first records only.
+
+	Packet IDs are remapped so that they don't collide.  Sources that use
+	identical headers share one output packet ID and so become a single
+	dataset when the output is run through a DatasetBuilder.  Headers that
+	differ get their own IDs.  Only the first stream header is output, all
+	sources must have the same stream version.
+
+	Args:
+		lSources (list) - PacketReaders, or any iterables of packets, each
+			one sorted by time.
+
+	Returns (generator): Yields Packet objects.  Packets with new IDs are
+		shallow copies, the content is not copied.
+
+	Raises:
+		ValueError - If the stream versions differ or more than 99 distinct
+			headers are needed.
+	"""
+	from . builder import mkLayout, QStreamState
+
+	lIters = [iter(src) for src in lSources]
+	lIdMap = [{} for it in lIters]      # Input packet ID -> output packet ID
+	lLayouts = [{} for it in lIters]    # Input packet ID -> PktLayout
+	lQs = [QStreamState() for it in lIters]
+	lLast = [-(2**63)]*len(lIters)      # Untimed packets keep their place
+	dHdrIds = {}                        # (tag, content) -> output packet ID
+	lVersion = [None]
+	lHeap = []
+
+	def remap(pkt, nId):
+		if pkt.id == nId: return pkt
+		pkt = copy.copy(pkt)
+		pkt.id = nId
+		return pkt
+
+	def advance(iSrc):
+		"""Output non-data packets from a source until the next data packet,
+		which is pushed on the heap."""
+		for pkt in lIters[iSrc]:
+			if isinstance(pkt, DataPkt):
+				nId = lIdMap[iSrc].get(pkt.id, None)
+				if nId is None:
+					raise DataError(
+						pkt.tag, pkt.id, None, "Data packet with no header"
+					)
+				layout = lLayouts[iSrc].get(pkt.id, None)
+				if layout is not None and pkt.content is not None:
+					nTime = layout.firstTime(pkt.content)
+					if not numpy.isnat(nTime):
+						lLast[iSrc] = int(nTime.astype('M8[ns]').astype('int64'))
+
+				heapq.heappush(lHeap, (lLast[iSrc], iSrc, remap(pkt, nId)))
+				return
+
+			if pkt.tag == 'Sx':
+				if pkt.sver == 'qstream': lQs[iSrc].streamHdr(pkt.docTree().getroot())
+				if lVersion[0] is None:
+					lVersion[0] = pkt.sver
+					yield pkt
+				elif pkt.sver != lVersion[0]:
+					raise ValueError(
+						"Can't merge version %s and %s streams"%(lVersion[0], pkt.sver)
+					)
+				continue
+
+			if not isinstance(pkt, HdrPkt) or pkt.id < 1:
+				yield pkt   # Comments, exceptions, etc.
+				continue
+
+			tKey = (pkt.tag, bytes(pkt.content))
+			nId = dHdrIds.get(tKey, None)
+			if nId is None:
+				nId = len(dHdrIds) + 1
+				if nId > 99:
+					raise ValueError("More than 99 distinct headers in merged streams")
+				dHdrIds[tKey] = nId
+				yield remap(pkt, nId)
+
+			lIdMap[iSrc][pkt.id] = nId
+			if isinstance(pkt, DataHdrPkt):
+				try:
+					lLayouts[iSrc][pkt.id] = mkLayout(pkt, lQs[iSrc])
+				except HeaderError:
+					lLayouts[iSrc][pkt.id] = None  # Can't get times, keep order
+
+	for iSrc in range(len(lIters)):
+		yield from advance(iSrc)
+
+	while lHeap:
+		(nTime, iSrc, pkt) = heapq.heappop(lHeap)
+		yield pkt
+		yield from advance(iSrc)
@@ -0,0 +1,555 @@
+# The MIT License
+#
+# Copyright 2019 Chris Piker
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Serialize Dataset objects as das2.2 or das3 streams.
+
+Headers are generated from the Dimension and Variable structure of each
+dataset.  Values that only change along the j or k index are written once in
+the header, record varying values are sent in data packets.  Packets are built
+from NumPy arrays a bounded number of records at a time, so large datasets are
+never copied into a single output buffer.
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy
+
+from . import pkt
+from . import dastime
+from . dataset import Quantity
+
+g_lDas3CoordTags = ('xCoord', 'yCoord', 'zCoord')
+
+g_nChunk = 1048576   # Default bytes of packet data per write
+
+g_nNs2000 = numpy.datetime64('2000-01-01', 'ns').astype('i8')  # us2000 epoch
+
+# ########################################################################### #
+# Properties
+
+def _timeStr(val):
+	"""ISO-8601 string for a datetime64 or DasTime value"""
+	if isinstance(val, dastime.DasTime): return str(val)
+	return str(numpy.datetime64(val, 'ns'))
+
+def _propType(val):
+	"""Get (das3 type, units, text) for a property value"""
+	if isinstance(val, (bool, numpy.bool_)):
+		return ('bool', None, 'true' if val else 'false')
+	if isinstance(val, (int, numpy.integer)):
+		return ('int', None, '%d'%val)
+	if isinstance(val, (float, numpy.floating)):
+		return ('real', None, repr(float(val)))
+	if isinstance(val, (numpy.datetime64, dastime.DasTime)):
+		return ('datetime', None, _timeStr(val))
+
+	if isinstance(val, Quantity):
+		bTime = (val.unit is not None) and (val.unit.upper() == 'UTC')
+		aVal = numpy.asarray(val.value)
+		if aVal.size == 2:
+			if bTime:
+				return ('datetimeRange', 'UTC', '%s to %s'%(
+					_timeStr(aVal.flat[0]), _timeStr(aVal.flat[1])
+				))
+			return ('realRange', val.unit, '%r to %r'%(
+				float(aVal.flat[0]), float(aVal.flat[1])
+			))
+		if aVal.size == 1:
+			if bTime: return ('datetime', None, _timeStr(aVal.flat[0]))
+			return ('real', val.unit, repr(float(aVal.flat[0])))
+
+	return ('string', None, str(val))
+
+def _das3Props(dProps, sIndent):
+	"""Get a das3 <properties> element, or an empty string for no properties"""
+	lOut = []
+	for sName in dProps:
+		if dProps[sName] is None: continue
+		(sType, sUnits, sVal) = _propType(dProps[sName])
+		sAttrs = 'name=%s'%quoteattr(sName)
+		if sType != 'string': sAttrs += ' type="%s"'%sType
+		if sUnits: sAttrs += ' units=%s'%quoteattr(sUnits)
+		lOut.append('%s  <p %s>%s</p>\n'%(sIndent, sAttrs, escape(sVal)))
+
+	if len(lOut) == 0: return ''
+	return '%s<properties>\n%s%s</properties>\n'%(sIndent, ''.join(lOut), sIndent)
+
+# das3 property types to das2.2 property types
+g_dDas2PropTypes = {
+	'bool':'boolean', 'int':'int', 'real':'double', 'datetime':'Time',
+	'datetimeRange':'TimeRange', 'realRange':'DatumRange', 'string':'String'
+}
+
+def _das2Props(dProps, sIndent):
+	"""Get a das2.2 <properties> element, values are given as attributes"""
+	lOut = []
+	for sName in dProps:
+		if dProps[sName] is None: continue
+		(sType, sUnits, sVal) = _propType(dProps[sName])
+		sType = g_dDas2PropTypes[sType]
+		if sUnits:
+			if sType == 'double': sType = 'Datum'
+			if sType != 'TimeRange': sVal = '%s %s'%(sVal, sUnits)
+		lOut.append('%s:%s=%s'%(sType, sName, quoteattr(sVal)))
+
+	if len(lOut) == 0: return ''
+	sSep = '\n%s            '%sIndent
+	return '%s<properties %s/>\n'%(sIndent, sSep.join(lOut))
+
+# ########################################################################### #
+# Variable encoding
+
+def _prefixKeep(lKeep):
+	"""Values sent in packets can only be reshaped into leading j,k axes, so
+	keep every axis unless the kept ones come first."""
+	if lKeep == sorted(lKeep, reverse=True): return lKeep
+	return [True]*len(lKeep)
+
+class _VarOut(object):
+	"""Output instructions for a single Variable.
+
+	Special members of this class are:
+
+		- .sMode - 'packet' for record varying values, 'ragged' for values
+		  with a different count in each record, 'header' for values given
+		  once in the header
+		- .tIdx - Index applied after the record index to get the values to
+		  send, broadcast axes are indexed at 0 so that only unique values
+		  are written
+		- .dtype - The output dtype for each value
+	"""
+
+	def __init__(self, dim, var, sVersion):
+		self.sDim = dim.name
+		self.var = var
+		self.sRole = var.name
+		self.sUnits = var.units or ''
+		self.fill = var.fill
+		self.bDas2 = (sVersion < '3')
+		self.nItems = 1
+		self.aHdr = None
+		self.tIdx = ()
+
+		if var.ragged is not None:
+			self.sMode = 'ragged'
+			self._setType(var.ragged.values)
+			return
+
+		array = var.array
+		nRank = len(array.shape)
+		lKeep = list(var.unique[1:])
+
+		if var.unique[0] or self.bDas2 or (array.shape[0] == 0):
+			self.sMode = 'packet'
+			lKeep = _prefixKeep(lKeep)
+		else:
+			# Constants are repeated over the j index, unless there is none
+			if (nRank > 1) and not any(lKeep): lKeep[0] = True
+			self.sMode = 'header' if nRank > 1 else 'packet'
+
+		self.tIdx = tuple(slice(None) if b else 0 for b in lKeep)
+		self._setType(array)
+
+		if self.sMode == 'header':
+			aHdr = self.encode(array[(0,) + self.tIdx])
+			if (self.sValType in ('real', 'int')) and \
+			   numpy.all(numpy.isfinite(aHdr)):
+				self.aHdr = aHdr
+			else:
+				# Only numbers can be written in the header, repeat the rest
+				# in each packet
+				self.sMode = 'packet'
+				self.tIdx = tuple(
+					slice(None) if b else 0 for b in _prefixKeep(lKeep)
+				)
+
+		self.tItems = tuple(
+			n for (n, s) in zip(array.shape[1:], self.tIdx) if s != 0
+		)
+		for n in self.tItems: self.nItems *= n
+
+		if self.sValType == 'string': self._setStrBytes(array)
+
+	def _setType(self, array):
+		"""Pick the output encoding for an array's dtype"""
+		dt = array.dtype
+		if dt.kind == 'M':
+			self.fill = None
+		elif isinstance(array, numpy.ma.MaskedArray) and self.fill is None:
+			self.fill = array.fill_value
+
+		if self.bDas2:
+			# Everything is a double in das2.2 output, times are us2000
+			if dt.kind not in 'Mfiu':
+				raise ValueError("Can't write %s:%s values of type %s to a "
+				                 "das2.2 stream"%(self.sDim, self.sRole, dt))
+			(self.dtype, self.sEncoding, self.sValType) = \
+				('<f8', 'little_endian_real8', 'real')
+			if dt.kind == 'M': self.sUnits = 'us2000'
+
+		elif dt.kind == 'M':
+			(self.dtype, self.sEncoding, self.sValType) = ('<i8', 'LEint', 'datetime')
+			self.sUnits = 'ns1970'
+		elif dt.kind == 'f':
+			nSize = max(dt.itemsize, 4)
+			(self.dtype, self.sEncoding, self.sValType) = ('<f%d'%nSize, 'LEreal', 'real')
+		elif dt.kind in 'iu':
+			if dt.itemsize == 1:
+				self.sEncoding = 'byte' if dt.kind == 'i' else 'ubyte'
+			else:
+				self.sEncoding = 'LEint' if dt.kind == 'i' else 'LEuint'
+			self.dtype = '<%s%d'%(dt.kind, dt.itemsize)
+			self.sValType = 'int'
+		elif dt.kind == 'b':
+			(self.dtype, self.sEncoding, self.sValType) = ('u1', 'ubyte', 'bool')
+		elif dt.kind in 'US':
+			(self.dtype, self.sEncoding, self.sValType) = ('S1', 'utf8', 'string')
+		else:
+			raise ValueError("Can't write %s:%s values of type %s"%(
+				self.sDim, self.sRole, dt
+			))
+
+		self.nBytes = numpy.dtype(self.dtype).itemsize
+
+	def _setStrBytes(self, array):
+		"""Size text fields to the longest UTF-8 encoded string"""
+		nMax = 1
+		for iBeg in range(0, array.shape[0], 65536):
+			aText = numpy.asarray(array[(slice(iBeg, iBeg + 65536),) + self.tIdx])
+			aEnc = numpy.char.encode(aText.astype('U'), 'utf-8')
+			nMax = max(nMax, aEnc.dtype.itemsize)
+		self.dtype = 'S%d'%nMax
+		self.nBytes = nMax
+
+	def encode(self, array):
+		"""Convert values to the output dtype"""
+		if isinstance(array, numpy.ma.MaskedArray):
+			if self.fill is not None: array = array.filled(self.fill)
+			else: array = array.data
+
+		if array.dtype.kind == 'M':
+			aNs = array.astype('M8[ns]').view('i8')
+			if self.bDas2:
+				return (aNs - g_nNs2000) / 1000.0
+			return aNs.astype(self.dtype, copy=False)
+
+		if self.sValType == 'string':
+			aText = numpy.asarray(array).astype('U')
+			return numpy.char.encode(aText, 'utf-8').astype(self.dtype)
+
+		return array.astype(self.dtype, copy=False)
+
+	def column(self, iBeg, iEnd):
+		"""Get the output values for a range of records"""
+		return self.encode(self.var.array[(slice(iBeg, iEnd),) + self.tIdx])
+
+	def values(self, iBeg, iEnd):
+		"""Get the flat output values of a range of ragged records"""
+		ragged = self.var.ragged
+		return self.encode(ragged.values[ragged.offsets[iBeg]:ragged.offsets[iEnd]])
+
+	def recBytes(self):
+		"""The average number of output bytes per record"""
+		if self.sMode == 'header': return 0
+		if self.sMode == 'ragged':
+			ragged = self.var.ragged
+			return (len(ragged.values)*self.nBytes) // max(len(ragged), 1)
+		return self.nItems*self.nBytes
+
+def _outputVars(ds, sVersion):
+	"""Get a list of (sCat, dim, lVarOut) for each dimension of a dataset"""
+	lDims = []
+	for (sCat, dDims) in (('coord', ds.dCoord), ('data', ds.dData)):
+		for sDim in dDims:
+			dim = dDims[sDim]
+			lVars = []
+			for sRole in dim.vars:
+				# Centers are re-created from reference and offset by readers
+				if sRole == 'center' and ('reference' in dim.vars) and \
+				   ('offset' in dim.vars):
+					continue
+				lVars.append(_VarOut(dim, dim.vars[sRole], sVersion))
+
+			# Values of unknown length have to come last in each packet
+			lVars.sort(key=lambda vo: vo.sMode == 'ragged')
+			if len(lVars) > 0: lDims.append( (sCat, dim, lVars) )
+	return lDims
+
+# ########################################################################### #
+# das3 headers
+
+def _das3Sizes(vo, ds):
+	"""Get the jSize and kSize attributes for the values sent for a variable"""
+	sOut = ''
+	for i in range(len(vo.tIdx)):
+		if vo.tIdx[i] != 0: sOut += ' %sSize="%d"'%('jk'[i], ds.shape[i+1])
+	return sOut
+
+def _das3Var(vo, ds, sIndent):
+	"""Get the <scalar> element for one variable"""
+	sAttrs = 'use=%s units=%s valType="%s"'%(
+		quoteattr(vo.sRole), quoteattr(vo.sUnits), vo.sValType
+	)
+	# Fill values are often numpy scalars, format them like properties
+	if vo.fill is not None: sAttrs += ' fill=%s'%quoteattr(_propType(vo.fill)[2])
+
+	if vo.sMode == 'ragged':
+		sStore = '<packet numItems="*" itemBytes="%d" encoding="%s"/>'%(
+			vo.nBytes, vo.sEncoding
+		)
+	elif vo.sMode == 'packet':
+		sAttrs += _das3Sizes(vo, ds)
+		sStore = '<packet numItems="%d" itemBytes="%d" encoding="%s"/>'%(
+			vo.nItems, vo.nBytes, vo.sEncoding
+		)
+	else:
+		sAttrs += _das3Sizes(vo, ds)
+		sFmt = '%d' if vo.sValType == 'int' else '%.17g'
+		sStore = '<values>%s</values>'%';'.join(sFmt%x for x in vo.aHdr.ravel())
+
+	return '%s<scalar %s>\n%s  %s\n%s</scalar>\n'%(
+		sIndent, sAttrs, sIndent, sStore, sIndent
+	)
+
+def _coordAxis(lVars):
+	"""The first index a coordinate dimension varies in, picks it's tag"""
+	nAxis = 2
+	for vo in lVars:
+		if vo.sMode != 'header': return 0
+		for i in range(len(vo.tIdx)):
+			if vo.tIdx[i] != 0:
+				nAxis = min(nAxis, i + 1)
+				break
+	return nAxis
+
+def _das3Header(ds, lDims):
+	"""Get the <dataset> header for a dataset and the variables to send in
+	the element order required by the das3 schema."""
+	nRank = len(ds.shape)
+	if nRank < 1 or nRank > 3:
+		raise ValueError("das3 streams hold datasets of rank 1 to 3, %s is "
+		                 "rank %d"%(ds.name, nRank))
+
+	lRagged = [vo for (_, _, lVars) in lDims for vo in lVars if vo.sMode == 'ragged']
+	if len(lRagged) > 1:
+		raise ValueError("Dataset %s has %d ragged variables, das3 packets can "
+		                 "only hold one"%(ds.name, len(lRagged)))
+	if len(lRagged) == 0 and (1 in ds.shape[1:]):
+		raise ValueError("das3 streams can't give a j or k size of 1, squeeze "
+		                 "dataset %s %s first"%(ds.name, ds.shape))
+
+	# Schema order is xCoord, yCoord, zCoord, then data.  Within each group
+	# the ragged values go last.
+	def dimOrder(tDim):
+		bRagged = tDim[2][-1].sMode == 'ragged'
+		if tDim[0] == 'data': return (3, bRagged)
+		return (_coordAxis(tDim[2]), bRagged)
+	lDims.sort(key=dimOrder)
+
+	if lRagged:
+		bAfter = False
+		for (sCat, dim, lVars) in lDims:
+			if bAfter and [vo for vo in lVars if vo.sMode != 'header']:
+				raise ValueError("Ragged %s:%s values must follow all other "
+				                 "packet values"%(lRagged[0].sDim, lRagged[0].sRole))
+			if lRagged[0] in lVars: bAfter = True
+
+	sAttrs = 'rank="%d" name=%s'%(nRank, quoteattr(ds.name))
+	if not lRagged:
+		for i in range(1, nRank): sAttrs += ' %sSize="%d"'%('jk'[i-1], ds.shape[i])
+
+	lOut = ['<dataset %s>\n'%sAttrs, _das3Props(ds.props, '  ')]
+	for (sCat, dim, lVars) in lDims:
+		if sCat == 'data': sTag = 'data'
+		else: sTag = g_lDas3CoordTags[_coordAxis(lVars)]
+
+		lOut.append('  <%s physDim=%s>\n'%(sTag, quoteattr(dim.name)))
+		lOut.append(_das3Props(dim.props, '    '))
+		for vo in lVars: lOut.append(_das3Var(vo, ds, '    '))
+		lOut.append('  </%s>\n'%sTag)
+
+	lOut.append('</dataset>\n')
+	return (''.join(lOut), [vo for (_, _, lVars) in lDims for vo in lVars])
+
+# ########################################################################### #
+# das2.2 headers
+
+def _das2Plane(sTag, dim, vo, sExtra=''):
+	sAttrs = 'name=%s type="%s"'%(quoteattr(dim.name), vo.sEncoding)
+	if sTag == 'yscan':
+		sAttrs += ' zUnits=%s'%quoteattr(vo.sUnits) + sExtra
+	else:
+		sAttrs += ' units=%s'%quoteattr(vo.sUnits)
+
+	dProps = dict(dim.props)
+	if vo.fill is not None: dProps['fill'] = vo.fill
+	sProps = _das2Props(dProps, '    ')
+	if len(sProps) == 0: return '  <%s %s/>\n'%(sTag, sAttrs)
+	return '  <%s %s>\n%s  </%s>\n'%(sTag, sAttrs, sProps, sTag)
+
+def _das2Header(ds, lDims):
+	"""Get the <packet> header for a dataset and the variables to send in
+	plane order.  Only datasets that fit the x, y, z and yscan plane model
+	are supported."""
+	nRank = len(ds.shape)
+	if nRank < 1 or nRank > 2:
+		raise ValueError("das2.2 streams hold datasets of rank 1 or 2, %s is "
+		                 "rank %d, use version='3.0'"%(ds.name, nRank))
+
+	for (sCat, dim, lVars) in lDims:
+		if len(lVars) != 1 or lVars[0].sRole != 'center':
+			raise ValueError("das2.2 streams only hold center values, %s has "
+			                 "%s, use version='3.0'"%(
+			                 dim.name, ', '.join(vo.sRole for vo in lVars)))
+		if lVars[0].sMode == 'ragged':
+			raise ValueError("das2.2 streams can't hold ragged values for %s, "
+			                 "use version='3.0'"%dim.name)
+
+	lCoord = [(dim, lVars[0]) for (sCat, dim, lVars) in lDims if sCat == 'coord']
+	lData = [(dim, lVars[0]) for (sCat, dim, lVars) in lDims if sCat == 'data']
+	lOut = ['<packet>\n']
+
+	if nRank == 1:
+		if len(lCoord) == 0:
+			raise ValueError("Dataset %s has no coordinates for the <x> plane"%ds.name)
+		lOut.append(_das2Plane('x', *lCoord[0]))
+		sTag = 'z' if len(lCoord) > 1 else 'y'
+		for (dim, vo) in lCoord[1:]: lOut.append(_das2Plane('y', dim, vo))
+		for (dim, vo) in lData: lOut.append(_das2Plane(sTag, dim, vo))
+		lPlanes = lCoord + lData
+
+	else:
+		lX = [t for t in lCoord if t[1].var.unique == [True, False]]
+		lY = [t for t in lCoord if t[1].var.unique == [False, True]]
+		lScan = [t for t in lData if t[1].nItems == ds.shape[1]]
+		if len(lX) != 1 or len(lY) != 1 or len(lCoord) != 2 or \
+		   len(lScan) != len(lData):
+			raise ValueError("Dataset %s doesn't fit the das2.2 <x> and <yscan> "
+			                 "layout, use version='3.0'"%ds.name)
+
+		voY = lY[0][1]
+		aTags = voY.encode(voY.var.array[(0,slice(None))])
+		sExtra = ' yUnits=%s nitems="%d" yTags="%s"'%(
+			quoteattr(voY.sUnits), ds.shape[1],
+			','.join('%.17g'%x for x in aTags)
+		)
+		lOut.append(_das2Plane('x', *lX[0]))
+		for (dim, vo) in lData: lOut.append(_das2Plane('yscan', dim, vo, sExtra))
+		lPlanes = lX + lData
+
+	lOut.append('</packet>\n')
+	return (''.join(lOut), [vo for (dim, vo) in lPlanes])
+
+# ########################################################################### #
+# Output
+
+def _sendRecords(fOut, buf, nRecs, lVars, nChunk):
+	"""Write all packets of one dataset, a bounded number at a time"""
+	lFixed = [vo for vo in lVars if vo.sMode == 'packet']
+	lRagged = [vo for vo in lVars if vo.sMode == 'ragged']
+	if len(lFixed) + len(lRagged) == 0: return
+
+	nRecBytes = sum(vo.recBytes() for vo in lVars) + 16  # plus tag
+	nStep = max(1, nChunk // nRecBytes)
+
+	for iBeg in range(0, nRecs, nStep):
+		iEnd = min(iBeg + nStep, nRecs)
+		lCols = [vo.column(iBeg, iEnd) for vo in lFixed]
+		if lRagged:
+			aOffsets = lRagged[0].var.ragged.offsets[iBeg:iEnd+1]
+			buf.addRagged(
+				lRagged[0].values(iBeg, iEnd), numpy.diff(aOffsets), *lCols
+			)
+		else:
+			buf.add(*lCols)
+		buf.send(fOut, False)
+
+def write_stream(dataset, fOut, version='3.0', chunk=g_nChunk):
+	"""Write datasets to a file object as a das2.2 or das3 stream
+
+	Headers are generated from the Dimensions and Variables of each dataset.
+	Values that are only unique in the j or k index, for example frequency
+	tables or waveform time offsets, are written once in the dataset header
+	using Variable.unique, and the datasets's properties are kept.  Data
+	packets are assembled a limited number of records at a time, so the
+	output is never held in memory all at once.
+
+	Times are written as ns1970 integers in das3 streams and as us2000
+	doubles in das2.2 streams.  das2.2 streams can only hold rank 1 datasets
+	and rank 2 datasets with a single <yscan> coordinate, and the properties
+	of all datasets are merged into the stream header.
+
+	Args:
+		dataset (Dataset, list) - A dataset, or a list of up to 99 datasets,
+			each is given it's own packet ID.
+
+		fOut (file) - A binary file object to receive the stream.  Output is
+			flushed at the end, not after each write.
+
+		version (str) - Either '3.0' for a das3 stream or '2.2'.
+
+		chunk (int) - The approximate number of packet bytes to assemble
+			before each write.
+
+	Raises:
+		ValueError - If a dataset can't be represented in the requested
+			stream version
+	"""
+	if isinstance(dataset, (list, tuple)): lDs = list(dataset)
+	else: lDs = [dataset]
+
+	if len(lDs) > 99:
+		raise ValueError("Streams can hold at most 99 datasets, %d given"%len(lDs))
+
+	if version.startswith('3'):
+		sFmt = 'das3'
+		sStream = '<stream type="das-basic-stream" version="3.0">\n</stream>\n'
+	elif version == '2.2':
+		# Dataset properties can only go in the das2.2 stream header
+		sFmt = 'das2'
+		dProps = {}
+		for ds in reversed(lDs): dProps.update(ds.props)
+		sStream = '<stream version="2.2">\n%s</stream>\n'%_das2Props(dProps, '  ')
+	else:
+		raise ValueError("Unknown stream version '%s', expected '3.0' or "
+		                 "'2.2'"%version)
+
+	# Check everything before any output is sent
+	lHdrs = []
+	for ds in lDs:
+		lDims = _outputVars(ds, version)
+		if sFmt == 'das3': lHdrs.append(_das3Header(ds, lDims))
+		else: lHdrs.append(_das2Header(ds, lDims))
+
+	hdr = pkt.HdrBuf(0, sFmt)
+	hdr.add(sStream)
+	hdr.send(fOut, False)
+
+	for i, (sHdr, lVars) in enumerate(lHdrs):
+		hdr = pkt.HdrBuf(i + 1, sFmt)
+		hdr.add(sHdr)
+		hdr.send(fOut, False)
+
+		buf = pkt.PktArrayBuf(i + 1, sFmt)
+		_sendRecords(fOut, buf, lDs[i].shape[0], lVars, chunk)
+
+	fOut.flush()
@@ -8,7 +8,8 @@ BD=build.$(N_ARCH)
 
 SRC=_das2.c
 PYSRC=util.py __init__.py dastime.py toml.py source.py dataset.py \
- container.py pkt.py mpl.py auth.py node.py streamsrc.py cdf.py
+ container.py pkt.py mpl.py auth.py node.py streamsrc.py cdf.py reader.py \
+ builder.py index.py writer.py
 
 BUILT_PYSRC=$(patsubst %,$(BD)/das2/%,$(PYSRC))
 INSTALLED_PYSRC=$(patsubst %.py,$(INST_HOST_LIB)/das2/%.py,$(PYSRC))
@@ -40,8 +41,18 @@ test:
 	env PYVER=$(PYVER) PYTHONPATH=$(PWD)/$(BD) test/das2_dastime_test1.sh $(BD)
 	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestCatalog.py
 	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestSortMinimal.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestReader.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestBuilder.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestIndex.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestPkt.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestWriter.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestDsOps.py
 
 
+# Throughput benchmarks, compare with: bench/bench_stream.py -b OLD.json
+bench:
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) bench/bench_stream.py -o $(BD)/bench.json
+
 # Install purelib and extensions (python setup.py is so annoyingly
 # restrictive that we'll just do this ourselves)
 install:$(INST_EXT_LIB)/_das2.so  $(INSTALLED_PYSRC)
@@ -11,9 +11,10 @@ BD=build.$(N_ARCH)
 
 SRC=_das2.c
 PYSRC=util.py __init__.py dastime.py toml.py source.py dataset.py \
- container.py pkt.py mpl.py auth.py node.py streamsrc.py cdf.py reader.py
+ container.py pkt.py mpl.py auth.py node.py streamsrc.py cdf.py reader.py \
+ builder.py index.py writer.py
 
-SCRIPTS=das_verify
+SCRIPTS=das_verify das_index
 
 CDFSRC=__init__.py const.py
 
@@ -65,6 +66,12 @@ test: verify
 	env PYVER=$(PYVER) PYTHONPATH=$(PWD)/$(BD) test/das2_dastime_test1.sh $(BD)
 	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestCatalog.py
 	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestSortMinimal.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestReader.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestBuilder.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestIndex.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestPkt.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestWriter.py
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) test/TestDsOps.py
 
 verify:
 	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) scripts/das_verify test/ex05_waveform_extra.d3t
@@ -76,6 +83,10 @@ verify:
 	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) scripts/das_verify test/ex15_vector_document.d3x
 	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) scripts/das_verify test/ex96_yscan_multispec.d2t
 
+# Throughput benchmarks, compare with: bench/bench_stream.py -b OLD.json
+bench:
+	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) bench/bench_stream.py -o $(BD)/bench.json
+
 # All the planet based test are broken right now
 examples:
 	env PYTHONPATH=$(PWD)/$(BD) python$(PYVER) examples/ex01_source_queries.py
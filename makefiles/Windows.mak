@@ -28,6 +28,12 @@ run_test:
 	python test\TestDasTime.py
 	python test\TestCatalog.py
 	python test\TestSortMinimal.py
+	python test\TestReader.py
+	python test\TestBuilder.py
+	python test\TestIndex.py
+	python test\TestPkt.py
+	python test\TestWriter.py
+	python test\TestDsOps.py
 
 install:
 	python setup.py install --prefix=$(PREFIX)
@@ -24,7 +24,7 @@ if sys.platform.lower().startswith('sunos'):
 	ext = Extension(
 		"_das2", sources=lSrc, include_dirs=lInc, define_macros=lDefs
 		,library_dirs=lLibDirs, libraries=["das2.3","fftw3", "expat", 
-		                                   "ssl", "crypto", "z"]
+		                                   "ssl", "crypto", "z", "pthread"]
 		,extra_compile_args=["-xc99"]
 	)
 elif sys.platform == 'win32':
@@ -53,7 +53,7 @@ elif sys.platform == 'darwin':
 	ext = Extension(
 		"_das2", sources=lSrc, include_dirs=lInc, define_macros=lDefs
 		,library_dirs=lLibDirs
-		,libraries=["expat", "z"]
+		,libraries=["expat", "z", "pthread"]
 		,extra_compile_args=['-std=c99', '-ggdb', '-O0']
 		,extra_objects=lExObjs
 		,extra_link_args=['-Wl,-no_compact_unwind']
@@ -63,7 +63,7 @@ else:
 	ext = Extension(
 		"_das2", sources=lSrc, include_dirs=lInc, define_macros=lDefs
 		,library_dirs=lLibDirs
-		,libraries=["fftw3", "expat", "ssl", "crypto", "z"]
+		,libraries=["fftw3", "expat", "ssl", "crypto", "z", "pthread"]
 		,extra_compile_args=['-std=c99', '-ggdb', '-O0']
 		,extra_objects=['%s/libdas2.3.a'%sCLibDir]
 	)
@@ -77,7 +77,7 @@ setup(description="Das2 extensions for python",
 	author="Chris Piker",
 	author_email="das-developers@uiowa.edu",
 	url="https://das2.org/das2py",
-	scripts=['scripts/das_verify'],
+	scripts=['scripts/das_verify', 'scripts/das_index'],
 	package_data={'das2':['xsd/*.xsd']}
 )
 
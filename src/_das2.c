@@ -713,8 +713,10 @@ static PyMethodDef pyd2_methods[] = {
 	{"can_merge",   pyd2_can_merge,   METH_VARARGS, pyd2help_can_merge   },
 	
 	/* Stuff from py_builder.c */
-	{"read_file",   pyd2_read_file,   METH_VARARGS, pyd2help_read_file   },
-	{"read_server", pyd2_read_server, METH_VARARGS, pyd2help_read_server },
+	{"read_file",   (PyCFunction)pyd2_read_file, METH_VARARGS|METH_KEYWORDS,
+	                pyd2help_read_file },
+	{"read_server", (PyCFunction)pyd2_read_server, METH_VARARGS|METH_KEYWORDS,
+	                pyd2help_read_server },
 	{"read_cmd",    pyd2_read_cmd,    METH_VARARGS, pyd2help_read_cmd    }, 
 	{"auth_set",    pyd2_auth_set,    METH_VARARGS, pyd2help_auth_set    },
 	
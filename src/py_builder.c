@@ -19,6 +19,15 @@
 #include <limits.h>
 #include <Python.h>
 
+#include <zlib.h>
+#ifndef _WIN32
+#include <pthread.h>
+#include <strings.h>
+#include <unistd.h>
+#include <sys/socket.h>
+#include <openssl/ssl.h>
+#endif
+
 #include <das2/io.h>
 #include <das2/http.h>
 #include <das2/builder.h>
@@ -430,6 +439,26 @@ PyObject* _DasTextAryToNumpyAry(DasAry* pAry)
 	return pNdAry;
 }
 
+/* ************************************************************************ */
+/* Numpy type numbers for the basic das value types, -1 if there isn't one  */
+
+static int _npyTypeForVt(das_val_type vt)
+{
+	switch(vt){
+	case vtByte:   return NPY_UINT8;
+	case vtUShort: return NPY_UINT16;
+	case vtShort:  return NPY_INT16;
+	case vtInt:    return NPY_INT32;
+	case vtLong:   return NPY_INT64;
+	case vtFloat:  return NPY_FLOAT32;
+	case vtDouble: return NPY_FLOAT64;
+	default:
+		/* Can't handle unknown types for now, could return these as just byte */
+		/* blobs to python in the future, might be handy for telemetry */
+		return -1;
+	}
+}
+
 /* ************************************************************************ */
 /* Convert a DasAry to NDarray with coping data (fast)                      */
 
@@ -443,19 +472,8 @@ static PyObject* _DasGenericAryToNumpyAry(DasAry* pAry)
 	_npdims_from_shape(pAry, &np_dims);
 
 	/* Assume check in higher level function for raggedness */
-	int nType = 0;
-	das_val_type et = DasAry_valType(pAry);
-	switch(et){
-	case vtByte:   nType = NPY_UINT8; break;
-	case vtUShort: nType = NPY_UINT16; break;
-	case vtShort:  nType = NPY_INT16; break;
-	case vtInt:    nType = NPY_INT32; break;
-	case vtLong:   nType = NPY_INT64; break;
-	case vtFloat:  nType = NPY_FLOAT32; break;
-	case vtDouble: nType = NPY_FLOAT64; break;
-	default:
-		/* Can't handle unknown types for now, could return these as just byte */
-		/* blobs to python in the future, might be handy for telemetry */
+	int nType = _npyTypeForVt(DasAry_valType(pAry));
+	if(nType < 0){
 		PyErr_Format(g_pPyD2Error, "Logic error in %s,%d", __FILE__, __LINE__);
 		return NULL;
 	}
@@ -492,19 +510,96 @@ static PyObject* _DasGenericAryToNumpyAry(DasAry* pAry)
 	return pNdAry;
 }
 
+/* ************************************************************************ */
+/* Ragged arrays as flat values plus record offsets (one copy)              */
+
+/* Is any index other than the first ragged */
+static bool _DasAryIsRagged(DasAry* pAry)
+{
+	ptrdiff_t shape[16] = {0};
+	int nRank = DasAry_shape(pAry, shape);
+	for(int d = 1; d < nRank; ++d)
+		if(shape[d] == DASIDX_RAGGED) return true;
+	return false;
+}
+
+/* Only raggedness in the last index of a rank 2 array is handled, which is
+ * what das3 packets with numItems="*" produce.  The output is the tuple
+ * (values, offsets) where record i is values[offsets[i]:offsets[i+1]].
+ * The python side wraps these in a das2.RaggedArray, padding them out to a
+ * masked ndarray only if asked. */
+static PyObject* _DasRaggedAryToNumpyAry(DasAry* pAry)
+{
+	char sInfo[64] = {'\0'};
+	DasAry_toStr(pAry, sInfo, 63);
+
+	ptrdiff_t shape[16] = {0};
+	int nRank = DasAry_shape(pAry, shape);
+	if((nRank != 2)||(shape[0] == DASIDX_RAGGED)){
+		PyErr_Format(g_pPyD2Error, "Array %s is ragged in more than the last "
+		             "index of a rank 2 array, this is not supported", sInfo);
+		return NULL;
+	}
+
+	das_val_type vt = DasAry_valType(pAry);
+	das_units units = DasAry_units(pAry);
+	int nType = _npyTypeForVt(vt);
+	if((nType < 0) || Units_haveCalRep(units) ||
+	   Units_canConvert(units, UNIT_SECONDS)){
+		PyErr_Format(g_pPyD2Error, "Ragged array %s has time values or a "
+		             "non-numeric type, these are not supported", sInfo);
+		return NULL;
+	}
+
+	npy_intp nRecs = shape[0];
+	npy_intp nOffsets = nRecs + 1;
+	PyObject* pOffsets = PyArray_SimpleNew(1, &nOffsets, NPY_INT64);
+	if(pOffsets == NULL) return NULL;
+
+	int64_t* pOff = (int64_t*) PyArray_DATA((PyArrayObject*)pOffsets);
+	ptrdiff_t aLoc[1] = {0};
+	pOff[0] = 0;
+	for(npy_intp i = 0; i < nRecs; ++i){
+		aLoc[0] = i;
+		pOff[i+1] = pOff[i] + (int64_t)DasAry_lengthIn(pAry, 1, aLoc);
+	}
+
+	/* Records are stored end to end, so all values are one flat block */
+	size_t uLen = 0;
+	const void* pMem = DasAry_getIn(pAry, vt, DIM0, &uLen);
+	if((int64_t)uLen != pOff[nRecs]){
+		PyErr_Format(g_pPyD2Error, "Array %s has %zu values but it's records "
+		             "sum to %lld", sInfo, uLen, (long long)pOff[nRecs]);
+		Py_DECREF(pOffsets);
+		return NULL;
+	}
+
+	npy_intp nVals = (npy_intp)uLen;
+	PyObject* pValues = PyArray_SimpleNew(1, &nVals, nType);
+	if(pValues == NULL){ Py_DECREF(pOffsets); return NULL; }
+	if(uLen > 0)
+		memcpy(
+			PyArray_DATA((PyArrayObject*)pValues), pMem,
+			PyArray_NBYTES((PyArrayObject*)pValues)
+		);
+
+	return Py_BuildValue("(NN)", pValues, pOffsets);  /* Steals both refs */
+}
+
 /* ************************************************************************ */
 /* Converting any* DasAry to ndarray without a data copy if possible        */
 
 /* Note that DasAry is more flexible in one respect in that all it's
- * dimensions can be ragged.  Since ndarrays allow for masks we can get around
- * numpy's limitation by making a cubic array and giving it a mask.  For now
- * I'm just not supporting ragged arrays (except of vtByte arrays that store
- * strings) since das 2.2 streams don't have them anyway.
- *
- * * TODO: Handling mask creation for ragged arrays
+ * dimensions can be ragged.  Rank 2 arrays that are ragged in the last
+ * index are output as a (values, offsets) tuple instead of an ndarray, see
+ * _DasRaggedAryToNumpyAry above.  Other ragged arrays are not supported
+ * (except of vtByte arrays that store strings).
  *
  * Basic conversion is handled as follows:
  *
+ *  0. If the array is ragged and doesn't hold strings, output a tuple of
+ *     flat values and int64 record offsets.
+ *
  *  1. If the units of the array are epoch times (no matter the data type),
  *     generate an array of numpy datetime64 objects with units ns (nanoseconds).
  *
@@ -521,6 +616,11 @@ static PyObject* _DasAryToNumpyAry(DasAry* pAry)
 {
 	das_units units = DasAry_units(pAry);
 	das_val_type vt = DasAry_valType(pAry);
+	unsigned int uFlags = DasAry_getUsage(pAry);
+	bool bString = (vt == vtText) || ((uFlags&D2ARY_AS_STRING) == D2ARY_AS_STRING);
+
+	if(!bString && _DasAryIsRagged(pAry))
+		return _DasRaggedAryToNumpyAry(pAry);
 
 	if((vt == vtTime) || Units_haveCalRep(units))
 		return _DasCalAryToNumpyAry(pAry);
@@ -528,8 +628,7 @@ static PyObject* _DasAryToNumpyAry(DasAry* pAry)
 	if(Units_canConvert(units, UNIT_SECONDS))
 		return _DasTimeAryToNumpyAry(pAry);
 
-	unsigned int uFlags = DasAry_getUsage(pAry);
-	if((vt == vtText) || ( (uFlags&D2ARY_AS_STRING) == D2ARY_AS_STRING) )
+	if(bString)
 		return _DasTextAryToNumpyAry(pAry);
 
 	return _DasGenericAryToNumpyAry(pAry);
@@ -727,7 +826,7 @@ static PyObject* _props2PyDict(DasDesc* pDesc)
  *
  *	   'arrays': {
  *			sName : ndarray,
- *			sName : ndarray,
+ *			sName : (ndarray, offsets),   (ragged arrays)
  *			sName : ndarray
  *		}
  *
@@ -811,15 +910,46 @@ static bool _addVars(int nDsRank, DasDim* pDim, PyObject* pDimDict)
 }
 
 
-static PyObject* _DsList2PyList(DasDs** lDs, size_t uDs)
+/* Variable projection, pVars is NULL or a python set of data dimension names.
+ * Coordinate dimensions are always output */
+static bool _dimWanted(DasDim* pDim, PyObject* pVars)
+{
+	if((pVars == NULL)||(pDim->dtype == DASDIM_COORD)) return true;
+
+	PyObject* pStr = PyString_FromString(pDim->sId);
+	int nIn = PySet_Contains(pVars, pStr);
+	Py_DECREF(pStr);
+	return (nIn == 1);
+}
+
+/* Only arrays that back a variable in an output dimension are converted.
+ * Operator variables such as reference + offset are not output as arrays
+ * (see ds_from_raw), so only array variables are checked. */
+static bool _aryWanted(DasDs* pDs, DasAry* pAry, PyObject* pVars)
+{
+	if(pVars == NULL) return true;
+
+	DasVar* pVar = NULL;
+	for(size_t m = 0; m < pDs->uDims; ++m){
+		if(!_dimWanted(pDs->lDims[m], pVars)) continue;
+		for(size_t v = 0; v < pDs->lDims[m]->uVars; ++v){
+			pVar = pDs->lDims[m]->aVars[v];
+			if((pVar->vartype == D2V_ARRAY) && (DasVarAry_getArray(pVar) == pAry))
+				return true;
+		}
+	}
+	return false;
+}
+
+static PyObject* _DsList2PyList(DasDs** lDs, size_t uDs, PyObject* pVars)
 {
 	DasDs* pDs = NULL;
 	DasDim* pDim = NULL;
 	PyObject* pRetList = PyList_New(uDs);
 
 	/* Before going through all the setup, see if the Das Arrays can even be
-	 * converted to ndarrays with this extension.  Once code has been written
-	 * to generate ragged ndarrays, remove this check */
+	 * converted to ndarrays with this extension.  Only rank 2 arrays that are
+	 * ragged in the last index can be output as (values, offsets) tuples */
 
 	/* Iteration variables used here */
 	size_t d = 0; /* Dataset index */
@@ -835,6 +965,7 @@ static PyObject* _DsList2PyList(DasDs** lDs, size_t uDs)
 		pDs = lDs[d];
 		for(a = 0; a <pDs->uArrays; ++a){
 			pDasAry = pDs->lArrays[a];
+			if(!_aryWanted(pDs, pDasAry, pVars)) continue;
 
 			/* Make sure the das array does not contain a user defined type */
 			if(DasAry_valType(pDasAry) == vtUnknown){
@@ -859,10 +990,14 @@ static PyObject* _DsList2PyList(DasDs** lDs, size_t uDs)
 						((pDasAry->uFlags & D2ARY_AS_STRING)==D2ARY_AS_STRING) )
 						continue;
 
+					/* Also rank 2 arrays with variable length records */
+					if((i == 1) && (pDasAry->nRank == 2)) continue;
+
 					PyErr_Format(g_pPyD2Error,
-						"Array %s from dataset %s is ragged.  Conversion "
-						"of ragged DasArrays to NumPy ndarrays has not been "
-						"implemented.", DasAry_toStr(pDasAry, sInfo, 63), pDs->sId
+						"Array %s from dataset %s is ragged in more than the "
+						"last index.  Conversion of these DasArrays to NumPy "
+						"has not been implemented.",
+						DasAry_toStr(pDasAry, sInfo, 63), pDs->sId
 					);
 					return NULL;
 				}
@@ -940,6 +1075,7 @@ static PyObject* _DsList2PyList(DasDs** lDs, size_t uDs)
 
 		for(m = 0; m < pDs->uDims; ++m){
 			pDim = pDs->lDims[m];
+			if(!_dimWanted(pDim, pVars)) continue;
 
 			/* Create and add the dimension dictionary to the right category */
 			pDimDict = PyDict_New();
@@ -969,6 +1105,8 @@ static PyObject* _DsList2PyList(DasDs** lDs, size_t uDs)
 		pdArys = PyDict_New();
 		pdFill = PyDict_New();
 		for(a = 0; a < pDs->uArrays; ++a){
+			if(!_aryWanted(pDs, pDs->lArrays[a], pVars)) continue;
+
 			pAry = _DasAryToNumpyAry(pDs->lArrays[a]);
 			if(pAry == NULL){
 				Py_DECREF(pdFill); Py_DECREF(pdArys); Py_DECREF(pDsDict);
@@ -1005,6 +1143,256 @@ static PyObject* _DsList2PyList(DasDs** lDs, size_t uDs)
 	return pRetList;
 }
 
+/* ************************************************************************* */
+/* Packet ID filtering.  Sits between DasIO and the dataset builder so that
+ * the builder never sees headers or data for unwanted packet IDs and thus
+ * never allocates arrays for them. */
+
+typedef struct py_pkt_filter {
+	StreamHandler base;
+	StreamHandler* pNext;  /* Usually a DasDsBldr */
+	bool aKeep[100];
+} PyPktFilter;
+
+static DasErrCode _filt_streamDesc(StreamDesc* pSd, void* vp)
+{
+	StreamHandler* pNext = ((PyPktFilter*)vp)->pNext;
+	if(pNext->streamDescHandler == NULL) return DAS_OKAY;
+	return pNext->streamDescHandler(pSd, pNext->userData);
+}
+
+static DasErrCode _filt_pktDesc(StreamDesc* pSd, PktDesc* pPd, void* vp)
+{
+	PyPktFilter* pThis = (PyPktFilter*)vp;
+	StreamHandler* pNext = pThis->pNext;
+	if(!pThis->aKeep[PktDesc_getId(pPd)] || (pNext->pktDescHandler == NULL))
+		return DAS_OKAY;
+	return pNext->pktDescHandler(pSd, pPd, pNext->userData);
+}
+
+static DasErrCode _filt_pktRedef(StreamDesc* pSd, PktDesc* pPd, void* vp)
+{
+	PyPktFilter* pThis = (PyPktFilter*)vp;
+	StreamHandler* pNext = pThis->pNext;
+	if(!pThis->aKeep[PktDesc_getId(pPd)] || (pNext->pktRedefHandler == NULL))
+		return DAS_OKAY;
+	return pNext->pktRedefHandler(pSd, pPd, pNext->userData);
+}
+
+static DasErrCode _filt_pktData(PktDesc* pPd, void* vp)
+{
+	PyPktFilter* pThis = (PyPktFilter*)vp;
+	StreamHandler* pNext = pThis->pNext;
+	if(!pThis->aKeep[PktDesc_getId(pPd)] || (pNext->pktDataHandler == NULL))
+		return DAS_OKAY;
+	return pNext->pktDataHandler(pPd, pNext->userData);
+}
+
+static DasErrCode _filt_except(OobExcept* pExcept, void* vp)
+{
+	StreamHandler* pNext = ((PyPktFilter*)vp)->pNext;
+	if(pNext->exceptionHandler == NULL) return DAS_OKAY;
+	return pNext->exceptionHandler(pExcept, pNext->userData);
+}
+
+static DasErrCode _filt_comment(OobComment* pCmt, void* vp)
+{
+	StreamHandler* pNext = ((PyPktFilter*)vp)->pNext;
+	if(pNext->commentHandler == NULL) return DAS_OKAY;
+	return pNext->commentHandler(pCmt, pNext->userData);
+}
+
+static DasErrCode _filt_close(StreamDesc* pSd, void* vp)
+{
+	StreamHandler* pNext = ((PyPktFilter*)vp)->pNext;
+	if(pNext->closeHandler == NULL) return DAS_OKAY;
+	return pNext->closeHandler(pSd, pNext->userData);
+}
+
+/* Add the builder to the input, behind a packet ID filter if pIds is not
+ * None.  The filter must live until reading is done.  Returns false and sets
+ * a python exception if pIds isn't an iterable of packet IDs */
+static bool _addBldr(
+	DasIO* pIn, DasDsBldr* pBldr, PyObject* pIds, PyPktFilter* pFilt
+){
+	if((pIds == NULL)||(pIds == Py_None)){
+		DasIO_addProcessor(pIn, (StreamHandler*)pBldr);
+		return true;
+	}
+
+	memset(pFilt, 0, sizeof(PyPktFilter));
+	PyObject* pIter = PyObject_GetIter(pIds);
+	if(pIter == NULL) return false;
+
+	PyObject* pItem = NULL;
+	long nId = 0;
+	while((pItem = PyIter_Next(pIter)) != NULL){
+		nId = PyLong_AsLong(pItem);
+		Py_DECREF(pItem);
+		if((nId < 1)||(nId > 99)){
+			Py_DECREF(pIter);
+			if(!PyErr_Occurred())
+				PyErr_Format(PyExc_ValueError, "Packet ID %ld is not in the range 1 to 99", nId);
+			return false;
+		}
+		pFilt->aKeep[nId] = true;
+	}
+	Py_DECREF(pIter);
+	if(PyErr_Occurred()) return false;
+
+	pFilt->pNext = (StreamHandler*)pBldr;
+	pFilt->base.streamDescHandler = _filt_streamDesc;
+	pFilt->base.pktDescHandler    = _filt_pktDesc;
+	pFilt->base.pktRedefHandler   = _filt_pktRedef;
+	pFilt->base.pktDataHandler    = _filt_pktData;
+	pFilt->base.exceptionHandler  = _filt_except;
+	pFilt->base.commentHandler    = _filt_comment;
+	pFilt->base.closeHandler      = _filt_close;
+	pFilt->base.userData          = pFilt;
+
+	DasIO_addProcessor(pIn, (StreamHandler*)pFilt);
+	return true;
+}
+
+/* Convert the vars argument to a set, NULL with no exception for None */
+static PyObject* _varSet(PyObject* pVars)
+{
+	if((pVars == NULL)||(pVars == Py_None)) return NULL;
+	return PySet_New(pVars);
+}
+
+/* ************************************************************************* */
+/* Gzip content encoding.  DasIO reads the raw socket, so when a server
+ * compresses the message body a thread inflates the socket data into one
+ * end of a socket pair and DasIO reads the other end.  Only one chunk of
+ * compressed and decompressed data is in memory at a time. */
+
+#ifndef _WIN32
+
+#ifndef MSG_NOSIGNAL
+#define MSG_NOSIGNAL 0
+#endif
+
+typedef struct gz_pump {
+	DasHttpResp* pRes;
+	int nOut;       /* Write end of the socket pair */
+	int nZRet;      /* Final zlib status, Z_STREAM_END if the body was whole */
+	pthread_t thread;
+} GzPump;
+
+static bool _isGzipped(const DasHttpResp* pRes)
+{
+	const char* sKey = "content-encoding:";
+	size_t uKey = strlen(sKey);
+	const char* p = pRes->sHeaders;
+	if(p == NULL) return false;
+
+	while(*p != '\0'){
+		if(strncasecmp(p, sKey, uKey) == 0){
+			p += uKey;
+			while((*p == ' ')||(*p == '\t')) ++p;
+			return (strncasecmp(p, "gzip", 4) == 0)||(strncasecmp(p, "x-gzip", 6) == 0);
+		}
+		p = strchr(p, '\n');
+		if(p == NULL) break;
+		++p;
+	}
+	return false;
+}
+
+static bool _sendAll(int nFd, const unsigned char* pBuf, size_t uLen)
+{
+	ssize_t nSent;
+	while(uLen > 0){
+		nSent = send(nFd, pBuf, uLen, MSG_NOSIGNAL);
+		if(nSent <= 0) return false;  /* Reader closed early */
+		pBuf += nSent;
+		uLen -= nSent;
+	}
+	return true;
+}
+
+static void* _gzPump(void* vp)
+{
+	GzPump* pPump = (GzPump*)vp;
+	DasHttpResp* pRes = pPump->pRes;
+	unsigned char aIn[16384];
+	unsigned char aOut[65536];
+	int nRead = 0;
+	int nRet = Z_OK;
+
+	z_stream strm;
+	memset(&strm, 0, sizeof(z_stream));
+	nRet = inflateInit2(&strm, 16 + MAX_WBITS);  /* Expect a gzip wrapper */
+	if(nRet != Z_OK){
+		pPump->nZRet = nRet;
+		close(pPump->nOut);
+		return NULL;
+	}
+
+	while(true){
+		if(pRes->pSsl != NULL) nRead = SSL_read(pRes->pSsl, aIn, sizeof(aIn));
+		else                   nRead = recv(pRes->nSockFd, aIn, sizeof(aIn), 0);
+		if(nRead <= 0) break;
+
+		strm.next_in = aIn;
+		strm.avail_in = nRead;
+		do{
+			/* Bodies may be several gzip members back to back */
+			if((nRet == Z_STREAM_END)&&(strm.avail_in > 0)){
+				if((nRet = inflateReset(&strm)) != Z_OK) goto PUMP_DONE;
+			}
+			strm.next_out = aOut;
+			strm.avail_out = sizeof(aOut);
+			nRet = inflate(&strm, Z_NO_FLUSH);
+			if(nRet == Z_BUF_ERROR) nRet = Z_OK;  /* Just needs more input */
+			if((nRet != Z_OK)&&(nRet != Z_STREAM_END)) goto PUMP_DONE;
+
+			if(!_sendAll(pPump->nOut, aOut, sizeof(aOut) - strm.avail_out)){
+				nRet = Z_ERRNO;
+				goto PUMP_DONE;
+			}
+		} while((strm.avail_out == 0)||(strm.avail_in > 0));
+	}
+
+PUMP_DONE:
+	inflateEnd(&strm);
+	pPump->nZRet = nRet;
+	close(pPump->nOut);  /* Reader sees end of stream */
+	return NULL;
+}
+
+/* Returns the socket to hand to DasIO or -1 on error.  The pump owns the
+ * write end and closes it when the body is done.  The read end belongs to
+ * the DasIO it is handed to and is closed by del_DasIO, never here. */
+static int _startPump(DasHttpResp* pRes, GzPump* pPump)
+{
+	int aPair[2];
+	if(socketpair(AF_UNIX, SOCK_STREAM, 0, aPair) != 0) return -1;
+
+	pPump->pRes = pRes;
+	pPump->nOut = aPair[1];
+	pPump->nZRet = Z_OK;
+	if(pthread_create(&(pPump->thread), NULL, _gzPump, pPump) != 0){
+		close(aPair[0]);
+		close(aPair[1]);
+		return -1;
+	}
+	return aPair[0];
+}
+
+/* Shutting down the read end unblocks the pump if DasIO stopped early.  The
+ * descriptor itself is left open for del_DasIO, so this must be called
+ * before the DasIO is deleted. */
+static int _stopPump(GzPump* pPump, int nIn)
+{
+	shutdown(nIn, SHUT_RDWR);
+	pthread_join(pPump->thread, NULL);
+	return pPump->nZRet;
+}
+
+#endif /* _WIN32 */
+
 /* ************************************************************************* */
 const char pyd2help_read_file[] =
 "Reads a Das2 stream from a disk file and returns a list of DasDs (das dataset)\n"
@@ -1015,6 +1403,11 @@ const char pyd2help_read_file[] =
 "\n"
 "Args:\n"
 "   sFile (str) : The filename to read\n"
+"   ids (set, optional) : Only output datasets for these packet IDs.  Other\n"
+"      packets are still parsed, but no arrays are allocated for them.\n"
+"   vars (set, optional) : Only output these data dimensions, by name.\n"
+"      Coordinates are always output.  Arrays that are only used by other\n"
+"      data dimensions are not converted to ndarrays.\n"
 "\n"
 "Return:\n"
 "   A list of correlated datasets.  Each correlated dataset is a dictionary\n"
@@ -1042,23 +1435,38 @@ const char pyd2help_read_file[] =
 "\n"
 "Each dataset is defined by a dictionary with the same keys as the coordinates\n"
 "\n"
-"The array dictionary is a mapping of array ID names to backing ndarrays\n"
+"The array dictionary is a mapping of array ID names to backing ndarrays.\n"
+"Arrays with a variable number of items in each record are given as a tuple\n"
+"of (values, offsets) ndarrays, where record i is values[offsets[i]:offsets[i+1]]\n"
 "\n";
 
-static PyObject* pyd2_read_file(PyObject* self, PyObject* args)
+static PyObject* pyd2_read_file(PyObject* self, PyObject* args, PyObject* kwds)
 {
 	const char* sFile;
+	PyObject* pIds = NULL;
+	PyObject* pVarsArg = NULL;
 	int nRet = DAS_OKAY;
+	PyPktFilter filt;
 
-	if(!PyArg_ParseTuple(args, "s:read_file", &sFile))
+	static char* kwlist[] = {"sFile", "ids", "vars", NULL};
+	if(!PyArg_ParseTupleAndKeywords(args, kwds, "s|OO:read_file", kwlist,
+	                                &sFile, &pIds, &pVarsArg))
 		return NULL;
 
+	PyObject* pVars = _varSet(pVarsArg);
+	if((pVars == NULL) && PyErr_Occurred()) return NULL;
+
 	DasIO* pIn = new_DasIO_file("libdas2", sFile, "r");
-	if(pIn == NULL) return pyd2_setException(g_pPyD2Error);
+	if(pIn == NULL){ Py_XDECREF(pVars); return pyd2_setException(g_pPyD2Error); }
 
 	DasDsBldr* pBldr = new_DasDsBldr();
-	if(pBldr == NULL) return pyd2_setException(g_pPyD2Error);
-	DasIO_addProcessor(pIn, (StreamHandler*)pBldr);
+	if(pBldr == NULL){ Py_XDECREF(pVars); return pyd2_setException(g_pPyD2Error); }
+	if(!_addBldr(pIn, pBldr, pIds, &filt)){
+		del_DasIO(pIn);
+		del_DasDsBldr(pBldr);
+		Py_XDECREF(pVars);
+		return NULL;
+	}
 
 	/* Release the GIL while doing I/O */
 	Py_BEGIN_ALLOW_THREADS
@@ -1068,6 +1476,7 @@ static PyObject* pyd2_read_file(PyObject* self, PyObject* args)
 	if(nRet != DAS_OKAY){
 		del_DasIO(pIn);
 		del_DasDsBldr(pBldr);
+		Py_XDECREF(pVars);
 		return pyd2_setException(g_pPyD2Error);
 	}
 
@@ -1077,7 +1486,8 @@ static PyObject* pyd2_read_file(PyObject* self, PyObject* args)
 
 	DasDsBldr_release(pBldr); /* Free the correlated datasets from builder mem */
 
-	PyObject* pRet = _DsList2PyList(lDs, uCorDs);
+	PyObject* pRet = _DsList2PyList(lDs, uCorDs, pVars);
+	Py_XDECREF(pVars);
 
 	for(size_t u = 0; u < uCorDs; ++u){
 		/* arrays don't own re-used data and may be freed */
@@ -1090,9 +1500,10 @@ static PyObject* pyd2_read_file(PyObject* self, PyObject* args)
 
 /* ************************************************************************* */
 static const char pyd2help_read_server[] =
-"read_server(sUrl, sAgent=None)\n"
+"read_server(sUrl, rConSec, sAgent=None, ids=None, vars=None)\n"
 "\n"
-"Reads a Das2 stream from a remote HTTP/HTTPS server.\n"
+"Reads a Das2 stream from a remote HTTP/HTTPS server.  Message bodies sent\n"
+"with Content-Encoding: gzip are decompressed as they arrive.\n"
 "\n"
 "Note:\n"
 "   This function releases the global interpreter lock during data download\n"
@@ -1103,6 +1514,9 @@ static const char pyd2help_read_server[] =
 "      remote server in seconds.  A value of <= 0.0 means wait as long as\n"
 "      the operating system allows."
 "   sAgent (str,optional) : The user agent string you'd like to use\n"
+"   ids (set, optional) : Only output datasets for these packet IDs, see\n"
+"      read_file\n"
+"   vars (set, optional) : Only output these data dimensions, see read_file\n"
 "\n"
 "Returns:\n"
 "   A list of datasets.  As defined in the section :ref:`Low-level Dataset Output`\n"
@@ -1110,17 +1524,25 @@ static const char pyd2help_read_server[] =
 ;
 
 /* Read in das2 stream from a server */
-static PyObject* pyd2_read_server(PyObject* self, PyObject* args)
+static PyObject* pyd2_read_server(PyObject* self, PyObject* args, PyObject* kwds)
 {
 	const char* sInitialUrl = "http://planet.physics.uiowa.edu/das/das2Server"
 	       "?server=dataset&dataset=Galileo/PWS/Survey_Electric"
 	       "&start_time=2001-001&end_time=2001-002";
 	const char* sUserAgent = NULL;
 	float rConSec = DASHTTP_TO_MIN * DASHTTP_TO_MULTI;
-	if(!PyArg_ParseTuple(args, "s|fs:read_server", &sInitialUrl, &rConSec,
-			               &sUserAgent))
+	PyObject* pIds = NULL;
+	PyObject* pVarsArg = NULL;
+	PyPktFilter filt;
+
+	static char* kwlist[] = {"sUrl", "rConSec", "sAgent", "ids", "vars", NULL};
+	if(!PyArg_ParseTupleAndKeywords(args, kwds, "s|fzOO:read_server", kwlist,
+	                     &sInitialUrl, &rConSec, &sUserAgent, &pIds, &pVarsArg))
 		return NULL;
 
+	PyObject* pVars = _varSet(pVarsArg);
+	if((pVars == NULL) && PyErr_Occurred()) return NULL;
+
 	bool bOkay = false;
 	DasHttpResp res;
 	PyObject* pExcept = g_pPyD2Error;
@@ -1139,6 +1561,7 @@ static PyObject* pyd2_read_server(PyObject* self, PyObject* args)
 		pRet = PyErr_Format(pExcept, "%d, Could not get body for URL, reason: %s",
 		                    res.nCode, res.sError);
 		DasHttpResp_clear(&res);
+		Py_XDECREF(pVars);
 		return pRet;
 	}
 	char sUrl[512] = {'\0'};
@@ -1147,20 +1570,47 @@ static PyObject* pyd2_read_server(PyObject* self, PyObject* args)
 		daslog_info_v("Redirected to %s", sUrl);
 
 	DasIO* pIn;
-
+	int nGzIn = -1;
+#ifndef _WIN32
+	GzPump pump;
+	if(_isGzipped(&res)){
+		if((nGzIn = _startPump(&res, &pump)) < 0){
+			DasHttpResp_clear(&res);
+			Py_XDECREF(pVars);
+			return PyErr_Format(g_pPyD2Error,
+				"Couldn't start decompression for gzip encoded body from %s", sUrl
+			);
+		}
+		pIn = new_DasIO_socket("libdas2", nGzIn, "r");
+	}
+	else
+#endif
 	if(DasHttpResp_useSsl(&res))
 		pIn = new_DasIO_ssl("libdas2", res.pSsl, "r");
 	else
 		pIn = new_DasIO_socket("libdas2", res.nSockFd, "r");
 
 	DasDsBldr* pBldr = new_DasDsBldr();
-	DasIO_addProcessor(pIn, (StreamHandler*)pBldr);
+	if(!_addBldr(pIn, pBldr, pIds, &filt)){
+#ifndef _WIN32
+		if(nGzIn >= 0) _stopPump(&pump, nGzIn);
+#endif
+		del_DasIO(pIn);
+		del_DasDsBldr(pBldr);
+		DasHttpResp_clear(&res);
+		Py_XDECREF(pVars);
+		return NULL;
+	}
 
 	int nRet = DAS_OKAY;
+	int nZRet = Z_STREAM_END;
 
 	/* Release the GIL while processing the message body */
 	Py_BEGIN_ALLOW_THREADS
 	nRet = DasIO_readAll(pIn);
+#ifndef _WIN32
+	if(nGzIn >= 0) nZRet = _stopPump(&pump, nGzIn);
+#endif
 	Py_END_ALLOW_THREADS
 
 	if(nRet != DAS_OKAY){
@@ -1170,16 +1620,29 @@ static PyObject* pyd2_read_server(PyObject* self, PyObject* args)
 
 		pRet = pyd2_setException(g_pPyD2Error);
 		DasHttpResp_clear(&res);
+		Py_XDECREF(pVars);
 		return pRet;
 	}
 
+	if(nZRet != Z_STREAM_END){
+		del_DasIO(pIn);
+		del_DasDsBldr(pBldr);
+		DasHttpResp_clear(&res);
+		Py_XDECREF(pVars);
+		return PyErr_Format(g_pPyD2Error,
+			"Gzip encoded body from %s is truncated or corrupt (zlib status %d)",
+			sUrl, nZRet
+		);
+	}
+
 	/* Build python list of dataset objects here */
 	size_t uDs = 0;
 	DasDs** lDs = DasDsBldr_getDataSets(pBldr, &uDs);
 
 	DasDsBldr_release(pBldr); /* Free the correlated datasets from builder mem */
 
-	PyObject* pDsList = _DsList2PyList(lDs, uDs);
+	PyObject* pDsList = _DsList2PyList(lDs, uDs, pVars);
+	Py_XDECREF(pVars);
 
 	for(size_t u = 0; u < uDs; ++u){
 		/* arrays don't own re-used data and may be freed */
@@ -1250,7 +1713,7 @@ static PyObject* pyd2_read_cmd(PyObject* self, PyObject* args)
 
 	DasDsBldr_release(pBldr); /* Free the correlated datasets from builder mem */
 
-	PyObject* pRet = _DsList2PyList(lDs, uDs);
+	PyObject* pRet = _DsList2PyList(lDs, uDs, NULL);
 
 	for(size_t u = 0; u < uDs; ++u){
 		/* arrays don't own re-used data and may be freed */
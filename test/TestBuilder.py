@@ -0,0 +1,344 @@
+"""Testing the pure python dataset builder"""
+
+import os.path
+import struct
+import unittest
+from io import BytesIO
+
+import numpy
+
+import das2
+
+g_sTestDir = os.path.dirname(os.path.abspath(__file__))
+
+def readStream(sFile, **kwargs):
+	builder = das2.DatasetBuilder(**kwargs)
+	with open(os.path.join(g_sTestDir, sFile), 'rb') as fIn:
+		for pkt in das2.PacketReader(fIn):
+			builder.add(pkt)
+	return builder.datasets()
+
+def raggedStream(lSweeps, bText=False):
+	"""Make a das3 stream with a variable number of amplitudes per packet"""
+	if bText:
+		sAmp = '<packet numItems="*" itemBytes="*" valTerm=";" encoding="utf8"/>'
+	else:
+		sAmp = '<packet numItems="*" itemBytes="4" encoding="LEreal"/>'
+
+	sHdr = '''<dataset name="sweeps" rank="2" jSize="*">
+  <xCoord physDim="time">
+    <scalar use="center" units="t2000" valType="real">
+      <packet numItems="1" itemBytes="8" encoding="LEreal"/>
+    </scalar>
+  </xCoord>
+  <data physDim="amplitude">
+    <scalar use="center" units="V" valType="real" jSize="*" fill="-1">
+      %s
+    </scalar>
+  </data>
+</dataset>'''%sAmp
+	xHdr = sHdr.encode('utf-8')
+	xSx = b'<stream type="das-basic-stream" version="3.0" />'
+
+	lOut = [b'|Sx||%d|'%len(xSx), xSx, b'|Hx|1|%d|'%len(xHdr), xHdr]
+	for i in range(len(lSweeps)):
+		xPkt = struct.pack('<d', 60.0*i)
+		if bText: xPkt += b''.join(b'%g;'%r for r in lSweeps[i])
+		else: xPkt += struct.pack('<%df'%len(lSweeps[i]), *lSweeps[i])
+		lOut += [b'|Pd|1|%d|'%len(xPkt), xPkt]
+
+	return b''.join(lOut)
+
+def qStream(lRecs, bText=False):
+	"""Make a QStream with a spectrum per packet and inline frequencies"""
+	def hdr(nId, sXml):
+		x = ('<?xml version="1.0" encoding="UTF-8"?>\n' + sXml).encode('utf-8')
+		return b'[%02d]%06d'%(nId, len(x)) + x
+
+	def prop(sName, sType, sVal):
+		return '<property name="%s" type="%s" value="%s"/>'%(sName, sType, sVal)
+
+	if bText: (sTimeEnc, sSpecEnc) = ('time24', 'ascii10')
+	else: (sTimeEnc, sSpecEnc) = ('double', 'float')
+
+	lOut = [
+		hdr(0, '<stream dataset_id="spec" byte_order="little_endian"><properties>'
+		    + prop('TITLE', 'String', 'Test Spectra') + '</properties></stream>'),
+		hdr(1, '<packet><qdataset id="freq" rank="1"><properties>'
+		    + prop('UNITS', 'units', 'Hz') + prop('LABEL', 'String', 'Frequency')
+		    + '</properties><values encoding="ascii10" length="3" values="10,20,30"/>'
+		    + '</qdataset></packet>'),
+		hdr(2, '<packet><qdataset id="time" rank="1"><properties>'
+		    + prop('UNITS', 'units', 't2000')
+		    + '</properties><values encoding="%s" length=""/></qdataset>'%sTimeEnc
+		    + '<qdataset id="spec" rank="2"><properties>'
+		    + prop('DEPEND_0', 'qdataset', 'time') + prop('DEPEND_1', 'qdataset', 'freq')
+		    + prop('FILL_VALUE', 'double', '-1.0E31') + prop('UNITS', 'units', 'V')
+		    + '</properties><values encoding="%s" length="3"/></qdataset>'%sSpecEnc
+		    + '</packet>')
+	]
+	for (rTime, lSpec) in lRecs:
+		if bText:
+			sTime = str(numpy.datetime64('2000-01-01', 'ms') + int(rTime*1000))
+			xRec = ('%-24s'%sTime + ''.join('%10.3e'%r for r in lSpec)).encode()
+		else:
+			xRec = struct.pack('<d3f', rTime, *lSpec)
+		lOut.append(b':02:' + xRec)
+
+	return b''.join(lOut)
+
+class TestBuilder(unittest.TestCase):
+
+	def test_das22_text(self):
+		"""Text yscan and y planes from a das2.2 stream"""
+		lDs = readStream('test_sort.d2t')
+		self.assertEqual(len(lDs), 2)
+
+		ds = lDs[0]
+		self.assertEqual(ds.shape, (6, 6))
+		self.assertEqual(ds.props['summary'][:9], 'Same data')
+		self.assertEqual(
+			list(ds['amp']['center'].array[0]), [32, 34, 36, 33, 31, 35]
+		)
+		self.assertEqual(
+			list(ds['frequency']['center'].array[0]), [20, 40, 60, 30, 10, 50]
+		)
+		self.assertEqual(
+			ds['time']['center'].array[3,0], numpy.datetime64('2013-05-15', 'ns')
+		)
+
+		ds = lDs[1]
+		self.assertEqual(ds.shape, (36,))
+		self.assertEqual(ds['amp']['center'].array[-1], 55)
+		self.assertEqual(ds['frequency']['center'].array[-1], 50)
+
+	def test_das22_props(self):
+		"""Axis properties move to dimensions"""
+		lDs = readStream('ex96_yscan_multispec.d2t')
+		for ds in lDs:
+			self.assertEqual(ds['time'].props['tagWidth'].value, 128.0)
+			self.assertEqual(ds['amplitude'].props['fill'], -1e31)
+
+	def test_das3_binary(self):
+		"""Binary values decode the same in one run as in many runs"""
+		lDs = readStream('ex06_waveform_binary.d3b')
+		self.assertEqual(len(lDs), 1)
+		ds = lDs[0]
+		self.assertEqual(ds.shape, (32, 6144))
+		self.assertEqual(ds['time']['reference'].array.dtype, numpy.dtype('M8[ns]'))
+		self.assertEqual(ds['Ey']['center'].array.dtype, numpy.dtype('float32'))
+
+		ds2 = readStream('ex06_waveform_binary.d3b', nRunMax=1)[0]
+		self.assertTrue(numpy.array_equal(
+			ds['Ey']['center'].array, ds2['Ey']['center'].array
+		))
+		self.assertTrue(numpy.array_equal(
+			ds['time']['reference'].array, ds2['time']['reference'].array
+		))
+
+	def test_das3_text(self):
+		"""Text values match the binary version of the same data"""
+		dsText = readStream('ex05_waveform_extra.d3t')[0]
+		dsBin = readStream('ex06_waveform_binary.d3b')[0]
+
+		aText = dsText['time']['reference'].array
+		aBin = dsBin['time']['reference'].array
+		self.assertEqual(aText[0,0], aBin[0,0])
+
+	def test_das3_header_vals(self):
+		"""Values from headers broadcast over records"""
+		ds = readStream('ex12_sounder_xyz.d3t')[0]
+		self.assertEqual(ds.shape, (3, 160, 80))
+		aFreq = ds['frequency']['center'].array
+		self.assertTrue(numpy.array_equal(aFreq[0,:,0], aFreq[2,:,79]))
+		self.assertEqual(ds['frequency']['center'].unique, [False, True, False])
+		self.assertEqual(ds['altitude']['offset'].unique, [False, False, True])
+
+	def test_text_decode(self):
+		"""Bulk text conversion matches single value conversion"""
+		vd = das2.VarDef(
+			'coord', 'time', 'center', 'UTC', 'f0', (), 0, 'datetime', 'text',
+			None, None
+		)
+		aRaw = numpy.array([
+			b'2017-09-15T10:00:06.003 ', b' 2017-258T10:00:06.003', b'2017-258 ',
+			b'2013-05-21 10:00'
+		], dtype='S24')
+		aOut = das2.builder._decodeText(aRaw, vd)
+		self.assertEqual(aOut.dtype, numpy.dtype('M8[ns]'))
+		for x, t in zip(aRaw, aOut):
+			self.assertEqual(
+				t, numpy.datetime64(str(das2.DasTime(x.decode().strip())), 'ns')
+			)
+
+		vd = vd._replace(sValType='real')
+		aRaw = numpy.array([[b' 1.5e3', b'-2 \n'], [b'+0.25 ', b'7']], dtype='S8')
+		aOut = das2.builder._decodeText(aRaw, vd)
+		self.assertEqual(aOut.tolist(), [[1500.0, -2.0], [0.25, 7.0]])
+
+		vd = vd._replace(sValType='int')
+		aOut = das2.builder._decodeText(aRaw[1:, 1:], vd)
+		self.assertEqual(aOut.tolist(), [[7]])
+
+		with self.assertRaises(ValueError):
+			das2.builder._decodeText(numpy.array([b'1.x'], dtype='S3'), vd)
+
+	def test_ragged(self):
+		"""Variable item counts are kept as flat values plus offsets"""
+		lSweeps = [[1, 2, 3], [4, 5, -1, 6, 7], [], [8.5, 9]]
+		for bText in (False, True):
+			for nRunMax in (16777216, 1):
+				builder = das2.DatasetBuilder(nRunMax=nRunMax)
+				for pkt in das2.PacketReader(BytesIO(raggedStream(lSweeps, bText))):
+					builder.add(pkt)
+				ds = builder.datasets()[0]
+				self.assertEqual(ds.shape, (4, 5))
+
+				var = ds['amplitude']['center']
+				self.assertEqual(var.ragged.offsets.tolist(), [0, 3, 8, 8, 10])
+				self.assertEqual(var.ragged[3].tolist(), [8.5, 9])
+				self.assertEqual(len(var.ragged[2]), 0)
+				self.assertIsNone(var._array)  # Not padded yet
+
+				aPad = var.array
+				self.assertEqual(aPad.shape, (4, 5))
+				self.assertEqual(aPad.mask.sum(), 2 + 5 + 3 + 1)
+				self.assertEqual(aPad[1].compressed().tolist(), [4, 5, 6, 7])
+
+				aTime = ds['time']['center'].array
+				self.assertEqual(aTime.shape, (4, 5))
+				self.assertEqual(aTime[1,0], numpy.datetime64('2000-01-01T00:01', 'ns'))
+
+		with self.assertRaises(das2.DataError):
+			readStream('ex13_object_annotation.d3t')  # Item length is off by one
+
+	def test_ragged_array(self):
+		"""Ragged records are views and slices share values"""
+		ra = das2.RaggedArray.fromLengths(numpy.arange(6.0), [2, 0, 4])
+		self.assertEqual(len(ra), 3)
+		self.assertEqual(ra.lengths().tolist(), [2, 0, 4])
+		self.assertTrue(numpy.shares_memory(ra[2], ra.values))
+		self.assertEqual([len(a) for a in ra], [2, 0, 4])
+
+		ra2 = ra[1:]
+		self.assertEqual(len(ra2), 2)
+		self.assertEqual(ra2[1].tolist(), [2, 3, 4, 5])
+		aPad = ra2.padded(fill=3.0, nWidth=5)
+		self.assertEqual(aPad.shape, (2, 5))
+		self.assertEqual(aPad.compressed().tolist(), [2, 4, 5])
+
+		with self.assertRaises(ValueError):
+			das2.RaggedArray(numpy.arange(3), [0, 2, 1])
+
+	def test_qstream(self):
+		"""QStreams decode with inline DEPEND_1 values from an earlier header"""
+		lRecs = [(60.0*i, [i, 2*i, -1.0e31]) for i in range(5)]
+		for bText in (False, True):
+			fIn = BytesIO(qStream(lRecs, bText))
+			reader = das2.PacketReader(fIn)
+			self.assertEqual(reader.streamType()[0:2], ('q-stream', 'qstream'))
+
+			lDs = das2.read_stream(BytesIO(qStream(lRecs, bText)))
+			self.assertEqual(len(lDs), 1)
+			ds = lDs[0]
+			self.assertEqual(ds.name, 'spec')
+			self.assertEqual(ds.shape, (5, 3))
+			self.assertEqual(ds.props['TITLE'], 'Test Spectra')
+			self.assertEqual(
+				ds['time']['center'].array[2,0], numpy.datetime64('2000-01-01T00:02', 'ns')
+			)
+			self.assertEqual(ds['freq']['center'].array[3].tolist(), [10, 20, 30])
+			self.assertEqual(ds['freq'].props['label'], 'Frequency')
+
+			aSpec = ds['spec']['center'].array
+			self.assertEqual(aSpec[4,1], 8)
+			self.assertEqual(aSpec.mask[:,2].tolist(), [True]*5)
+
+	def test_time_units(self):
+		"""Autoplot style epoch units and TT2000"""
+		vd = das2.VarDef(
+			'coord', 'time', 'center', 'seconds since 2010-01-01T00:00Z', 'f0',
+			(), 0, 'datetime', 'binary', None, None
+		)
+		aOut = das2.builder._decodeBinary(numpy.array([0.0, 90.5]), vd)
+		self.assertEqual(aOut[1], numpy.datetime64('2010-01-01T00:01:30.5', 'ns'))
+
+		vd = vd._replace(sUnits='cdfTT2000')
+		aTT = numpy.array([0, 536500867184000000, 536500869184000000])
+		aOut = das2.builder._decodeBinary(aTT, vd)
+		self.assertEqual(aOut.tolist(), numpy.array([
+			'2000-01-01T11:58:55.816', '2016-12-31T23:59:59', '2017-01-01'
+		], dtype='M8[ns]').tolist())
+
+	def test_das22_ascii_time(self):
+		"""das2.2 ascii planes with epoch units decode to times"""
+		lOut = []
+		def add(sTag, x):
+			x = x.encode('utf-8')
+			lOut.append(('[%s]%06d'%(sTag, len(x))).encode('utf-8') + x)
+		add('00', '<stream version="2.2"/>\n')
+		add('01', '<packet>\n'
+			'  <x type="ascii12" units="t2000"/>\n'
+			'  <y type="ascii10" units="us2000" name="tEvent"/>\n'
+			'  <y type="time24" units="us2000" name="tIso"/>\n'
+			'  <y type="ascii10" units="V" name="amp"/>\n</packet>\n'
+		)
+		for (rT2000, rUs2000, sIso, rAmp) in (
+			(0.0, 1.5e6, '2000-01-01T00:00:02.000', 1.0),
+			(60.25, 61.25e6, '2000-001T00:01:02.250', 2.0)
+		):
+			lOut.append(b':01:' + (
+				'%12.3f%10.1f%24s%9.3f\n'%(rT2000, rUs2000, sIso, rAmp)
+			).encode('utf-8'))
+
+		ds = das2.read_stream(BytesIO(b''.join(lOut)))[0]
+		self.assertEqual(ds['time']['center'].array.tolist(), numpy.array(
+			['2000-01-01T00:00', '2000-01-01T00:01:00.25'], dtype='M8[ns]'
+		).tolist())
+		self.assertEqual(ds['tEvent']['center'].array.tolist(), numpy.array(
+			['2000-01-01T00:00:01.5', '2000-01-01T00:01:01.25'], dtype='M8[ns]'
+		).tolist())
+		self.assertEqual(ds['tIso']['center'].array.tolist(), numpy.array(
+			['2000-01-01T00:00:02', '2000-01-01T00:01:02.25'], dtype='M8[ns]'
+		).tolist())
+		self.assertEqual(ds['tEvent']['center'].units, 'UTC')
+		self.assertEqual(ds['amp']['center'].array.tolist(), [1.0, 2.0])
+
+	def test_projection(self):
+		"""Unselected packet IDs and data dimensions are left out"""
+		lAll = readStream('ex96_yscan_multispec.d2t')
+		sPath = os.path.join(g_sTestDir, 'ex96_yscan_multispec.d2t')
+		with open(sPath, 'rb') as fIn:
+			lDs = das2.read_stream(fIn, ids={2, 5})
+		self.assertEqual([ds.name for ds in lDs], ['amplitude_02', 'amplitude_05'])
+		self.assertTrue(numpy.array_equal(
+			lDs[1]['amplitude']['center'].array, lAll[4]['amplitude']['center'].array
+		))
+
+		lDs = readStream('test_sort.d2t', vars={'amp'})
+		self.assertEqual(list(lDs[1].dData), ['amp'])
+		self.assertEqual(list(lDs[1].dCoord), ['time'])
+		self.assertEqual(lDs[1]['amp']['center'].array[-1], 55)
+
+		lDs = readStream('test_sort.d2t', vars=set())
+		self.assertEqual(len(lDs[0].dData), 0)
+		self.assertEqual(lDs[0].shape, (6, 6))
+
+	def test_skipped(self):
+		"""Skimmed streams are rejected with a DataError"""
+		builder = das2.DatasetBuilder()
+		with open(os.path.join(g_sTestDir, 'ex96_yscan_multispec.d2t'), 'rb') as fIn:
+			with self.assertRaises(das2.DataError):
+				for pkt in das2.PacketReader(fIn, bSkipData=True):
+					builder.add(pkt)
+
+	def test_read_stream(self):
+		"""The top level function handles headers with no data"""
+		with open(os.path.join(g_sTestDir, 'test_read_empty.d2s'), 'rb') as fIn:
+			lDs = das2.read_stream(fIn)
+		for ds in lDs:
+			self.assertEqual(ds.shape[0], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,350 @@
+"""Testing dataset subsets, unions, appends and sorts"""
+
+import os.path
+import unittest
+
+import numpy
+
+import das2
+
+g_sTestDir = os.path.dirname(os.path.abspath(__file__))
+
+def readTest(sFile):
+	with open(os.path.join(g_sTestDir, sFile), 'rb') as fIn:
+		return das2.read_stream(fIn)[0]
+
+def mkBurst(nBeg, lLens):
+	"""Records with a different number of amplitudes each"""
+	ds = das2.Dataset('burst')
+	ds.coord('time').center(numpy.arange(nBeg, nBeg + len(lLens), dtype='f8'), 's')
+	ragged = das2.RaggedArray.fromLengths(
+		numpy.arange(sum(lLens), dtype='f4') + nBeg, lLens
+	)
+	ds.data('amplitude').center(ragged, 'V', fill=-1.0)
+	return ds
+
+def mkSounder():
+	"""Time by pulse frequency by range, out of order in the first two"""
+	ds = das2.Dataset('sounder')
+	time = ds.coord('time')
+	time.reference(['2015-08-27','2015-08-26','2015-08-29','2015-08-26'], 'UTC')
+	time.offset([0,10,20], 'ms', axis=1)
+	ds.coord('pulse_freq').center([4,3,5], 'MHz', axis=1)
+	ds.coord('range').center(numpy.arange(5)*13.71 + 25.10, 'km',  axis=2)
+
+	aAmp = numpy.array([3, 1, 4, 2])[:,None,None]*100 + \
+	       numpy.array([2, 1, 3])[None,:,None]*10 + numpy.arange(1, 6)[None,None,:]
+	ds.data('spec_dens').center(aAmp, 'V**2 m**-2 Hz**-1', fill=0.0)
+	return ds
+
+class DsTestCase(unittest.TestCase):
+	"""Tests that start from a multi-packet spectrogram"""
+
+	def setUp(self):
+		self.ds = readTest('ex96_yscan_multispec.d2t')  # 238 x 119 spectra
+
+class TestSlice(DsTestCase):
+
+	def test_records(self):
+		"""Record subsets are views with the same broadcast structure"""
+		ds = self.ds
+		sub = ds[10:20]
+		self.assertEqual(sub.shape, (10, 119))
+		self.assertEqual(sub.name, ds.name)
+		self.assertEqual(sub.props, ds.props)
+		self.assertEqual(sub['time'].props, ds['time'].props)
+
+		for (sDim, sRole) in (('time','center'), ('frequency','center'), ('amplitude','center')):
+			var = ds[sDim][sRole]
+			varSub = sub[sDim][sRole]
+			self.assertEqual(varSub.unique, var.unique)
+			self.assertEqual(varSub.units, var.units)
+			self.assertIs(varSub.dim, sub[sDim])
+			self.assertTrue(numpy.shares_memory(varSub.array, var.array))
+			self.assertTrue(numpy.array_equal(varSub.array, var.array[10:20]))
+
+		# Broadcast axes still take no memory
+		self.assertEqual(sub['time']['center'].array.strides[1], 0)
+		self.assertEqual(sub['frequency']['center'].array.strides[0], 0)
+		self.assertTrue(isinstance(sub['amplitude']['center'].array, numpy.ma.MaskedArray))
+
+		# The original is untouched
+		self.assertEqual(ds.shape, (238, 119))
+		self.assertEqual(ds['time']['center'].array.shape, (238, 119))
+
+	def test_columns(self):
+		"""Subsets along the second axis and with steps"""
+		ds = self.ds
+		sub = ds[:, 5:10]
+		self.assertEqual(sub.shape, (238, 5))
+		aFreq = ds['frequency']['center'].array
+		self.assertTrue(numpy.array_equal(sub['frequency']['center'].array, aFreq[:, 5:10]))
+
+		sub = ds[::-2, ::3]
+		self.assertEqual(sub.shape, (119, 40))
+		aAmp = ds['amplitude']['center'].array
+		self.assertTrue(numpy.array_equal(sub['amplitude']['center'].array, aAmp[::-2, ::3]))
+
+		self.assertEqual(ds[500:].shape, (0, 119))
+
+		with self.assertRaises(TypeError): ds[3]
+		with self.assertRaises(IndexError): ds[:, :, :]
+
+	def test_ragged(self):
+		"""Ragged values stay compact for record subsets"""
+		ds = mkBurst(0, [3, 0, 5, 1, 2])
+		sub = ds[1:4]
+		var = sub['amplitude']['center']
+		self.assertIsNotNone(var.ragged)
+		self.assertEqual(var.ragged.offsets.tolist(), [3, 3, 8, 9])
+		self.assertTrue(numpy.array_equal(var.array, ds['amplitude']['center'].array[1:4]))
+
+		sub = ds[1:4, 0:2]
+		self.assertEqual(sub['amplitude']['center'].array.shape, (3, 2))
+
+
+class TestUnion(DsTestCase):
+
+	def assertSameValues(self, ds, dsOut):
+		self.assertEqual(dsOut.shape, ds.shape)
+		for sDim in ds:
+			for sRole in ds[sDim]:
+				var = ds[sDim][sRole]
+				varOut = dsOut[sDim][sRole]
+				self.assertEqual(varOut.unique, var.unique)
+				self.assertEqual(varOut.units, var.units)
+				self.assertTrue(numpy.array_equal(varOut.array, var.array))
+
+	def test_broadcast(self):
+		"""Only unique axes are joined, shared values stay broadcast"""
+		ds = self.ds
+		dsOut = das2.ds_union([ds[0:100], ds[100:150], ds[150:]])
+		self.assertSameValues(ds, dsOut)
+
+		self.assertEqual(dsOut['frequency']['center'].array.strides[0], 0)
+		self.assertEqual(dsOut['time']['center'].array.strides[1], 0)
+
+		# Different values in a degenerate axis are joined by record
+		ds2 = ds[0:10]
+		ds2['frequency']['center'].array = ds2['frequency']['center'].array*2
+		dsOut = das2.ds_union([ds[0:10], ds2])
+		var = dsOut['frequency']['center']
+		self.assertEqual(var.unique, [True, True])
+		self.assertTrue(numpy.array_equal(var.array[10:], ds2['frequency']['center'].array))
+
+	def test_chunked(self):
+		"""Chunked unions only join values when they are used"""
+		ds = self.ds
+		lParts = [ds[0:100], ds[100:]]
+		dsOut = das2.ds_union(lParts, bChunked=True)
+
+		var = dsOut['amplitude']['center']
+		self.assertIsNotNone(var.chunked)
+		self.assertEqual(len(var.chunked.chunks), 2)
+		self.assertTrue(numpy.shares_memory(
+			var.chunked.chunks[1], lParts[1]['amplitude']['center'].array
+		))
+		self.assertIn('float64', str(var))
+		self.assertIsNotNone(dsOut['time']['center'].chunked)
+		self.assertIsNone(dsOut['frequency']['center'].chunked)
+
+		# Subsets of whole records keep the chunks
+		sub = dsOut[90:110]
+		self.assertEqual(len(sub['amplitude']['center'].chunked.chunks), 2)
+		self.assertTrue(numpy.array_equal(
+			sub['amplitude']['center'].array, ds['amplitude']['center'].array[90:110]
+		))
+
+		self.assertSameValues(ds, dsOut)
+
+	def test_chunked_array(self):
+		"""Chunked arrays index across chunk boundaries"""
+		a = numpy.arange(20).reshape(10, 2)
+		ca = das2.ChunkedArray([a[0:3], a[3:3], a[3:10]])
+		self.assertEqual(ca.shape, (10, 2))
+		self.assertEqual(len(ca), 10)
+		self.assertEqual(ca[3].tolist(), [6, 7])
+		self.assertEqual(ca[-1].tolist(), [18, 19])
+		self.assertTrue(numpy.array_equal(ca[2:5].concatenate(), a[2:5]))
+		self.assertEqual(len(ca[8:2]), 0)
+		self.assertTrue(numpy.array_equal(numpy.asarray(ca), a))
+		self.assertEqual([r.tolist() for r in ca][4], [8, 9])
+
+		with self.assertRaises(IndexError): ca[10]
+		with self.assertRaises(IndexError): ca[::2]
+		with self.assertRaises(ValueError): das2.ChunkedArray([a, a[:, 0]])
+
+	def test_ragged(self):
+		"""Ragged values are joined without padding"""
+		lDs = [mkBurst(nBeg, [3, 0, 5, 1, 2]) for nBeg in (0, 5)]
+
+		dsOut = das2.ds_union(lDs)
+		var = dsOut['amplitude']['center']
+		self.assertIsNotNone(var.ragged)
+		self.assertEqual(var.ragged.offsets.tolist(),
+		                 [0, 3, 3, 8, 9, 11, 14, 14, 19, 20, 22])
+		self.assertTrue(numpy.array_equal(var.array[5:], lDs[1]['amplitude']['center'].array))
+
+
+class TestAppend(DsTestCase):
+
+	def test_append(self):
+		"""Appended records match the original, shared values stay broadcast"""
+		ds = self.ds
+		live = das2.Dataset('live')
+		for i in range(0, 238, 7): live.append(ds[i:i+7])
+		self.assertEqual(live.shape, ds.shape)
+		self.assertEqual(live.props, ds.props)
+
+		var = live['amplitude']['center']
+		self.assertIsNotNone(var.grow)
+		self.assertTrue(len(var.grow.array) >= 238)
+		self.assertTrue(isinstance(var.array, numpy.ma.MaskedArray))
+		self.assertEqual(var.array.fill_value, ds['amplitude']['center'].array.fill_value)
+		self.assertEqual(live['frequency']['center'].array.strides[0], 0)
+		self.assertEqual(live['time']['center'].array.strides[1], 0)
+
+		live.freeze()
+		self.assertIsNone(var.grow)
+		self.assertEqual(var.array.base.shape, (238, 119))
+		for sDim in ds:
+			for sRole in ds[sDim]:
+				self.assertEqual(live[sDim][sRole].unique, ds[sDim][sRole].unique)
+				self.assertTrue(numpy.array_equal(
+					live[sDim][sRole].array, ds[sDim][sRole].array
+				))
+				self.assertTrue(numpy.array_equal(
+					numpy.ma.getmaskarray(live[sDim][sRole].array),
+					numpy.ma.getmaskarray(ds[sDim][sRole].array)
+				))
+
+		# Appending after a freeze starts new buffers
+		live.append(ds[0:2])
+		self.assertEqual(live.shape, (240, 119))
+		self.assertTrue(numpy.array_equal(
+			live['amplitude']['center'].array[238:], ds['amplitude']['center'].array[0:2]
+		))
+
+	def test_unique(self):
+		"""Values that stop being the same in each record are copied out"""
+		ds = self.ds
+		live = das2.Dataset('live').append(ds[0:10])
+		ds2 = ds[10:20]
+		ds2['frequency']['center'].array = ds2['frequency']['center'].array*2
+		live.append(ds2)
+
+		var = live['frequency']['center']
+		self.assertEqual(var.unique, [True, True])
+		self.assertTrue(numpy.array_equal(var.array[:10], ds['frequency']['center'].array[:10]))
+		self.assertTrue(numpy.array_equal(var.array[10:], ds2['frequency']['center'].array))
+
+	def test_ragged(self):
+		"""Ragged values grow without padding, the widest record sets the shape"""
+		live = mkBurst(0, [3, 0, 2])
+		live.append(mkBurst(3, [1, 5]))
+		self.assertEqual(live.shape, (5, 5))
+
+		var = live['amplitude']['center']
+		self.assertEqual(var.ragged.offsets.tolist(), [0, 3, 3, 5, 6, 11])
+		self.assertEqual(var.ragged[4].tolist(), [4, 5, 6, 7, 8])
+		self.assertEqual(var.array.shape, (5, 5))
+		self.assertEqual(live['time']['center'].array.shape, (5, 5))
+
+		live.freeze()
+		self.assertIsNone(var.grow)
+		self.assertEqual(var.ragged.offsets.tolist(), [0, 3, 3, 5, 6, 11])
+
+	def test_errors(self):
+		"""Records that don't fit are rejected before anything changes"""
+		ds = self.ds
+		live = das2.Dataset('live').append(ds[0:10])
+		with self.assertRaises(das2.DatasetError): live.append(ds[10:20, 0:5])
+		with self.assertRaises(das2.DatasetError): live.append(mkBurst(0, [1]))
+		self.assertEqual(live.shape, (10, 119))
+		self.assertEqual(live['amplitude']['center'].array.shape, (10, 119))
+
+
+class TestSortTake(DsTestCase):
+
+	def test_broadcast(self):
+		"""Degenerate variables are untouched, broadcast axes stay broadcast"""
+		ds = mkSounder()
+		aRange = ds['range']['center'].array
+		ds.sort('time:reference', 'pulse_freq')
+
+		aAmp = ds['spec_dens']['center'].array
+		aExpect = numpy.arange(1, 5)[:,None,None]*100 + \
+		          numpy.arange(1, 4)[None,:,None]*10 + numpy.arange(1, 6)[None,None,:]
+		self.assertTrue(numpy.array_equal(aAmp, aExpect))
+
+		self.assertIs(ds['range']['center'].array, aRange)
+		self.assertEqual(ds['pulse_freq']['center'].array[0,:,0].tolist(), [3, 4, 5])
+		self.assertEqual(ds['pulse_freq']['center'].array.strides[0], 0)
+		self.assertEqual(ds['pulse_freq']['center'].array.strides[2], 0)
+		self.assertEqual(ds['time']['reference'].array.strides[1:], (0, 0))
+		self.assertEqual(ds['time']['offset'].array[0,:,0].tolist(),
+		                 [numpy.timedelta64(10, 'ms'), 0, numpy.timedelta64(20, 'ms')])
+		self.assertEqual(ds['time']['center'].array.strides[2], 0)
+
+	def test_records(self):
+		"""Record sorts of a stream keep frequencies broadcast"""
+		ds = self.ds
+		dsRev = ds[::-1]
+		aOrder = numpy.argsort(dsRev['time']['center'].array[:,0], kind='stable')
+		dExpect = dict(
+			(sDim, dsRev[sDim]['center'].array[aOrder]) for sDim in ('time', 'amplitude')
+		)
+		dsRev.sort('time')
+		for sDim in dExpect:
+			self.assertTrue(numpy.array_equal(dsRev[sDim]['center'].array, dExpect[sDim]))
+		self.assertTrue(numpy.array_equal(
+			dsRev['frequency']['center'].array, ds['frequency']['center'].array
+		))
+		self.assertEqual(dsRev['amplitude']['center'].array.fill_value,
+		                 ds['amplitude']['center'].array.fill_value)
+		self.assertEqual(dsRev['frequency']['center'].array.strides[0], 0)
+		self.assertEqual(dsRev['time']['center'].array.strides[1], 0)
+
+	def test_keys(self):
+		"""Later keys break ties, masked values go last"""
+		ds = das2.Dataset('keys')
+		ds.coord('a').center([2, 1, 2, 1, 0], '')
+		ds.coord('b').center(numpy.ma.masked_values([5, 7, 3, -1, -1], -1), '')
+		ds.data('c').center(numpy.arange(5), '')
+		ds.sort('a', 'b')
+		self.assertEqual(ds['c']['center'].array.tolist(), [4, 1, 3, 2, 0])
+
+		ds.sort('b')
+		self.assertEqual(ds['c']['center'].array.tolist(), [2, 0, 1, 4, 3])
+
+	def test_multi_index(self):
+		"""Keys unique in several axes are sorted together"""
+		ds = das2.Dataset('grid')
+		ds.coord('time').center([1.0, 2.0], 's')
+		ds.coord('chan').center([[3, 1], [2, 0]], '', axis=1)
+		ds.data('amp').center(numpy.arange(8).reshape(2, 2, 2), 'V')
+		ds.sort('chan')
+
+		aChan = ds['chan']['center'].array
+		self.assertEqual(aChan[0].tolist(), [[0, 1], [2, 3]])
+		self.assertEqual(ds['chan']['center'].unique, [False, True, True])
+		self.assertEqual(aChan.strides[0], 0)
+		self.assertEqual(ds['time']['center'].array[:,0,0].tolist(), [1.0, 2.0])
+		self.assertEqual(ds['amp']['center'].array[1].ravel().tolist(), [7, 5, 6, 4])
+
+	def test_ragged(self):
+		"""Ragged records are re-ordered without padding"""
+		ds = das2.Dataset('burst')
+		ds.coord('time').center([3.0, 1.0, 2.0], 's')
+		ragged = das2.RaggedArray.fromLengths(numpy.arange(6, dtype='f4'), [3, 0, 3])
+		ds.data('amplitude').center(ragged, 'V', fill=-1.0)
+		ds.sort('time')
+
+		var = ds['amplitude']['center']
+		self.assertIsNotNone(var.ragged)
+		self.assertEqual(var.ragged.offsets.tolist(), [0, 0, 3, 6])
+		self.assertEqual(var.ragged.values.tolist(), [3, 4, 5, 0, 1, 2])
+
+
+if __name__ == '__main__':
+	unittest.main()
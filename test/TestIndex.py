@@ -0,0 +1,117 @@
+"""Testing sidecar time indexes and time range reads"""
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import das2
+
+g_sTestDir = os.path.dirname(os.path.abspath(__file__))
+
+class TestIndex(unittest.TestCase):
+
+	def setUp(self):
+		self.sTmpDir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.sTmpDir)
+
+	def copyStream(self, sFile):
+		sPath = os.path.join(self.sTmpDir, sFile)
+		shutil.copy(os.path.join(g_sTestDir, sFile), sPath)
+		return sPath
+
+	def test_round_trip(self):
+		"""Saved indexes load back the same and go stale with the file"""
+		sPath = self.copyStream('ex96_yscan_multispec.d2t')
+		idx = das2.write_index(sPath)
+		self.assertEqual(len(idx.aId), 681)
+		self.assertEqual(len(idx.lHdrs), 7)
+
+		idx2 = das2.TimeIndex.load(sPath)
+		self.assertEqual(idx2.sVersion, '2.2')
+		self.assertEqual(idx2.lHdrs, idx.lHdrs)
+		self.assertTrue(numpy.array_equal(idx2.aTime, idx.aTime))
+		self.assertTrue(numpy.array_equal(idx2.aOffset, idx.aOffset))
+
+		with open(sPath, 'ab') as fOut: fOut.write(b'\n')
+		self.assertIsNone(das2.TimeIndex.load(sPath))
+
+	def test_time_range(self):
+		"""Range reads match the same records from a full read"""
+		for sFile, sRole in (
+			('ex96_yscan_multispec.d2t', 'center'),
+			('ex06_waveform_binary.d3b', 'reference')
+		):
+			sPath = self.copyStream(sFile)
+			das2.write_index(sPath)
+
+			with open(sPath, 'rb') as fIn:
+				lAll = das2.read_stream(fIn)
+
+			aAll = lAll[0]['time'][sRole].array
+			aAll = aAll.reshape(aAll.shape[0], -1)[:,0]
+			iBeg = len(aAll)//4
+			beg = aAll[iBeg]
+			end = aAll[len(aAll)//2]
+
+			lDs = das2.read_file(sPath, time=(beg, end))
+			self.assertEqual(len(lDs), len(lAll))
+
+			aRange = lDs[0]['time'][sRole].array
+			aRange = aRange.reshape(aRange.shape[0], -1)[:,0]
+			self.assertEqual(aRange[0], beg)
+			self.assertTrue(aRange[-1] < end)
+			self.assertTrue(numpy.array_equal(
+				aAll[iBeg:iBeg + len(aRange)], aRange
+			))
+
+	def test_out_of_range(self):
+		"""Only records inside the time range are returned"""
+		sPath = self.copyStream('ex96_yscan_multispec.d2t')
+		das2.write_index(sPath)
+
+		lDs = das2.read_time_range(sPath, '2030-01-01', '2031-01-01')
+		self.assertEqual(len(lDs), 6)
+		for ds in lDs: self.assertEqual(ds.shape[0], 0)
+
+		with open(sPath, 'rb') as fIn:
+			lAll = das2.read_stream(fIn)
+		aAll = lAll[0]['time']['center'].array[:,0]
+		beg = aAll[10] + numpy.timedelta64(1, 'ns')
+		end = aAll[20] - numpy.timedelta64(1, 'ns')
+
+		lDs = das2.read_file(sPath, time=(beg, end))
+		self.assertEqual(lDs[0].name, lAll[0].name)
+		aRange = lDs[0]['time']['center'].array[:,0]
+		self.assertTrue(numpy.array_equal(aRange, aAll[(aAll >= beg) & (aAll < end)]))
+		for ds in lDs:
+			if ds.shape[0] == 0: continue
+			aTime = ds['time']['center'].array[:,0]
+			self.assertTrue(aTime.min() >= beg)
+			self.assertTrue(aTime.max() < end)
+
+	def test_filters(self):
+		"""Range reads honor packet ID and variable selections"""
+		sPath = self.copyStream('ex96_yscan_multispec.d2t')
+		das2.write_index(sPath)
+
+		lDs = das2.read_file(sPath, time=('2000-01-01', '2100-01-01'), ids=[3], vars=set())
+		self.assertEqual([ds.name for ds in lDs], ['amplitude_03'])
+		self.assertEqual(len(lDs[0].dData), 0)
+		self.assertIn('time', lDs[0].dCoord)
+
+	def test_no_index(self):
+		"""Range reads work without a sidecar file"""
+		sPath = os.path.join(g_sTestDir, 'test_read_empty.d2s')
+		lDs = das2.read_file(sPath, time=('2017-09-04', '2017-09-05'))
+		self.assertEqual(len(lDs), 1)
+		self.assertEqual(lDs[0].shape[0], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,244 @@
+"""Testing the packet writing helpers"""
+
+import os
+import tempfile
+import unittest
+import struct
+from io import BytesIO, TextIOWrapper
+
+import numpy
+
+import das2
+from das2 import pkt
+
+g_sDas2Hdr = '''<packet>
+  <x type="little_endian_real8" units="us2000"></x>
+  <yscan name="amp" type="little_endian_real4" zUnits="V" yUnits="Hz"
+         nitems="4" yTagMin="10.0" yTagInterval="10.0"></yscan>
+</packet>
+'''
+
+def das2Stream(fWrite):
+	"""Make a das2.2 stream with data packets from a writer function"""
+	fOut = BytesIO()
+	hdr = pkt.HdrBuf(0)
+	hdr.add('<stream version="2.2"></stream>\n')
+	hdr.send(fOut)
+	hdr = pkt.HdrBuf(1)
+	hdr.add(g_sDas2Hdr)
+	hdr.send(fOut)
+	fWrite(fOut)
+	return fOut.getvalue()
+
+g_sDas3Hdr = '''<dataset name="sweeps" rank="2">
+  <xCoord physDim="time">
+    <scalar use="center" units="t2000" valType="real">
+      <packet numItems="1" itemBytes="8" encoding="LEreal"/>
+    </scalar>
+  </xCoord>
+  <data physDim="amplitude">
+    <scalar use="center" units="V" valType="real">
+      <packet numItems="*" itemBytes="4" encoding="LEreal"/>
+    </scalar>
+  </data>
+</dataset>
+'''
+
+def das3Stream(fWrite):
+	"""Make a das3 stream with variable length packets from a writer function"""
+	fOut = BytesIO()
+	hdr = pkt.HdrBuf(0, 'das3')
+	hdr.add('<stream type="das-basic-stream" version="3.0"/>\n')
+	hdr.send(fOut)
+	hdr = pkt.HdrBuf(1, 'das3')
+	hdr.add(g_sDas3Hdr)
+	hdr.send(fOut)
+	pkt.sendComment(fOut, 'log:info', 'a < b', 'TestPkt', sFmt='das3')
+	fWrite(fOut)
+	pkt.sendException(fOut, pkt.EXCEPT_NODATA, 'Nothing more', sFmt='das3')
+	return fOut.getvalue()
+
+class TestPkt(unittest.TestCase):
+
+	def setUp(self):
+		self.aTime = numpy.arange(50, dtype='f8')*1e6
+		self.aAmp = numpy.arange(200, dtype='f4').reshape(50, 4)
+
+	def test_pkt_buf(self):
+		"""Array and list inputs pack the same as single values"""
+		buf = pkt.PktBuf(1)
+		for r in (1.0, 2.5, -3.0): buf.addFloats(r)
+		xOne = buf.lBytes[1:]
+
+		buf = pkt.PktBuf(1)
+		buf.addFloats([1.0, 2.5, -3.0])
+		self.assertEqual(b''.join(buf.lBytes[1:]), b''.join(xOne))
+
+		buf = pkt.PktBuf(1)
+		buf.addDoubles(numpy.array([1.0, 2.5, -3.0]), '>')
+		self.assertEqual(b''.join(buf.lBytes[1:]), struct.pack('>3d', 1.0, 2.5, -3.0))
+		self.assertEqual(buf.length(), 4 + 24)
+
+	def test_columns(self):
+		"""Bulk output matches packet at a time output"""
+		def single(fOut):
+			buf = pkt.PktBuf(1)
+			for i in range(len(self.aTime)):
+				buf.addDoubles(self.aTime[i])
+				buf.addFloats(self.aAmp[i])
+				buf.send(fOut, bFlush=False)
+
+		def bulk(fOut):
+			buf = pkt.PktArrayBuf(1)
+			buf.add(self.aTime[:20], self.aAmp[:20])
+			buf.add(self.aTime[20:], self.aAmp[20:])
+			self.assertEqual(buf.length(), 50*(4 + 8 + 16))
+			buf.send(fOut)
+			self.assertEqual(buf.length(), 0)
+
+		xBulk = das2Stream(bulk)
+		self.assertEqual(xBulk, das2Stream(single))
+
+		lDs = das2.read_stream(BytesIO(xBulk))
+		self.assertTrue(numpy.array_equal(lDs[0]['amp']['center'].array, self.aAmp))
+
+	def test_records(self):
+		"""Structured arrays are written one packet per record, das3 tags
+		carry the record length"""
+		aRecs = numpy.zeros(50, dtype=[('time', '<f8'), ('amp', '<f4', (4,))])
+		aRecs['time'] = self.aTime
+		aRecs['amp'] = self.aAmp
+
+		buf = pkt.PktArrayBuf(2, 'das3')
+		buf.addRecords(aRecs)
+		fOut = BytesIO()
+		buf.send(fOut)
+
+		x = fOut.getvalue()
+		self.assertEqual(len(x), 50*(len(b'|Pd|2|24|') + 24))
+		self.assertEqual(x[:9], b'|Pd|2|24|')
+		self.assertEqual(x[9:33], aRecs[0].tobytes())
+
+		with self.assertRaises(ValueError): pkt.PktArrayBuf(0)
+		with self.assertRaises(ValueError):
+			pkt.PktArrayBuf(1).add(self.aTime, self.aAmp[:10])
+
+
+	def test_das3(self):
+		"""Variable length das3 packets written singly and in bulk match"""
+		aCounts = numpy.array([3, 0, 5, 1], dtype='int32')
+		aTime = 60.0*numpy.arange(4)
+		aValues = numpy.arange(aCounts.sum(), dtype='<f4')
+		lSplit = numpy.split(aValues, numpy.cumsum(aCounts)[:-1])
+
+		def single(fOut):
+			buf = pkt.PktBuf(1, 'das3')
+			for i in range(4):
+				buf.addDoubles(aTime[i])
+				buf.addFloats(lSplit[i])
+				self.assertEqual(buf.length(), len(b'|Pd|1|%d|'%(8+4*aCounts[i])) + 8 + 4*aCounts[i])
+				buf.send(fOut, bFlush=False)
+
+		def ragged(fOut):
+			buf = pkt.PktArrayBuf(1, 'das3')
+			buf.addRagged(aValues[:3], aCounts[:2], aTime[:2])
+			buf.addRagged(aValues[3:], aCounts[2:], aTime[2:])
+			buf.send(fOut)
+
+		def records(fOut):
+			buf = pkt.PktArrayBuf(1, 'das3')
+			buf.addVarRecords(
+				[struct.pack('<d', aTime[i]) + lSplit[i].tobytes() for i in range(4)]
+			)
+			buf.send(fOut)
+
+		xSingle = das3Stream(single)
+		self.assertEqual(das3Stream(ragged), xSingle)
+		self.assertEqual(das3Stream(records), xSingle)
+
+		lPkts = list(das2.PacketReader(BytesIO(xSingle), sValidate='all'))
+		self.assertEqual([p.tag for p in lPkts], ['Sx', 'Hx', 'Cx'] + ['Pd']*4 + ['Ex'])
+		self.assertEqual(lPkts[2].docTree().getroot().text, 'a < b')
+
+		var = das2.read_stream(BytesIO(xSingle))[0]['amplitude']['center']
+		self.assertEqual(var.ragged.offsets.tolist(), [0, 3, 3, 8, 9])
+		self.assertTrue(numpy.array_equal(var.ragged.values, aValues))
+
+		with self.assertRaises(ValueError):
+			pkt.PktArrayBuf(1).addVarRecords([b'12'])
+		with self.assertRaises(ValueError):
+			pkt.PktArrayBuf(1, 'das3').addRagged(aValues, [1, 2])
+
+	def test_stream_writer(self):
+		"""Coalesced output matches direct output"""
+		def single(fOut):
+			buf = pkt.PktBuf(1)
+			for i in range(len(self.aTime)):
+				buf.addDoubles(self.aTime[i])
+				buf.addFloats(self.aAmp[i])
+				buf.send(fOut)
+			pkt.sendComment(fOut, 'log:info', 'done', 'TestPkt')
+
+		xDirect = das2Stream(single)
+		xBody = xDirect[len(das2Stream(lambda fOut: None)):]
+
+		# No file descriptor, nothing is written until the explicit flush
+		fOut = BytesIO()
+		sw = pkt.StreamWriter(fOut)
+		single(sw)
+		self.assertEqual(len(fOut.getvalue()), 0)
+		self.assertEqual(sw.pending(), len(xBody))
+		sw.flush()
+		self.assertEqual(sw.pending(), 0)
+		self.assertEqual(fOut.getvalue(), xBody)
+
+		# Gather writes to a real file, flushed by size
+		with tempfile.TemporaryFile() as fTmp:
+			with pkt.StreamWriter(fTmp, nFlushBytes=256) as sw:
+				self.assertIsNotNone(sw.nFd)
+				hdr = pkt.HdrBuf(0)
+				hdr.add('<stream version="2.2"></stream>\n')
+				hdr.send(sw)
+				hdr = pkt.HdrBuf(1)
+				hdr.add(g_sDas2Hdr)
+				hdr.send(sw)
+				self.assertTrue(os.fstat(fTmp.fileno()).st_size > 0)
+				single(sw)
+				self.assertTrue(sw.pending() < 256)
+
+			fTmp.seek(0)
+			self.assertEqual(fTmp.read(), xDirect)
+
+		# Age limit of zero writes every packet
+		fOut = BytesIO()
+		with pkt.StreamWriter(fOut, rFlushSec=0.0) as sw:
+			buf = pkt.PktArrayBuf(1)
+			buf.add(self.aTime, self.aAmp)
+			buf.send(sw)
+			self.assertEqual(len(fOut.getvalue()), 50*(4 + 8 + 16))
+
+	def test_text_output(self):
+		"""Text already written to a text file stays ahead of packets"""
+		xComment = BytesIO()
+		pkt.sendComment(xComment, 'log:info', 'done', 'TestPkt')
+		xComment = xComment.getvalue()
+
+		fRaw = BytesIO()
+		fText = TextIOWrapper(fRaw, encoding='utf-8')
+		fText.write('before ')
+		pkt.sendComment(fText, 'log:info', 'done', 'TestPkt')
+		fText.write(' after')
+		fText.flush()
+		self.assertEqual(fRaw.getvalue(), b'before ' + xComment + b' after')
+
+		fRaw = BytesIO()
+		fText = TextIOWrapper(fRaw, encoding='utf-8')
+		with pkt.StreamWriter(fText) as sw:
+			fText.write('before ')
+			pkt.sendComment(sw, 'log:info', 'done', 'TestPkt')
+		self.assertEqual(fRaw.getvalue(), b'before ' + xComment)
+
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,8 +1,44 @@
 import sys
+import os
+import gzip
+import tempfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import numpy
 import das2
 
 perr = sys.stderr.write
 
+def sameData(lDs, lDs2):
+	"""True if two dataset lists have the same names, shapes and values"""
+	if [(ds.name, ds.shape) for ds in lDs] != [(ds.name, ds.shape) for ds in lDs2]:
+		return False
+	for (ds, ds2) in zip(lDs, lDs2):
+		for (dDims, dDims2) in ((ds.dCoord, ds2.dCoord), (ds.dData, ds2.dData)):
+			for sDim in dDims:
+				for sRole in dDims[sDim].vars:
+					if not numpy.array_equal(
+						dDims[sDim].vars[sRole].array, dDims2[sDim].vars[sRole].array
+					):
+						return False
+	return True
+
+class GzipHandler(BaseHTTPRequestHandler):
+	"""Serve one gzip content-encoded body for any GET"""
+	xBody = b''
+
+	def do_GET(self):
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/vnd.das2.das2stream')
+		self.send_header('Content-Encoding', 'gzip')
+		self.send_header('Content-Length', str(len(self.xBody)))
+		self.end_headers()
+		self.wfile.write(self.xBody)
+
+	def log_message(self, *args):
+		pass
+
 # Testing low level and high level das2 python data read APIs
 
 def main(argv):
@@ -30,6 +66,38 @@ def main(argv):
 		return 13
 
 
+	# Gzip file round trip, written as a das2.2 stream and read back
+	sFile = 'test/ex96_yscan_multispec.d2t'
+	lExpect = das2.read_file(sFile)
+
+	with tempfile.TemporaryDirectory() as sTmp:
+		sGzFile = os.path.join(sTmp, 'ex96.d2t.gz')
+		with gzip.open(sGzFile, 'wb') as fOut:
+			das2.write_stream(lExpect, fOut, '2.2')
+
+		if not sameData(das2.read_file(sGzFile), lExpect):
+			perr("ERROR: Gzip file round trip changed the data\n")
+			return 13
+
+	# Gzip encoded server response, split into two gzip members
+	with open(sFile, 'rb') as fIn:
+		xData = fIn.read()
+	n = len(xData)//2
+	GzipHandler.xBody = gzip.compress(xData[:n]) + gzip.compress(xData[n:])
+
+	server = HTTPServer(('127.0.0.1', 0), GzipHandler)
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		sGzUrl = 'http://127.0.0.1:%d/ex96'%server.server_address[1]
+		lDs = das2.read_http(sGzUrl)
+	finally:
+		server.shutdown()
+
+	if (lDs is None) or (not sameData(lDs, lExpect)):
+		perr("ERROR: Gzip encoded server response did not match the file\n")
+		return 13
+
 	# Try server read
 
 	sUrl = 'http://planet.physics.uiowa.edu/das/das2Server?server=dataset&'+\
@@ -0,0 +1,470 @@
+"""Testing the pure python packet reader"""
+
+import os.path
+import asyncio
+import unittest
+import tempfile
+import gzip
+import bz2
+import lzma
+from io import BytesIO
+
+import numpy
+from lxml import etree
+
+import das2
+
+g_sTestDir = os.path.dirname(os.path.abspath(__file__))
+
+g_lStreams = [
+	'ex05_waveform_extra.d3t', 'ex06_waveform_binary.d3b',
+	'ex08_dynaspec_namespace.d3t', 'ex12_sounder_xyz.d3t',
+	'ex13_object_annotation.d3t', 'ex14_object_tfcat.d3t',
+	'ex96_yscan_multispec.d2t', 'test_sort.d2t', 'test_read_empty.d2s'
+]
+
+def readAll(fIn, **kwargs):
+	"""Return a list of (tag, id, length, content) tuples from a stream"""
+	reader = das2.PacketReader(fIn, **kwargs)
+	return [(pkt.tag, pkt.id, pkt.length, bytes(pkt.content)) for pkt in reader]
+
+class TestReader(unittest.TestCase):
+
+	def test_chunking(self):
+		"""Buffer refills must not change the packets that are read"""
+		for sFile in g_lStreams:
+			sPath = os.path.join(g_sTestDir, sFile)
+			with open(sPath, 'rb') as fIn:
+				lExpect = readAll(fIn)
+
+			for nChunk in (7, 1000, 65537):
+				with open(sPath, 'rb') as fIn:
+					self.assertEqual(readAll(fIn, nChunk=nChunk), lExpect, sFile)
+
+	def test_offsets(self):
+		"""The reader offset lands at the end of the input"""
+		for sFile in g_lStreams:
+			sPath = os.path.join(g_sTestDir, sFile)
+			with open(sPath, 'rb') as fIn:
+				reader = das2.PacketReader(fIn)
+				for pkt in reader: pass
+				self.assertEqual(reader.nOffset, os.path.getsize(sPath), sFile)
+
+	def test_buffer_reuse(self):
+		"""Buffers are refilled in place unless views into them are held"""
+		sPath = os.path.join(g_sTestDir, 'ex96_yscan_multispec.d2t')
+		with open(sPath, 'rb') as fIn: xData = fIn.read()
+
+		buf = das2.InputBuffer(BytesIO(xData), nChunk=1000)
+		buf.read(600).tobytes()
+		xFirst = buf._xBuf
+		buf.read(600).tobytes()
+		self.assertIs(buf._xBuf, xFirst)
+
+		mvKeep = buf.read(600)
+		xKeep = mvKeep.tobytes()
+		buf.read(600)
+		self.assertIsNot(buf._xBuf, xFirst)
+		self.assertEqual(mvKeep.tobytes(), xKeep)
+
+		# Packets dropped as they are read don't pin their chunks, at most
+		# the current and previous buffers are in use
+		reader = das2.PacketReader(BytesIO(xData), nChunk=1000)
+		lBufs = []
+		for pkt in reader:
+			if not any(x is reader._buf._xBuf for x in lBufs):
+				lBufs.append(reader._buf._xBuf)
+		self.assertLessEqual(len(lBufs), 2)
+
+	def test_non_file(self):
+		"""Inputs without readinto() still work"""
+		class Reader(object):
+			def __init__(self, xData): self.fIn = BytesIO(xData)
+			def read(self, n): return self.fIn.read(min(n, 13))
+
+		sPath = os.path.join(g_sTestDir, 'ex06_waveform_binary.d3b')
+		with open(sPath, 'rb') as fIn: xData = fIn.read()
+
+		self.assertEqual(readAll(Reader(xData)), readAll(BytesIO(xData)))
+
+	def test_mmap(self):
+		"""Memory mapped reads match buffered reads"""
+		for sFile in g_lStreams:
+			sPath = os.path.join(g_sTestDir, sFile)
+			with open(sPath, 'rb') as fIn:
+				lExpect = readAll(fIn)
+			with open(sPath, 'rb') as fIn:
+				self.assertEqual(readAll(fIn, bMmap=True), lExpect, sFile)
+
+	def test_mmap_close(self):
+		"""Closing unmaps the file once no packet views are held"""
+		sPath = os.path.join(g_sTestDir, 'ex96_yscan_multispec.d2t')
+		with open(sPath, 'rb') as fIn:
+			with das2.PacketReader(fIn, bMmap=True) as reader:
+				pkt = reader.packet(-1)
+				self.assertEqual(pkt.tag, 'Pd')
+				with self.assertRaises(BufferError):
+					reader.close()
+
+				# Still usable after a failed close
+				self.assertEqual(bytes(reader.packet(-1).content), bytes(pkt.content))
+				pkt = None
+			self.assertEqual(len(reader._buf.view(0, 100)), 0)
+
+			with das2.MmapBuffer(fIn) as buf:
+				self.assertEqual(buf.read(4).tobytes(), b'[00]')
+			self.assertEqual(buf.avail(), 0)
+
+	def test_random_access(self):
+		"""Packets can be fetched by number and by ID"""
+		for sFile in g_lStreams:
+			sPath = os.path.join(g_sTestDir, sFile)
+			with open(sPath, 'rb') as fIn:
+				lExpect = readAll(fIn)
+
+			with open(sPath, 'rb') as fIn:
+				reader = das2.PacketReader(fIn, bMmap=True)
+
+				# Jump to the end before reading anything
+				pkt = reader.packet(-1)
+				self.assertEqual(
+					(pkt.tag, pkt.id, pkt.length, bytes(pkt.content)), lExpect[-1]
+				)
+
+				lIndex = reader.index()
+				self.assertEqual(len(lIndex), len(lExpect), sFile)
+				self.assertEqual(lIndex[0].offset, 0)
+				for i in range(len(lExpect)):
+					pkt = reader.packet(i)
+					self.assertEqual(
+						(pkt.tag, pkt.id, pkt.length, bytes(pkt.content)), lExpect[i]
+					)
+
+				for nId in set(t[1] for t in lExpect):
+					lPkts = reader.packets(nId)
+					self.assertEqual(
+						len(lPkts), len([t for t in lExpect if t[1] == nId])
+					)
+
+		with open(os.path.join(g_sTestDir, 'test_sort.d2t'), 'rb') as fIn:
+			reader = das2.PacketReader(fIn)
+			with self.assertRaises(ValueError):
+				reader.packet(0)
+
+	def test_hdr_cache(self):
+		"""Data headers arrive parsed and identical headers share a tree"""
+		sPath = os.path.join(g_sTestDir, 'ex96_yscan_multispec.d2t')
+		lTrees = []
+		for i in range(2):
+			with open(sPath, 'rb') as fIn:
+				lHdrs = [p for p in das2.PacketReader(fIn) if p.tag == 'Hx']
+			for pkt in lHdrs:
+				self.assertIsNotNone(pkt.tree)
+				self.assertEqual(pkt.dataLen(), pkt.nDatLen)
+			lTrees.append([pkt.docTree() for pkt in lHdrs])
+
+		for i in range(len(lTrees[0])):
+			self.assertIs(lTrees[0][i], lTrees[1][i])
+
+	def test_validate(self):
+		"""Headers can be checked against the schemas while reading"""
+		for sFile in g_lStreams:
+			if sFile == 'test_read_empty.d2s': continue  # Has a bad exception pkt
+			with open(os.path.join(g_sTestDir, sFile), 'rb') as fIn:
+				lExpect = readAll(fIn)
+			for sMode in ('all', 'once'):
+				with open(os.path.join(g_sTestDir, sFile), 'rb') as fIn:
+					self.assertEqual(readAll(fIn, sValidate=sMode), lExpect, sFile)
+
+		self.assertIs(
+			das2.loadSchema('das-basic-stream', '2.2')[0],
+			das2.loadSchema('das-basic-stream', '2.2')[0]
+		)
+
+		xHdr = b'<stream version="2.2"><bogus/></stream>'
+		xStream = b'[00]%06d'%len(xHdr) + xHdr
+		for sMode in ('all', 'once'):
+			with self.assertRaises(etree.DocumentInvalid):
+				readAll(BytesIO(xStream), sValidate=sMode)
+
+	def test_async(self):
+		"""The asyncio reader returns the same packets"""
+
+		async def readAsync(xData, nPiece):
+			stream = asyncio.StreamReader()
+			for i in range(0, len(xData), nPiece):
+				stream.feed_data(xData[i:i+nPiece])
+			stream.feed_eof()
+
+			reader = das2.AsyncPacketReader(stream, nChunk=nPiece)
+			lPkts = [
+				(pkt.tag, pkt.id, pkt.length, bytes(pkt.content))
+				async for pkt in reader
+			]
+			return (lPkts, reader.nOffset)
+
+		for sFile in g_lStreams:
+			sPath = os.path.join(g_sTestDir, sFile)
+			with open(sPath, 'rb') as fIn: xData = fIn.read()
+			lExpect = readAll(BytesIO(xData))
+
+			for nPiece in (5, 4096):
+				(lPkts, nOffset) = asyncio.run(readAsync(xData, nPiece))
+				self.assertEqual(lPkts, lExpect, sFile)
+				self.assertEqual(nOffset, len(xData), sFile)
+
+		with self.assertRaises(ValueError):
+			asyncio.run(readAsync(xData[:-10], 4096))
+
+		# Compressed streams are decompressed as they arrive
+		sPath = os.path.join(g_sTestDir, 'ex96_yscan_multispec.d2t')
+		with open(sPath, 'rb') as fIn: xData = fIn.read()
+		lExpect = readAll(BytesIO(xData))
+		n = len(xData)//2
+		xTwoGz = gzip.compress(xData[:n]) + gzip.compress(xData[n:])
+		for xComp in (
+			gzip.compress(xData), xTwoGz, bz2.compress(xData), lzma.compress(xData)
+		):
+			for nPiece in (5, 4096):
+				(lPkts, nOffset) = asyncio.run(readAsync(xComp, nPiece))
+				self.assertEqual(lPkts, lExpect)
+				self.assertEqual(nOffset, len(xData))
+
+		with self.assertRaises(EOFError):
+			asyncio.run(readAsync(gzip.compress(xData)[:-20], 4096))
+
+	def test_skip_data(self):
+		"""Skimming gives the same headers, packet counts and offsets"""
+		class Reader(object):
+			def __init__(self, xData): self.fIn = BytesIO(xData)
+			def read(self, n): return self.fIn.read(n)
+
+		for sFile in g_lStreams:
+			sPath = os.path.join(g_sTestDir, sFile)
+			with open(sPath, 'rb') as fIn: xData = fIn.read()
+			lExpect = readAll(BytesIO(xData))
+
+			for cls in (BytesIO, Reader):
+				for nChunk in (7, 1000, 1048576):
+					reader = das2.PacketReader(cls(xData), nChunk=nChunk, bSkipData=True)
+					lPkts = list(reader)
+					self.assertEqual(len(lPkts), len(lExpect), sFile)
+					for pkt, tExpect in zip(lPkts, lExpect):
+						self.assertEqual((pkt.tag, pkt.id, pkt.length), tExpect[:3])
+						if isinstance(pkt, das2.SkippedDataPkt):
+							self.assertIsNone(pkt.content)
+							self.assertEqual(
+								xData[pkt.offset:pkt.offset+pkt.length], tExpect[3]
+							)
+						else:
+							self.assertEqual(bytes(pkt.content), tExpect[3])
+
+		sPath = os.path.join(g_sTestDir, 'ex06_waveform_binary.d3b')
+		with open(sPath, 'rb') as fIn: xData = fIn.read()
+		with self.assertRaises(ValueError):
+			list(das2.PacketReader(BytesIO(xData[:-10]), bSkipData=True))
+
+	def test_id_filter(self):
+		"""Filtered reads give the same packets as filtering afterwards"""
+		sPath = os.path.join(g_sTestDir, 'ex96_yscan_multispec.d2t')
+		with open(sPath, 'rb') as fIn: xData = fIn.read()
+
+		lExpect = [t for t in readAll(BytesIO(xData)) if t[0] == 'Sx' or t[1] in (2, 5)]
+		self.assertEqual(readAll(BytesIO(xData), ids={2, 5}), lExpect)
+		self.assertEqual(readAll(BytesIO(xData), ids={2, 5}, nChunk=100), lExpect)
+
+		with open(sPath, 'rb') as fIn:
+			reader = das2.PacketReader(fIn, bMmap=True, ids=[5])
+			self.assertEqual(len(list(reader)), 1 + 1 + 32)
+			self.assertEqual(len(reader.index()), 7 + 681)  # Index has everything
+
+		async def readAsync():
+			stream = asyncio.StreamReader()
+			stream.feed_data(xData)
+			stream.feed_eof()
+			reader = das2.AsyncPacketReader(stream, ids={2, 5})
+			return [
+				(pkt.tag, pkt.id, pkt.length, bytes(pkt.content))
+				async for pkt in reader
+			]
+		self.assertEqual(asyncio.run(readAsync()), lExpect)
+
+	def test_compressed(self):
+		"""Compressed inputs read the same as the originals"""
+		for sFile in ('ex96_yscan_multispec.d2t', 'ex06_waveform_binary.d3b'):
+			with open(os.path.join(g_sTestDir, sFile), 'rb') as fIn:
+				xData = fIn.read()
+			lExpect = readAll(BytesIO(xData))
+
+			# Two gzip members back to back must read as one stream
+			n = len(xData)//2
+			xTwoGz = gzip.compress(xData[:n]) + gzip.compress(xData[n:])
+
+			for sFormat, xComp in (
+				('gzip', gzip.compress(xData)), ('gzip', xTwoGz),
+				('bz2', bz2.compress(xData)), ('xz', lzma.compress(xData))
+			):
+				self.assertEqual(das2.compression(xComp), sFormat)
+				self.assertEqual(readAll(BytesIO(xComp)), lExpect)
+				self.assertEqual(readAll(BytesIO(xComp), nChunk=1000), lExpect)
+
+				reader = das2.PacketReader(BytesIO(xComp), bSkipData=True)
+				self.assertEqual(
+					[(p.tag, p.id, p.length) for p in reader],
+					[t[:3] for t in lExpect]
+				)
+
+		self.assertIsNone(das2.compression(xData))
+
+		with tempfile.TemporaryDirectory() as sTmp:
+			sPath = os.path.join(sTmp, 'test.d2t.gz')
+			with open(os.path.join(g_sTestDir, 'test_sort.d2t'), 'rb') as fIn:
+				xData = fIn.read()
+			with open(sPath, 'wb') as fOut:
+				fOut.write(gzip.compress(xData))
+
+			with das2.open_stream(sPath) as fIn:
+				self.assertEqual(fIn.read(), xData)
+
+			lDs = das2.read_file(sPath)
+			self.assertEqual([ds.name for ds in lDs], ['amp_01', 'frequency_02'])
+
+			with open(sPath, 'rb') as fIn:
+				with self.assertRaises(ValueError):
+					das2.PacketReader(fIn, bMmap=True)
+
+	def test_merge(self):
+		"""Merged streams are time ordered and keep every packet"""
+		def packets(sFile):
+			with open(os.path.join(g_sTestDir, sFile), 'rb') as fIn:
+				lPkts = list(das2.PacketReader(fIn))
+			for pkt in lPkts:
+				if isinstance(pkt, das2.DataPkt): pkt.content = bytes(pkt.content)
+			return lPkts
+
+		def summary(lPkts):
+			return [(pkt.tag, pkt.id, bytes(pkt.content)) for pkt in lPkts]
+
+		# Alternate data packets split across two sources merge back exactly
+		lPkts = packets('ex06_waveform_binary.d3b')
+		lHdrs = [pkt for pkt in lPkts if not isinstance(pkt, das2.DataPkt)]
+		lData = [pkt for pkt in lPkts if isinstance(pkt, das2.DataPkt)]
+		lMerged = list(das2.merge([lHdrs + lData[1::2], lHdrs + lData[0::2]]))
+		self.assertEqual(summary(lMerged), summary(lPkts))
+
+		# One source per packet ID, each sorted, gives a time sorted stream
+		lPkts = packets('ex96_yscan_multispec.d2t')
+		lOrder = (4, 2, 1, 3, 6, 5)
+		lSources = [
+			[pkt for pkt in lPkts if pkt.tag == 'Sx' or pkt.id == nId]
+			for nId in lOrder
+		]
+		lMerged = list(das2.merge(lSources))
+		self.assertEqual(len(lMerged), len(lPkts))
+
+		builder = das2.DatasetBuilder()
+		lTime = []
+		for pkt in lMerged:
+			builder.add(pkt)
+			if isinstance(pkt, das2.DataPkt):
+				lTime.append(bytes(pkt.content[:24]))  # Text time column
+		self.assertEqual(lTime, sorted(lTime))
+
+		lDs = builder.datasets()
+		self.assertEqual(
+			[ds.name for ds in lDs],
+			['amplitude_01', 'amplitude_02', 'amplitude_03', 'amplitude_04',
+			 'amplitude_05', 'amplitude_06']
+		)
+		builder = das2.DatasetBuilder()
+		for pkt in lPkts: builder.add(pkt)
+		dAll = dict((ds.name, ds) for ds in builder.datasets())
+		for ds, nId in zip(lDs, lOrder):  # Headers are numbered as they arrive
+			dsAll = dAll['amplitude_%02d'%nId]
+			self.assertEqual(ds.shape, dsAll.shape)
+			self.assertTrue(numpy.array_equal(
+				ds['amplitude']['center'].array, dsAll['amplitude']['center'].array
+			))
+
+		# Colliding IDs with different headers are renumbered
+		lMerged = list(das2.merge([packets('ex96_yscan_multispec.d2t'), packets('test_sort.d2t')]))
+		self.assertEqual(
+			sorted(set(pkt.id for pkt in lMerged if pkt.tag == 'Hx')), list(range(1, 9))
+		)
+		self.assertEqual(sum(1 for pkt in lMerged if pkt.tag == 'Sx'), 1)
+
+		with self.assertRaises(ValueError):
+			list(das2.merge([
+				packets('ex96_yscan_multispec.d2t'), packets('ex06_waveform_binary.d3b')
+			]))
+
+	def test_truncated(self):
+		"""Short packets are an error, not a short read"""
+		sPath = os.path.join(g_sTestDir, 'ex06_waveform_binary.d3b')
+		with open(sPath, 'rb') as fIn: xData = fIn.read()
+
+		with self.assertRaises(ValueError):
+			readAll(BytesIO(xData[:-10]))
+
+	def test_document(self):
+		"""XML documents read as packets, one element at a time"""
+		sPath = os.path.join(g_sTestDir, 'ex15_vector_document.d3x')
+		with open(sPath, 'rb') as fIn:
+			lPkts = list(das2.PacketReader(fIn, sValidate='all'))
+		self.assertEqual([p.tag for p in lPkts[:3]], ['Sx', 'Hx', 'Pd'])
+		self.assertEqual(len(lPkts), 74)
+		self.assertTrue(bytes(lPkts[-1].content).endswith(b'E+03;'))
+
+		# Data elements are passed over in skip data mode
+		with open(sPath, 'rb') as fIn:
+			lSkip = list(das2.PacketReader(fIn, bSkipData=True))
+		self.assertEqual(
+			[(p.tag, p.id) for p in lSkip], [(p.tag, p.id) for p in lPkts]
+		)
+		for (pkt, pktSkip) in zip(lPkts, lSkip):
+			if pkt.tag != 'Pd':
+				self.assertEqual(pktSkip.content, pkt.content)
+				continue
+			self.assertIsInstance(pktSkip, das2.SkippedDataPkt)
+			self.assertIsNone(pktSkip.content)
+			# Raw element text, which may lack the final terminator
+			self.assertGreaterEqual(pktSkip.length, pkt.length - 1)
+
+		with open(sPath, 'rb') as fIn:
+			ds = das2.read_stream(fIn)[0]
+		self.assertEqual(ds.shape, (72,))
+		self.assertEqual(ds.props['title'], '4x VMR Stream @ 400 Hz')
+		self.assertEqual(
+			ds['time']['center'].array[1], numpy.datetime64('2022-07-07T19:43:39.54', 'ns')
+		)
+
+		# Consumed elements are dropped as the document is read, only the
+		# parser's read ahead stays in the tree
+		lMax = []
+		for nRecs in (5000, 40000):
+			lRecs = [b'<d id="1">%d;%d</d>'%(i, i*2) for i in range(nRecs)]
+			xDoc = b''.join([
+				b'<?xml version="1.0"?><stream type="das-basic-doc" version="3.0">',
+				b'<dataset name="big" id="1" rank="1"><xCoord physDim="x">',
+				b'<scalar use="center" units="" valType="int"><packet numItems="1"/>',
+				b'</scalar></xCoord><data physDim="y">',
+				b'<scalar use="center" units="" valType="int"><packet numItems="1"/>',
+				b'</scalar></data></dataset>'
+			] + lRecs + [b'</stream>'])
+
+			reader = das2.DocReader(BytesIO(xDoc))
+			builder = das2.DatasetBuilder()
+			nMax = 0
+			for pkt in reader:
+				nMax = max(nMax, len(reader._elRoot))
+				builder.add(pkt)
+			lMax.append(nMax)
+
+			ds = builder.datasets()[0]
+			self.assertEqual(ds['y']['center'].array[-1], (nRecs - 1)*2)
+
+		self.assertLess(lMax[1], 2*lMax[0])
+
+
+if __name__ == '__main__':
+	unittest.main()
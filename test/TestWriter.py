@@ -0,0 +1,136 @@
+"""Testing dataset to stream serialization"""
+
+import os.path
+import unittest
+from io import BytesIO
+
+import numpy
+
+import das2
+
+g_sTestDir = os.path.dirname(os.path.abspath(__file__))
+
+def readTest(sFile):
+	with open(os.path.join(g_sTestDir, sFile), 'rb') as fIn:
+		return das2.read_stream(fIn)[0]
+
+class CountWrites(BytesIO):
+	"""Remember the size of each write"""
+	def __init__(self):
+		BytesIO.__init__(self)
+		self.lWrites = []
+
+	def write(self, x):
+		self.lWrites.append(len(x))
+		return BytesIO.write(self, x)
+
+class TestWriter(unittest.TestCase):
+
+	def assertSameDs(self, ds, ds2):
+		self.assertEqual(ds2.name, ds.name)
+		self.assertEqual(ds2.shape, ds.shape)
+		self.assertEqual(ds2.props, ds.props)
+		for (dDims, dDims2) in ((ds.dCoord, ds2.dCoord), (ds.dData, ds2.dData)):
+			self.assertEqual(sorted(dDims2), sorted(dDims))
+			for sDim in dDims:
+				self.assertEqual(dDims2[sDim].props, dDims[sDim].props)
+				self.assertEqual(sorted(dDims2[sDim].vars), sorted(dDims[sDim].vars))
+				for sRole in dDims[sDim].vars:
+					var = dDims[sDim].vars[sRole]
+					var2 = dDims2[sDim].vars[sRole]
+					self.assertEqual(var2.units, var.units)
+					self.assertEqual(var2.unique, var.unique)
+					self.assertTrue(numpy.array_equal(var2.array, var.array))
+
+	def roundTrip(self, ds, version='3.0', chunk=das2.g_nChunk):
+		fOut = BytesIO()
+		das2.write_stream(ds, fOut, version, chunk)
+		lPkts = list(das2.PacketReader(BytesIO(fOut.getvalue()), sValidate='all'))
+		self.assertEqual(lPkts[0].sver, version[0:3])
+		return (fOut.getvalue(), das2.read_stream(BytesIO(fOut.getvalue()))[0])
+
+	def test_round_trip(self):
+		"""Datasets read back the same from das3 and das2.2 output"""
+		ds = readTest('ex96_yscan_multispec.d2t')
+		self.assertSameDs(ds, self.roundTrip(ds)[1])
+		self.assertSameDs(ds, self.roundTrip(ds, '2.2')[1])
+
+		ds = readTest('ex06_waveform_binary.d3b')
+		self.assertSameDs(ds, self.roundTrip(ds)[1])
+
+	def test_header_values(self):
+		"""Values that don't change by record are only written once"""
+		ds = readTest('ex06_waveform_binary.d3b')
+		(xOut, ds2) = self.roundTrip(ds)
+
+		lPkts = list(das2.PacketReader(BytesIO(xOut)))
+		sHdr = bytes(lPkts[1].content).decode('utf-8')
+		self.assertEqual(sHdr.count('<values>'), 1)
+		self.assertNotIn('use="center"', sHdr.split('</xCoord>')[0])
+
+		# Only the reference time and the waveform are in each packet
+		lData = [p for p in lPkts if p.tag == 'Pd']
+		self.assertEqual(len(lData), 32)
+		self.assertEqual(lData[0].length, 8 + 6144*4)
+
+	def test_chunks(self):
+		"""Records are written a limited number at a time"""
+		ds = readTest('ex96_yscan_multispec.d2t')
+		fOut = CountWrites()
+		das2.write_stream(ds, fOut, chunk=10000)
+		self.assertEqual(len(fOut.lWrites), 2 + 24)
+		self.assertTrue(max(fOut.lWrites) <= 10000)
+
+		fAll = BytesIO()
+		das2.write_stream(ds, fAll)
+		self.assertEqual(fOut.getvalue(), fAll.getvalue())
+
+	def test_ragged(self):
+		"""Ragged values, strings and nanosecond times are kept"""
+		ds = das2.Dataset('burst')
+		aTime = numpy.datetime64('2020-01-01T00:00:00', 'ns') + \
+			numpy.arange(5).astype('m8[s]') + numpy.timedelta64(7, 'ns')
+		ds.coord('time').center(aTime, 'UTC')
+		ragged = das2.RaggedArray.fromLengths(
+			numpy.arange(11, dtype='f4'), [3, 0, 5, 1, 2]
+		)
+		ds.data('amplitude').center(ragged, 'V')
+		ds.data('mode').center(numpy.array(['a', 'bb', 'ccc', u'\xe9', '']), '')
+
+		ds2 = self.roundTrip(ds, chunk=40)[1]
+		var = ds2['amplitude']['center']
+		self.assertTrue(numpy.array_equal(var.ragged.offsets, ragged.offsets))
+		self.assertTrue(numpy.array_equal(var.ragged.values, ragged.values))
+		self.assertTrue(numpy.array_equal(ds2['time']['center'].array[:,0], aTime))
+		self.assertEqual(ds2['mode']['center'].array[:,0].tolist(),
+		                 ['a', 'bb', 'ccc', u'\xe9', ''])
+
+	def test_masked(self):
+		"""Masked values without an explicit fill survive a round trip"""
+		ds = das2.Dataset('masked')
+		ds.coord('time').center(numpy.arange(4, dtype='f8'), 's')
+		ds.coord('frequency').center([10.0, 20.0, 30.0], 'Hz', axis=1)
+		aAmp = numpy.ma.masked_array(
+			numpy.arange(12, dtype='f8').reshape(4, 3),
+			mask=[[0,1,0], [0,0,0], [1,0,0], [0,0,1]]
+		)
+		ds.data('amplitude').center(aAmp, 'V')
+
+		for sVersion in ('3.0', '2.2'):
+			(xOut, ds2) = self.roundTrip(ds, sVersion)
+			self.assertNotIn(b'np.', xOut)
+			aOut = ds2['amplitude']['center'].array
+			self.assertTrue(numpy.array_equal(numpy.ma.getmaskarray(aOut), aAmp.mask))
+			self.assertTrue(numpy.array_equal(aOut.compressed(), aAmp.compressed()))
+
+	def test_errors(self):
+		"""Datasets that don't fit the stream version are rejected up front"""
+		ds = readTest('ex06_waveform_binary.d3b')
+		fOut = BytesIO()
+		with self.assertRaises(ValueError): das2.write_stream(ds, fOut, '2.2')
+		with self.assertRaises(ValueError): das2.write_stream(ds, fOut, '2.3')
+		self.assertEqual(len(fOut.getvalue()), 0)
+
+
+if __name__ == '__main__':
+	unittest.main()